@@ -0,0 +1,159 @@
+"""
+asvがない環境でbenchmarkを実行し、結果をcommitごとに保存・比較する。
+
+    python -m benchmarks run [-b PATTERN] [--quick]
+    python -m benchmarks compare OLD NEW [--threshold 1.1]
+
+runは.benchmarks/<commit>.jsonに保存する。OLD, NEWはcommit(の先頭)またはjsonのpath。
+asvがある場合はasv run / asv continuous / asv compareでも同じbenchmarkを実行できる(asv.conf.json)。
+"""
+import argparse
+import importlib
+import itertools
+import json
+import os
+import pkgutil
+import platform
+import re
+import subprocess
+import sys
+import time
+import timeit
+
+RESULTS_DIR = ".benchmarks"
+PREFIXES = ("time_", "track_")
+
+
+def discover(pattern=None):
+    """(name, class, method, params)を返す。nameはmodule.Class.method(params)"""
+    package = importlib.import_module("benchmarks")
+    for info in sorted(pkgutil.iter_modules(package.__path__), key=lambda info: info.name):
+        if not info.name.startswith("bench_"):
+            continue
+        module = importlib.import_module("benchmarks." + info.name)
+        for class_name, cls in sorted(vars(module).items()):
+            if not isinstance(cls, type) or cls.__module__ != module.__name__:
+                continue
+            for method in sorted(name for name in dir(cls) if name.startswith(PREFIXES)):
+                for params in expand(getattr(cls, "params", [])):
+                    name = "%s.%s.%s(%s)" % (info.name, class_name, method, ", ".join(map(repr, params)))
+                    if pattern is None or re.search(pattern, name):
+                        yield name, cls, method, params
+
+
+def expand(params):
+    if not params:
+        return [()]
+    if not isinstance(params[0], list):
+        params = [params]
+    return list(itertools.product(*params))
+
+
+def measure(cls, method, params, repeat, min_time):
+    """time_は1回あたりの秒数(repeat回の中央値)、track_は返り値"""
+    instance = cls()
+    if hasattr(instance, "setup"):
+        instance.setup(*params)
+    try:
+        func = getattr(instance, method)
+        if method.startswith("track_"):
+            return func(*params)
+        timer = timeit.Timer(lambda: func(*params))
+        number = 1
+        while timer.timeit(number) < min_time and number < 1 << 20:
+            number *= 2
+        samples = sorted(t / number for t in timer.repeat(repeat, number))
+        return samples[len(samples) // 2]
+    finally:
+        if hasattr(instance, "teardown"):
+            instance.teardown(*params)
+
+
+def commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(args):
+    repeat, min_time = (3, 0.01) if args.quick else (7, 0.05)
+    results = {}
+    for name, cls, method, params in discover(args.bench):
+        start = time.perf_counter()
+        try:
+            results[name] = measure(cls, method, params, repeat, min_time)
+        except Exception as e:
+            print("%-72s failed: %r" % (name, e), file=sys.stderr)
+            continue
+        value = results[name]
+        shown = "%10.3f ms" % (value * 1e3) if method.startswith("time_") else "%13s" % value
+        print("%-72s %s  (%.1fs)" % (name, shown, time.perf_counter() - start))
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    revision = commit()
+    path = os.path.join(RESULTS_DIR, "%s.json" % revision[:12])
+    existing = load(path)["results"] if os.path.exists(path) else {}
+    existing.update(results)
+    document = {
+        "commit": revision,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": existing,
+    }
+    with open(path, "w") as f:
+        json.dump(document, f, indent=1, sort_keys=True)
+    print("saved %d results to %s" % (len(results), path))
+
+
+def load(ref):
+    path = ref
+    if not os.path.exists(path):
+        matches = [name for name in os.listdir(RESULTS_DIR) if name.startswith(ref[:12])]
+        if len(matches) != 1:
+            raise SystemExit("no unique result for %r in %s" % (ref, RESULTS_DIR))
+        path = os.path.join(RESULTS_DIR, matches[0])
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(args):
+    old, new = load(args.old)["results"], load(args.new)["results"]
+    regressions = 0
+    print("%-72s %12s %12s %8s" % ("benchmark", "old", "new", "ratio"))
+    for name in sorted(set(old) & set(new)):
+        if not isinstance(old[name], (int, float)) or not old[name]:
+            continue
+        ratio = new[name] / old[name]
+        mark = ""
+        if ratio > args.threshold:
+            mark, regressions = " slower", regressions + 1
+        elif ratio < 1 / args.threshold:
+            mark = " faster"
+        if mark or not args.only_changed:
+            print("%-72s %12.6g %12.6g %8.2f%s" % (name, old[name], new[name], ratio, mark))
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("-b", "--bench", help="regular expression to select benchmarks")
+    run_parser.add_argument("--quick", action="store_true", help="fewer and shorter repeats")
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=1.1)
+    compare_parser.add_argument("--only-changed", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Whim, Qash, BayerFilterのbenchmark。
+"""
+from misqr.whim import Whim
+from misqr.qash import Qash, QashVariants
+from misqr.util.filter import BayerFilter
+from misqr.util.constants import W, K
+import numpy as np
+
+DATA = "toshs.github.io/misqr//a.html"
+
+
+class TimeWhim:
+    params = [[4, 10, 25, 40]]
+    param_names = ["version"]
+    timeout = 120
+
+    def setup(self, version):
+        self.whim = Whim(DATA, version, 3)
+
+    def time_search_similar_qr(self, version):
+        self.whim.search_similar_qr(-6)
+
+
+class TimeQash:
+    params = [[4, 10, 25]]
+    param_names = ["version"]
+
+    def setup(self, version):
+        self.qash = Qash(DATA, version, 3, seed=0)
+        self.pixel = BayerFilter.tile([[W, K], [K, K]], self.qash.box_size // 2, self.qash.box_size // 2)
+
+    def time_construction(self, version):
+        Qash(DATA, version, 3, seed=0)
+
+    def time_false_pattern(self, version):
+        self.qash.set_false_pattern(self.pixel)
+
+    def time_variants(self, version):
+        QashVariants(DATA, version, 3, seed=0).generate(64)
+
+
+class TimeBayerFilter:
+    params = [[50, 200, 1000]]
+    param_names = ["size"]
+
+    def setup(self, size):
+        self.filter = BayerFilter(size, size)
+        self.filter.makeBayerFilter()
+        self.pix = np.asarray(BayerFilter.pix, dtype=np.uint8)
+
+    def time_generate(self, size):
+        # bypass the tile cache to time the generation itself
+        BayerFilter._tile.__wrapped__(self.pix.tobytes(), self.pix.shape, size, size, 1)
+
+    def time_image(self, size):
+        self.filter.makeImage()
+
+
+class TimeDemosaic:
+    params = [[200, 1000], ["bilinear", "mhc"]]
+    param_names = ["size", "method"]
+
+    def setup(self, size, method):
+        self.filter = BayerFilter(size, size)
+        self.filter.makeBayerFilter()
+        self.bayerfilter = self.filter.bayerfilter
+
+    def time_demosaic(self, size, method):
+        self.filter.bayerfilter = self.bayerfilter
+        self.filter.demosaic(method)
@@ -0,0 +1,94 @@
+"""
+QRとQRBuilderで、1シンボルあたりのメモリ確保(tracemalloc)と生成時間を比べる。
+
+    python -m benchmarks.bench_builder
+"""
+from misqr.util.builder import QRBuilder
+from misqr.util.qr import QR
+import time
+import tracemalloc
+import numpy as np
+
+CONFIGS = [(1, 0), (10, 3), (40, 3)]
+
+
+def payloads(capacity, n):
+    return ["%0*d" % (capacity // 2, i) for i in range(n)]
+
+
+def allocations(encode, datas):
+    """datasを順に符号化したときの、1シンボルあたりの(確保回数, 確保byte数)を返す"""
+    encode(datas[0])  # warm up caches and buffers
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+    for data in datas:
+        encode(data)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "traceback")
+    count = sum(max(stat.count_diff, 0) for stat in stats)
+    size = sum(max(stat.size_diff, 0) for stat in stats)
+    return count / len(datas), size / len(datas)
+
+
+def peak(encode, datas):
+    """1シンボルあたりの一時的な確保量の最大値[byte]"""
+    encode(datas[0])
+    tracemalloc.start()
+    peaks = []
+    for data in datas:
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        encode(data)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+    return max(peaks)
+
+
+def seconds(encode, datas):
+    start = time.perf_counter()
+    for data in datas:
+        encode(data)
+    return (time.perf_counter() - start) / len(datas)
+
+
+class TrackBuilderAllocations:
+    params = [CONFIGS]
+    param_names = ["config"]
+
+    def setup(self, config):
+        version, ecl = config
+        self.builder = QRBuilder(version, ecl)
+        self.datas = payloads(self.builder.capacity, 20)
+
+    def track_peak_bytes_builder(self, config):
+        return peak(self.builder.encode, self.datas)
+
+    def track_peak_bytes_qr(self, config):
+        version, ecl = config
+        return peak(lambda data: QR(data, version, ecl), self.datas)
+
+    def time_builder(self, config):
+        for data in self.datas:
+            self.builder.encode(data)
+
+
+def main():
+    print("%-8s %-8s %14s %14s %12s" % ("config", "api", "peak B/symbol", "retained B", "ms/symbol"))
+    for version, ecl in CONFIGS:
+        builder = QRBuilder(version, ecl)
+        datas = payloads(builder.capacity, 50)
+        out = np.empty((builder.w, builder.w), dtype=np.uint8)
+        apis = [
+            ("QR", lambda data: QR(data, version, ecl).masked_matrix),
+            ("builder", lambda data: builder.encode(data, out)),
+        ]
+        for name, encode in apis:
+            retained = allocations(encode, datas)[1]
+            print("%-8s %-8s %14d %14d %12.3f" % (
+                "%d-%d" % (version, ecl), name, peak(encode, datas), retained, seconds(encode, datas) * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+whimq, qashのimport時間(python -X importtime)を測り、予算を超えていないかを調べる。
+
+numpyのimport時間は環境によって大きく変わるので、予算はnumpyを除いたmisqr自身の分に対して設ける。
+また、PIL, qrcode, scipyが起動時にimportされていないことを確認する。
+TrackFirstSymbolは、新しいprocessで最初のシンボルを作るまでの時間をartifactファイルの有無で比べる。
+
+    python -m benchmarks.bench_import [--budget-ms 30] [--repeat 5]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ENTRY_POINTS = {"whimq": "misqr.whim", "qash": "misqr.qash"}
+DEFERRED = ("PIL", "qrcode", "scipy")
+BUDGET_MS = 30
+
+
+def _environment(**overrides):
+    # measure with bytecode caching as an installed package would have it
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    env.update(overrides)
+    return env
+
+
+def import_times(module):
+    """-X importtimeの出力から、moduleごとの累積import時間[us]を返す"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import %s" % module],
+                            capture_output=True, text=True, env=_environment(), check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def measure(module, repeat=5):
+    """(全体, numpy, misqr自身)のimport時間[ms]。repeat回の最小値"""
+    import_times(module)  # write the bytecode caches first
+    samples = []
+    for _ in range(repeat):
+        times = import_times(module)
+        total = times[module] / 1000
+        numpy = times.get("numpy", 0) / 1000
+        samples.append((total, numpy, total - numpy))
+    return min(samples, key=lambda sample: sample[0])
+
+
+def deferred_imports(module):
+    """moduleのimportで読み込まれてしまったDEFERREDのmodule"""
+    code = "import sys, %s; print(' '.join(m for m in %r if m in sys.modules))" % (module, DEFERRED)
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=_environment(), check=True)
+    return result.stdout.split()
+
+
+class TrackImportTime:
+    params = [list(ENTRY_POINTS)]
+    param_names = ["entry_point"]
+    unit = "ms"
+
+    def track_total(self, entry_point):
+        return measure(ENTRY_POINTS[entry_point], repeat=3)[0]
+
+    def track_without_numpy(self, entry_point):
+        return measure(ENTRY_POINTS[entry_point], repeat=3)[2]
+
+
+FIRST_SYMBOL = """
+import time
+from misqr.util.builder import QRBuilder
+start = time.perf_counter()
+QRBuilder(%d, 3, 0).encode("misqr")
+print((time.perf_counter() - start) * 1000)
+"""
+
+
+def first_symbol_ms(version, artifacts=True):
+    """新しいprocessでversionの最初のシンボルを作るまでの時間[ms](importは含めない)"""
+    env = _environment() if artifacts else _environment(MISQR_ARTIFACTS="")
+    result = subprocess.run([sys.executable, "-c", FIRST_SYMBOL % version], capture_output=True, text=True, env=env, check=True)
+    return float(result.stdout)
+
+
+class TrackFirstSymbol:
+    params = [[10, 40], [True, False]]
+    param_names = ["version", "artifacts"]
+    unit = "ms"
+
+    def track_first_symbol(self, version, artifacts):
+        return first_symbol_ms(version, artifacts)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_import")
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS, help="budget for misqr's own imports")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+    print("%-8s %-12s %10s %10s %10s %8s  %s" % ("script", "module", "total", "numpy", "misqr", "budget", "deferred loaded"))
+    for script, module in ENTRY_POINTS.items():
+        total, numpy, own = measure(module, args.repeat)
+        loaded = deferred_imports(module)
+        ok = own <= args.budget_ms and not loaded
+        failed |= not ok
+        print("%-8s %-12s %8.1fms %8.1fms %8.1fms %6.0fms  %s %s" % (
+            script, module, total, numpy, own, args.budget_ms, " ".join(loaded) or "-", "ok" if ok else "OVER"))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+保持しているQRオブジェクト1つあたりのメモリ(tracemalloc)を測る。
+PILの画像のピクセルはtracemallocの外で確保されるので、imageの分(w * w * 3 byte)は含まない。
+
+    python -m benchmarks.bench_memory
+"""
+from misqr.util.qr import QR
+import tracemalloc
+
+CONFIGS = [(2, 3), (10, 3), (40, 3)]
+N = 50
+
+
+def retained(build, n=N):
+    """build()の結果をn個保持したときの1つあたりの確保量[byte]"""
+    build(0)  # warm up caches
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [build(i) for i in range(n)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return (after - before) / n
+
+
+def builders(version, ecl):
+    data = "%d" % version * (version * 4)
+    return [
+        ("full", lambda i: QR(data + str(i), version, ecl)),
+        ("full+image", lambda i: _with_image(QR(data + str(i), version, ecl))),
+        ("slim", lambda i: QR(data + str(i), version, ecl, keep_intermediates=False)),
+    ]
+
+
+def _with_image(qr):
+    qr.image
+    return qr
+
+
+class TrackMemory:
+    params = [CONFIGS]
+    param_names = ["config"]
+
+    def track_bytes_full(self, config):
+        return retained(builders(*config)[0][1])
+
+    def track_bytes_slim(self, config):
+        return retained(builders(*config)[2][1])
+
+
+def main():
+    print("%-8s %-12s %14s" % ("config", "object", "B/symbol"))
+    for version, ecl in CONFIGS:
+        for name, build in builders(version, ecl):
+            print("%-8s %-12s %14d" % ("%d-%d" % (version, ecl), name, retained(build)))
+
+
+if __name__ == "__main__":
+    main()
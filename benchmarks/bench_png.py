@@ -0,0 +1,112 @@
+"""
+PNGの書き出しのbenchmark。PILでRGBのまま保存する場合と、PNGEncoderの1bit・パレットのPNGを比べる。
+
+    python -m benchmarks.bench_png [--n 64] [--box-size 10] [--workers 4]
+"""
+from misqr.util.qr import QR
+from misqr.util.cache import render
+from misqr.util.png import PNGEncoder, FILTERS, STRATEGIES
+from misqr.whim import Whim
+import argparse
+import io
+import time
+
+VERSION, LEVEL = 10, 3
+
+
+def payloads(n):
+    return ["toshs.github.io/misqr/%06d" % i for i in range(n)]
+
+
+def pil_png(image, box_size, border, level=6):
+    buffer = io.BytesIO()
+    render(image, box_size, border).save(buffer, format="PNG", compress_level=level)
+    return buffer.getvalue()
+
+
+class TimePNG:
+    params = [[1, 4, 10], list(FILTERS)]
+    param_names = ["box_size", "filter"]
+
+    def setup(self, box_size, filter):
+        self.qr = QR(payloads(1)[0], VERSION, LEVEL)
+        self.image = self.qr.image
+        self.encoder = PNGEncoder(filter=filter)
+
+    def time_pil_rgb(self, box_size, filter):
+        pil_png(self.image, box_size, 4)
+
+    def time_modules(self, box_size, filter):
+        self.encoder.encode_modules(self.qr.masked_matrix, box_size, 4)
+
+    def time_image(self, box_size, filter):
+        self.encoder.encode_image(self.image, box_size, 4)
+
+    def track_bytes(self, box_size, filter):
+        return len(self.encoder.encode_modules(self.qr.masked_matrix, box_size, 4))
+
+
+class TimeEncodeAll:
+    params = [[1, 2, 4]]
+    param_names = ["workers"]
+    n = 32
+
+    def setup(self, workers):
+        self.matrices = [QR(data, VERSION, LEVEL).masked_matrix for data in payloads(self.n)]
+        self.encoder = PNGEncoder(workers=workers)
+
+    def time_encode_all(self, workers):
+        self.encoder.encode_all(self.matrices, 10, 4, modules=True)
+
+
+def measure(run, items, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        sizes = [len(run(item)) for item in items]
+        samples.append(time.perf_counter() - start)
+    return min(samples) / len(items) * 1000, sum(sizes) / len(sizes)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_png")
+    parser.add_argument("--n", type=int, default=64)
+    parser.add_argument("--box-size", type=int, default=10)
+    parser.add_argument("--border", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    box, border = args.box_size, args.border
+    symbols = [QR(data, VERSION, LEVEL) for data in payloads(args.n)]
+    print("%d symbols of version %d, box %d, border %d" % (args.n, VERSION, box, border))
+    print("%-34s %10s %10s" % ("encoder", "ms/image", "bytes"))
+    for level in (1, 6, 9):
+        print("%-34s %10.3f %10.0f" % (("PIL RGB level %d" % level,) + measure(
+            lambda qr: pil_png(qr.image, box, border, level), symbols, args.repeat)))
+    for level in (1, 6, 9):
+        for filter in FILTERS:
+            for strategy in STRATEGIES:
+                encoder = PNGEncoder(level, filter, strategy)
+                print("%-34s %10.3f %10.0f" % (("1-bit level %d %s %s" % (level, filter, strategy),) + measure(
+                    lambda qr: encoder.encode_modules(qr.masked_matrix, box, border), symbols, args.repeat)))
+
+    whim = Whim("toshs.github.io/misqr/a.html", 4, 3)
+    options = list(whim.search_similar_qr(-6).values())
+    print("%-34s %10.3f %10.0f" % (("Whim PIL RGB",) + measure(lambda image: pil_png(image, box, border), options, args.repeat)))
+    print("%-34s %10.3f %10.0f" % (("Whim palette",) + measure(
+        lambda image: PNGEncoder().encode_image(image, box, border), options, args.repeat)))
+
+    matrices = [qr.masked_matrix for qr in symbols]
+    for workers in sorted({1, args.workers}):
+        encoder = PNGEncoder(workers=workers)
+        start = time.perf_counter()
+        results = encoder.encode_all(matrices, box, border, modules=True)
+        elapsed = time.perf_counter() - start
+        print("encode_all %d threads: %.3f ms/image wall, %.3f ms/image each, %d bytes total"
+              % (workers, elapsed / len(results) * 1000, sum(r.ms for r in results) / len(results),
+                 sum(r.nbytes for r in results)))
+
+
+if __name__ == "__main__":
+    main()
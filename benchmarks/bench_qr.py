@@ -0,0 +1,94 @@
+"""
+QRコードの生成(全160通りのバージョン・誤り訂正レベル)、誤り訂正符号、マスク、描画のbenchmark。
+"""
+from misqr.util.qr import QR
+from misqr.util.block import Block
+from misqr.util.builder import QRBuilder
+from misqr.util.capacity import capacity
+from misqr.util.cache import render
+from misqr.util.layout import get_layout
+from misqr.util import placement
+import io
+
+VERSIONS = list(range(1, 41))
+LEVELS = [QR.ERROR_CORRECT_L, QR.ERROR_CORRECT_M, QR.ERROR_CORRECT_Q, QR.ERROR_CORRECT_H]
+BYTE_MODE = 0b0100
+
+# (data codewords, error codewords) of every block size in the standard
+BLOCK_SHAPES = sorted({(int(data), get_layout(version, ecl).error_code_length)
+                       for version in VERSIONS for ecl in LEVELS
+                       for data in get_layout(version, ecl).data_lengths})
+
+
+def payload(version, ecl, fill=0.5):
+    """容量のfill倍の長さのデータ"""
+    return "a" * max(1, int(capacity(version, ecl, BYTE_MODE) * fill))
+
+
+class TimeConstruction:
+    params = [VERSIONS, LEVELS]
+    param_names = ["version", "ecl"]
+
+    def setup(self, version, ecl):
+        self.data = payload(version, ecl)
+        self.builder = QRBuilder(version, ecl)
+
+    def time_qr(self, version, ecl):
+        QR(self.data, version, ecl)
+
+    def time_builder(self, version, ecl):
+        self.builder.encode(self.data)
+
+
+class TimeReedSolomon:
+    params = [BLOCK_SHAPES]
+    param_names = ["block"]
+
+    def setup(self, block):
+        data, _ = block
+        self.block = Block(list(range(data)))
+
+    def time_block(self, block):
+        self.block.calculate_error_correction_code(block[1])
+
+
+class TimeBuilderReedSolomon:
+    params = [[1, 10, 25, 40], LEVELS]
+    param_names = ["version", "ecl"]
+
+    def setup(self, version, ecl):
+        self.builder = QRBuilder(version, ecl)
+        self.builder.encode_data_code(payload(version, ecl).encode("utf-8"))
+
+    def time_all_blocks(self, version, ecl):
+        self.builder.encode_error_code()
+
+
+class TimeMask:
+    params = [[2, 10, 40], list(range(8))]
+    param_names = ["version", "mask"]
+
+    def setup(self, version, mask):
+        self.qr = QR(payload(version, 3), version, 3, mask)
+
+    def time_mask(self, version, mask):
+        self.qr.mask(mask)
+
+    def time_mask_plane(self, version, mask):
+        placement.mask_plane.__wrapped__(version, mask)
+
+
+class TimeRender:
+    params = [[2, 10, 40], [1, 4, 10, 20]]
+    param_names = ["version", "box_size"]
+
+    def setup(self, version, box_size):
+        self.qr = QR(payload(version, 3), version, 3)
+        self.matrix = self.qr.masked_matrix
+        self.image = self.qr.make_image(self.matrix, self.qr.color)
+
+    def time_make_image(self, version, box_size):
+        render(self.qr.make_image(self.matrix, self.qr.color), box_size)
+
+    def time_png(self, version, box_size):
+        render(self.image, box_size).save(io.BytesIO(), format="PNG")
@@ -0,0 +1,91 @@
+"""
+複数processのバッチ生成で、結果をpickleして返す場合と共有メモリに書き込む場合を比べる。
+
+    python -m benchmarks.bench_shared [--n 2000] [--workers 2]
+"""
+from misqr.util import shared
+from misqr.util.workers import process_pool
+import argparse
+import time
+import numpy as np
+
+VERSION, LEVEL = 10, 3
+
+
+def payloads(n):
+    return ["toshs.github.io/misqr/%06d" % i for i in range(n)]
+
+
+def encode_pickled(datas, version, error_correct_level, box_size, border):
+    """workerで符号化・拡大し、配列をそのまま返す(pickleされて親に送られる)"""
+    from misqr.util.builder import QRBuilder
+    builder = QRBuilder.pooled(version, error_correct_level)
+    size = shared.raster_size(version, box_size, border)
+    out = np.empty((len(datas), size, size), dtype=np.uint8)
+    for data, raster in zip(datas, out):
+        shared.scale_into(builder.encode(data), raster, box_size, border)
+    return out
+
+
+def pickled(pool, datas, box_size, border, workers):
+    chunks = shared._chunks(len(datas), workers)
+    futures = [pool.submit(encode_pickled, datas[start:start + n], VERSION, LEVEL, box_size, border)
+               for start, n in chunks]
+    return np.concatenate([future.result() for future in futures])
+
+
+def through_shared_memory(pool, datas, box_size, border, workers):
+    with shared.generate(datas, VERSION, LEVEL, box_size=box_size, border=border, executor=pool,
+                         chunk=shared._chunks(len(datas), workers)[0][1]) as batch:
+        return int(batch.array[:, 0, 0].sum())
+
+
+class TimeBatchTransfer:
+    params = [[1, 4]]
+    param_names = ["box_size"]
+    workers = 2
+    n = 1000
+
+    def setup(self, box_size):
+        self.pool = process_pool(self.workers)
+        self.datas = payloads(self.n)
+        through_shared_memory(self.pool, self.datas[:self.workers], box_size, 0, self.workers)  # start the workers
+
+    def teardown(self, box_size):
+        self.pool.shutdown()
+
+    def time_pickled(self, box_size):
+        pickled(self.pool, self.datas, box_size, 4 if box_size > 1 else 0, self.workers)
+
+    def time_shared_memory(self, box_size):
+        through_shared_memory(self.pool, self.datas, box_size, 4 if box_size > 1 else 0, self.workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_shared")
+    parser.add_argument("--n", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    datas = payloads(args.n)
+    print("%d symbols of version %d, %d workers" % (args.n, VERSION, args.workers))
+    print("%-8s %12s %14s %14s" % ("box", "MB", "pickled[ms]", "shared[ms]"))
+    with process_pool(args.workers) as pool:
+        through_shared_memory(pool, datas[:args.workers], 1, 0, args.workers)
+        for box_size in (1, 4, 8):
+            border = 4 if box_size > 1 else 0
+            size = shared.raster_size(VERSION, box_size, border)
+            results = []
+            for run in (pickled, through_shared_memory):
+                samples = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    run(pool, datas, box_size, border, args.workers)
+                    samples.append(time.perf_counter() - start)
+                results.append(min(samples) * 1000)
+            print("%-8d %12.1f %14.1f %14.1f" % (box_size, args.n * size * size / 1e6, *results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+thread poolで同時に生成したときのthroughputのbenchmark。
+
+QR, Qashの生成は共有する表を読むだけで、重い処理(誤り訂正符号・配置・マスク)はGILを解放するNumPyの演算なので、
+CPUが複数あればthread数とともにthroughputが上がる。
+
+    python -m benchmarks.bench_threads [--n 400] [--threads 1,2,4,8]
+"""
+from misqr.util.qr import QR
+from misqr.util.builder import QRBuilder
+from misqr.qash import Qash
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import os
+import time
+
+VERSION, LEVEL = 25, 3
+
+
+def payloads(n):
+    return ["toshs.github.io/misqr/%06d" % i for i in range(n)]
+
+
+def build_qr(data):
+    return QR(data, VERSION, LEVEL, keep_intermediates=False)
+
+
+def build_builder(data):
+    return QRBuilder.pooled(VERSION, LEVEL).encode(data)
+
+
+def build_qash(data):
+    return Qash(data, VERSION, box_size=1, seed=0).qr.masked_matrix
+
+
+WORKLOADS = {"qr": build_qr, "builder": build_builder, "qash": build_qash}
+
+
+def run(pool, workload, datas):
+    for _ in pool.map(WORKLOADS[workload], datas):
+        pass
+
+
+class TimeThreads:
+    params = [list(WORKLOADS), [1, 2, 4]]
+    param_names = ["workload", "threads"]
+    n = 64
+
+    def setup(self, workload, threads):
+        self.pool = ThreadPoolExecutor(threads)
+        self.datas = payloads(self.n)
+        run(self.pool, workload, self.datas[:threads])  # start the threads
+
+    def teardown(self, workload, threads):
+        self.pool.shutdown()
+
+    def time_threads(self, workload, threads):
+        run(self.pool, workload, self.datas)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_threads")
+    parser.add_argument("--n", type=int, default=400)
+    parser.add_argument("--threads", default="1,2,4,8")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    counts = [int(t) for t in args.threads.split(",")]
+    datas = payloads(args.n)
+    print("%d symbols of version %d, %d CPUs" % (args.n, VERSION, os.cpu_count() or 1))
+    print("%-8s" % "workload" + "".join("%12s" % ("%d thr/s" % t) for t in counts) + "%10s" % "scaling")
+    for workload in WORKLOADS:
+        rates = []
+        for threads in counts:
+            with ThreadPoolExecutor(threads) as pool:
+                run(pool, workload, datas[:threads])
+                samples = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    run(pool, workload, datas)
+                    samples.append(time.perf_counter() - start)
+            rates.append(args.n / min(samples))
+        print("%-8s" % workload + "".join("%12.1f" % rate for rate in rates) + "%9.2fx" % (rates[-1] / rates[0]))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,19 @@
 from .util.filter import BayerFilter
 from .util.constants import W, K
-from .util.rs import rs
+from .util.layout import get_layout
+from .util.placement import placement_map, mask_plane
+from .util import composite
+from .util.robustness import RobustnessEstimator
 from .util.block import Block
 from .util.qr import QR
-import qrcode
+from .util.capacity import parse_version
+from .util.cache import QRCache
+from .util import stats as _stats
+from .util.stats import Stats
 import numpy as np
+import argparse
+import cProfile
 import sys
-import random
 import itertools
 
 class Qash:
@@ -26,10 +33,10 @@ class Qash:
         QRコードの余白
     qr: Object
         データから生成した通常のQRコード
-    version: int
-        QRコードのバージョン情報
+    version: int or str
+        QRコードのバージョン情報。"auto"の場合はデータが収まる最小のバージョン
     error_correction: int
-        QRコードの誤り訂正レベル。(L, M, H, Q) = (0, 1, 2, 3)
+        QRコードの誤り訂正レベル。(L, M, Q, H) = (0, 1, 2, 3)
     block_num: int
         QRコードのブロック数
     code_length: int
@@ -44,17 +51,29 @@ class Qash:
         QRコードのブロックごとのコード語
     qash:
         ランダム化されたQRコード
+    seed: int
+        rngが指定されていない場合に使うseed(同じseedからは同じQashが生成される)
+    cache: QRCache
+        ランダム化前のQRコードの生成に使うcache
+    stats: Stats
+        処理時間とカウンタの記録先(Noneの場合は記録しない)
     """
-    
+    __slots__ = ("data", "version", "pixel_size", "box_size", "border", "color", "insertion", "seed", "stats",
+                 "qr", "error_correction", "code", "matrix", "possible_error")
+
     def __init__(self, 
                  data,
                  version,
-                 error_correction=qrcode.constants.ERROR_CORRECT_H,
+                 error_correction=QR.ERROR_CORRECT_H,
                  pixel_size=1,
                  box_size=20,
                  border=4,
                  color="#888888",
-                 insertion=1):
+                 insertion=1,
+                 rng=None,
+                 seed=None,
+                 cache=None,
+                 stats=None):
 
         self.data = data
         self.version = version
@@ -63,23 +82,32 @@ class Qash:
         self.border = border
         self.color = color
         self.insertion = insertion
+        self.seed = seed
+        self.stats = stats = _stats.resolve(stats)
 
-        self.qr = QR(data, version, error_correction, color=color)
+        if cache is not None:
+            self.qr = cache.qr(data, version, error_correction, color=color, stats=stats).copy()
+            self.qr.stats = stats
+        else:
+            self.qr = QR(data, version, error_correction, color=color, stats=stats)
 
         self.version = self.qr.version
         self.error_correction = self.qr.error_correct_level
 
         self.code = self.qr.processed_code #[codewords]
-        self.matrix = self.qr.matrix
+        self.matrix = self.qr.masked_matrix  # before randomization
         self.possible_error = self.calc_error_symbol()  # ブロックごとのエラー許容数
 
         # QRを限界まで壊す 
         blocks = self.qr.data_blocks
-        for i in range(len(blocks)):
-            blocks[i].randomize(self.possible_error[i]-self.insertion+1)
+        counts = [possible_error - self.insertion + 1 for possible_error in self.possible_error]
+        with stats.stage("qash.randomize"):
+            Block.randomize_blocks(blocks, counts, rng, seed)
         self.qr.set_blocks(blocks)
         
-        self.qr.image = self.qr.image.resize((self.qr.image.width * self.box_size, self.qr.image.height * self.box_size))
+        image = self.qr.image
+        with stats.stage("qash.resize"):
+            self.qr.image = image.resize((image.width * self.box_size, image.height * self.box_size))
 
     # QR画像の(x, y)にpixel(matrix)を貼り付ける
     def set_pixel(self, pixel, x, y):
@@ -89,16 +117,25 @@ class Qash:
         y = y * self.box_size
         self.qr.image.paste(pixel, (offset+x,offset+y))
 
+    # 選んだ全ての白moduleにpixel(False Pattern)を一度に貼り付ける
+    def set_false_pattern(self, pixel, policy="all", count=None, region=None, rng=None, seed=None):
+        from PIL import Image
+        with self.stats.stage("qash.select"):
+            selected = composite.select(composite.eligible_mask(self.qr), policy, count, region, rng, seed)
+        with self.stats.stage("qash.composite"):
+            raster = np.array(self.qr.image)
+            composite.composite(raster, selected, np.asarray(pixel), self.box_size)
+            self.qr.image = Image.fromarray(raster)
+        self.stats.count("false_patterns", int(selected.sum()))
+        return selected
+
     # ブロックごとに許容する最大エラー数を返す
     def calc_error_symbol(self):
-        blocks = rs[(self.version-1) * 4 + self.error_correction]
-        possible_errors = []
-        for i in range(len(blocks)//3):
-            block = blocks[i*3:i*3+3]
-            error_code_length = block[1] - block[2]
-            for _ in range(block[0]):
-                possible_errors.append(error_code_length // 2)
-        return possible_errors
+        return list(get_layout(self.version, self.error_correction).possible_error)
+
+    # ランダム化後に残っている誤り訂正の余裕を見積もる
+    def robustness(self):
+        return RobustnessEstimator(self.qr, self.code)
 
     # data配列[a,b,c,...]からQRを生成
     def make_qr_from_data(self, data):
@@ -113,49 +150,151 @@ class Qash:
 
     @classmethod
     def make_qr(cls, data, version, error_correction):
+        import qrcode
+        # qrcode numbers the levels (M, L, H, Q) = (0, 1, 2, 3)
+        levels = [qrcode.constants.ERROR_CORRECT_L, qrcode.constants.ERROR_CORRECT_M,
+                  qrcode.constants.ERROR_CORRECT_Q, qrcode.constants.ERROR_CORRECT_H]
         qr = qrcode.QRCode(version=version, 
-            error_correction=error_correction, 
+            error_correction=levels[error_correction], 
         )
         qr.add_data(data)
         qr.make()
         return qr
 
 
+class QashVariants:
+    """
+    同じデータから、ランダム化したQashをまとめて生成する。
+
+    データの符号化・誤り訂正符号の計算は一度だけ行い、機能パターンと誤り訂正語のmoduleは共通とする。
+    各variantではランダム化するデータ語のmoduleだけを書き換える。
+    Qash(seed=s)と、QashVariants(seed=s)の最初のvariantは同じmoduleになる。
+
+    Attributes
+    --------
+    qr: Object
+        データから生成した通常のQRコード(全variantの骨格)
+    version: int
+    error_correction: int
+    possible_error: list
+        ブロックごとのエラー許容数
+    counts: list
+        ブロックごとのランダム化する語数
+    skeleton: ndarray
+        ランダム化前のmasked matrix(uint8)
+    module_index: ndarray
+        ランダム化するデータ語のbitに対応するmodule位置(y * w + x)
+    stats: Stats
+        処理時間とカウンタの記録先(Noneの場合は記録しない)
+    """
+
+    def __init__(self,
+                 data,
+                 version,
+                 error_correction=3,
+                 color="#888888",
+                 insertion=1,
+                 rng=None,
+                 seed=None,
+                 stats=None):
+
+        self.stats = _stats.resolve(stats)
+        self.qr = QR(data, version, error_correction, color=color, stats=self.stats)
+        self.version = self.qr.version
+        self.error_correction = self.qr.error_correct_level
+        self.insertion = insertion
+        self.rng = rng if rng is not None else np.random.default_rng(seed)
+
+        plan = get_layout(self.version, self.error_correction)
+        self.possible_error = list(plan.possible_error)
+        self.counts = [max(0, min(possible_error - insertion + 1, int(length)))
+                       for possible_error, length in zip(self.possible_error, plan.data_lengths)]
+
+        # randomized codewords in block order, and where they sit after interleaving
+        positions = [offset + np.arange(n) for offset, n in zip(plan.data_offsets, self.counts)]
+        positions = np.concatenate(positions).astype(np.intp)
+        self.originals = np.asarray(self.qr.data_code, dtype=np.uint8)[positions]
+        arranged = plan.inverse_permutation[positions]
+        bit_index = (arranged[:, None] * 8 + np.arange(8)).ravel()
+        self.module_index = placement_map(self.version)[bit_index]
+
+        self.skeleton = np.array(self.qr.masked_matrix, dtype=np.uint8)
+        self.mask_bits = mask_plane(self.version, self.qr.mask_pattern).ravel()[self.module_index]
+
+    def generate(self, n, out=None):
+        """
+        n個のvariantのmasked matrixを(n, h, w)のuint8配列で返す。outを指定した場合はそこに書き込む。
+        """
+        with self.stats.stage("variants.generate"):
+            codes = Block.random_replacement(self.originals, self.rng, size=(n, len(self.originals)))
+            bits = np.unpackbits(codes, axis=1)
+            if out is None:
+                out = np.empty((n, *self.skeleton.shape), dtype=np.uint8)
+            variants = out.reshape(n, -1)
+            variants[:] = self.skeleton.reshape(1, -1)
+            variants[:, self.module_index] = bits ^ self.mask_bits
+        self.stats.count("variants", n)
+        return out
+
+    def iterate(self, n=None, chunk=64):
+        """
+        variantのmasked matrixを一つずつ返すiterator。nがNoneの場合は無限に生成する。
+        """
+        while n is None or n > 0:
+            size = chunk if n is None else min(chunk, n)
+            yield from self.generate(size)
+            if n is not None:
+                n -= size
+
+    def __iter__(self):
+        return self.iterate()
+
+
 def main():
     # Get Time
     from time import gmtime, strftime
     T = strftime('%Y%m%d%H%M%S', gmtime())
 
-    if len(sys.argv) < 2:
-        print("usage: python3 qash.py <data>")
-        sys.exit()
-    data = sys.argv[1]
+    parser = argparse.ArgumentParser(prog="qash")
+    parser.add_argument("data")
+    parser.add_argument("--version", type=parse_version, default="auto")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--cache-dir", help="directory to keep generated symbols in")
+    parser.add_argument("--policy", choices=composite.POLICIES, default="all")
+    parser.add_argument("--count", type=int, help="number of false patterns for --policy random")
+    parser.add_argument("--region", type=int, nargs=4, metavar=("TOP", "LEFT", "BOTTOM", "RIGHT"),
+                        help="module range for --policy region")
+    parser.add_argument("--profile", action="store_true", help="print stage timings and counters to stderr")
+    parser.add_argument("--profile-file", help="also write cProfile stats to this file")
+    args = parser.parse_args()
+    data = args.data
 
     filename = data + T
 
     # Generate Qash
-    qash = Qash(data=data, version=4 ,error_correction=3)
+    stats = Stats() if args.profile or args.profile_file else None
+    profiler = cProfile.Profile() if args.profile_file else None
+    if profiler is not None:
+        profiler.enable()
+    cache = QRCache(directory=args.cache_dir)
+    qash = Qash(data=data, version=args.version, error_correction=3, seed=args.seed, cache=cache, stats=stats)
 
     # Generate False Pattern
     # S = np.array([255,255,255])//4*3
-    f = BayerFilter(qash.box_size//2, qash.box_size//2)
-    f.pix = np.array(
+    pix = np.array(
         [[W, K],
         [K, K]]
     )
-    f.makeBayerFilter()
-    f.makeImage()
-    pixel = f.image
+    pixel = BayerFilter.tile(pix, qash.box_size//2, qash.box_size//2)
 
     # Set Pattern to Image
-    white_pixel_position = np.where(np.logical_not(np.array(qash.qr.masked_matrix)))
-    tx, ty = 0, 0
-    for y, x in zip(white_pixel_position[0], white_pixel_position[1]):
-        if x > 9 and y > 9:
-            tx, ty = x, y
-            break
-
-    qash.set_pixel(pixel, tx, ty)
+    qash.set_false_pattern(pixel, args.policy, args.count, args.region)
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile_file)
+    if stats is not None:
+        stats.add_counters("cache_", cache.stats.as_dict())
+        print(stats.report(), file=sys.stderr)
     qash.qr.image.show()
 
 if __name__ == "__main__":
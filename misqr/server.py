@@ -0,0 +1,518 @@
+"""
+QR, Whim, Qashを生成するHTTPサービス(asyncioと標準ライブラリのみ)。
+
+    python -m misqr.server [--host 127.0.0.1] [--port 8000] [--workers N]
+
+    GET /qr?data=...&version=auto&level=M&mask=0&format=png&box=10&border=4
+    GET /whim?data=...&index=-6&choice=0&version=auto&box=20&border=4
+    GET /qash?data=...&version=auto&seed=0&policy=all[&count=N|&region=T,L,B,R]&border=4
+    GET /stats
+
+- 処理中のrequestと同じrequestは、新しく処理せずにその結果を待つ(coalescing)
+- 同じ(version, 誤り訂正レベル, マスクパターン)のQRのrequestはbatch_window秒の間集め、
+  一度のQRBuilder.encode_batchで符号化する(micro-batching)
+- 符号化と画像化はprocess poolで行い、poolに渡すjobの数を制限する。処理中のrequestがmax_pendingに
+  達したら503を返す(backpressure)
+- 画像はchunked transfer encodingで少しずつ送る
+- /statsはrouteごとのlatencyのpercentileとカウンタをJSONで返す
+"""
+from .util.capacity import capacity, fit_version, parse_version
+from .util.stats import Stats
+from .util.png import PNGEncoder
+from .util.composite import POLICIES
+from .util.workers import process_pool
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import asyncio
+import json
+import os
+import time
+import urllib.parse
+import numpy as np
+
+BYTE_MODE = 0b0100
+LEVELS = {"L": 0, "M": 1, "Q": 2, "H": 3}
+FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+CHUNK_SIZE = 16 << 10
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class BadRequest(ValueError):
+    pass
+
+
+class NotFound(LookupError):
+    pass
+
+
+def render_png(matrix, box_size=10, border=4):
+    """moduleの配列を1bitのPNGにする"""
+    return PNGEncoder().encode_modules(matrix, box_size, border)
+
+
+def render_svg(matrix, box_size=10, border=4):
+    """moduleの配列をSVGにする。横に連続する暗moduleを一つの矩形にまとめる"""
+    matrix = np.asarray(matrix, dtype=np.int8)
+    n = matrix.shape[1] + 2 * border
+    parts = ['<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" viewBox="0 0 %d %d" shape-rendering="crispEdges">'
+             % (n * box_size, n * box_size, n, n),
+             '<rect width="%d" height="%d" fill="#fff"/><path fill="#000" d="' % (n, n)]
+    for y, row in enumerate(matrix):
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], row, [0]))))
+        for start, end in edges.reshape(-1, 2):
+            parts.append("M%d %dh%dv1h-%dz" % (start + border, y + border, end - start, end - start))
+    parts.append('"/></svg>\n')
+    return "".join(parts).encode("utf-8")
+
+
+def render(matrix, format, box_size, border):
+    return render_png(matrix, box_size, border) if format == "png" else render_svg(matrix, box_size, border)
+
+
+# jobs run in the worker processes; they import the generators on first use
+
+def _initialize():
+    from .util import builder  # noqa: F401
+    from PIL import Image  # noqa: F401
+
+
+def encode_batch(version, error_correct_level, mask_pattern, items):
+    """items((data, format, box_size, border)のリスト)をまとめて符号化し、画像のbytesのリストを返す"""
+    from .util.builder import QRBuilder
+    matrices = QRBuilder.pooled(version, error_correct_level, mask_pattern).encode_batch([item[0] for item in items])
+    return [render(matrix, *item[1:]) for matrix, item in zip(matrices, items)]
+
+
+def whim_png(data, version, index, choice, box_size, border):
+    """Whimの候補のうちchoice番目(候補のデータの順)を(データ, PNG)で返す"""
+    from .whim import Whim
+    candidates = Whim(data, version, 3).search_similar_qr(index)
+    if not candidates:
+        raise NotFound("no similar QR code for index %d" % index)
+    key = sorted(candidates)[choice % len(candidates)]
+    # white, black and the mixed gray fit in a 2-bit palette
+    return key, PNGEncoder().encode_image(candidates[key], box_size, border)
+
+
+def qash_png(data, version, seed, policy, count, region, border):
+    from .qash import Qash
+    from .util.filter import BayerFilter
+    from .util.constants import W, K
+    qash = Qash(data, version, 3, seed=seed)
+    pixel = BayerFilter.tile([[W, K], [K, K]], qash.box_size // 2, qash.box_size // 2)
+    qash.set_false_pattern(pixel, policy, count, region, seed=seed)
+    # the image is already box_size pixels per module
+    return PNGEncoder().encode_image(qash.qr.image, 1, border * qash.box_size)
+
+
+class LatencyRecorder:
+    """
+    routeごとに直近size件のlatency[ms]を保持する。
+
+    Attributes
+    --------
+    size: int
+    counts: dict
+        routeごとの記録した総数
+    """
+
+    def __init__(self, size=4096):
+        self.size = size
+        self.counts = {}
+        self._samples = {}
+
+    def add(self, route, ms):
+        self._samples.setdefault(route, deque(maxlen=self.size)).append(ms)
+        self.counts[route] = self.counts.get(route, 0) + 1
+
+    def percentiles(self, qs=(50, 90, 99)):
+        """routeごとの{count, p50, p90, p99, max}[ms]"""
+        result = {}
+        for route, samples in self._samples.items():
+            values = np.fromiter(samples, dtype=float, count=len(samples))
+            summary = {"count": self.counts[route]}
+            summary.update(("p%d" % q, round(float(v), 3)) for q, v in zip(qs, np.percentile(values, qs)))
+            summary["max"] = round(float(values.max()), 3)
+            result[route] = summary
+        return result
+
+
+class Coalescer:
+    """同じkeyの処理が進行中なら、新しく始めずにその結果を待つ"""
+
+    def __init__(self, stats):
+        self.stats = stats
+        self._inflight = {}
+
+    async def run(self, key, factory):
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(factory())
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._done(key, f))
+        else:
+            self.stats.count("coalesced")
+        # a client going away must not cancel the work the others wait for
+        return await asyncio.shield(future)
+
+    def _done(self, key, future):
+        self._inflight.pop(key, None)
+        if not future.cancelled():
+            future.exception()  # retrieved here in case every waiter went away
+
+    def __len__(self):
+        return len(self._inflight)
+
+
+class MicroBatcher:
+    """
+    同じkeyのitemをwindow秒の間(最大max_batch個)集め、submit(func, *key, items)の一度の呼び出しにまとめる。
+
+    funcはitemと同じ順に結果のリストを返す。
+    """
+
+    def __init__(self, submit, func, stats, window=0.002, max_batch=64):
+        self.submit = submit
+        self.func = func
+        self.stats = stats
+        self.window = window
+        self.max_batch = max_batch
+        self._batches = {}
+
+    def add(self, key, item):
+        loop = asyncio.get_running_loop()
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = ([], loop.call_later(self.window, self._flush, key))
+        future = loop.create_future()
+        batch[0].append((item, future))
+        if len(batch[0]) >= self.max_batch:
+            self._flush(key)
+        return future
+
+    def _flush(self, key):
+        entries, timer = self._batches.pop(key)
+        timer.cancel()
+        asyncio.ensure_future(self._run(key, entries))
+
+    async def _run(self, key, entries):
+        self.stats.count("batches")
+        self.stats.count("batched_items", len(entries))
+        try:
+            results = await self.submit(self.func, *key, [item for item, _ in entries])
+        except Exception as e:
+            results = [e] * len(entries)
+        for (_, future), result in zip(entries, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+class QRServer:
+    """
+    QR, Whim, Qashの生成をHTTPで受け付ける。
+
+    Attributes
+    --------
+    workers: int
+        process poolのprocess数(0の場合はthread一つで処理する)
+    max_pending: int
+        同時に処理するrequestの上限。超えたrequestには503を返す
+    batch_window: float
+        QRのrequestをまとめるために待つ時間[s]
+    max_batch: int
+        一度に符号化するQRの最大数
+    stats: Stats
+        カウンタ(requests, coalesced, batches, batched_items, rejected, errors)
+    latency: LatencyRecorder
+    """
+
+    def __init__(self, workers=None, max_pending=256, batch_window=0.002, max_batch=64):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_pending = max_pending
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.stats = Stats()
+        self.latency = LatencyRecorder()
+        self.routes = {"/qr": self.qr, "/whim": self.whim, "/qash": self.qash, "/stats": self.status}
+
+        self.executor = None
+        self.active = 0
+        self.running = 0
+        self._server = None
+
+    async def start(self, host="127.0.0.1", port=8000):
+        if self.workers > 0:
+            # the artifact bundle is shared with the workers through the page cache
+            self.executor = process_pool(self.workers, initializer=_initialize)
+        else:
+            self.executor = ThreadPoolExecutor(1, initializer=_initialize)
+        # start the workers before the first request arrives
+        await asyncio.get_running_loop().run_in_executor(self.executor, _initialize)
+        # at most two jobs per worker are handed to the pool, the rest wait here
+        self._slots = asyncio.Semaphore(2 * max(self.workers, 1))
+        self.coalescer = Coalescer(self.stats)
+        self.batcher = MicroBatcher(self.submit, encode_batch, self.stats, self.batch_window, self.max_batch)
+        self._server = await asyncio.start_server(self.handle, host, port)
+        return self._server
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+    @property
+    def port(self):
+        return self._server.sockets[0].getsockname()[1]
+
+    async def submit(self, func, *args):
+        """funcをpoolで実行する。poolに渡すjobの数はsemaphoreで制限する"""
+        async with self._slots:
+            self.running += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+            finally:
+                self.running -= 1
+
+    # HTTP
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self.respond(writer, 400, "text/plain", b"malformed request line\n", keep_alive=False)
+                    break
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                status, content_type, body, extra = await self.dispatch(method, target)
+                await self.respond(writer, status, content_type, body, keep_alive, extra)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, target):
+        """(status, content type, body, 追加のheader)を返す"""
+        start = time.perf_counter()
+        url = urllib.parse.urlsplit(target)
+        route = url.path
+        handler = self.routes.get(route)
+        extra = {}
+        if handler is None:
+            status, content_type, body = 404, "text/plain", b"not found\n"
+        elif method != "GET":
+            status, content_type, body = 405, "text/plain", b"only GET is supported\n"
+        elif handler == self.status:
+            status, (content_type, body, extra) = 200, handler({})
+        elif self.active >= self.max_pending:
+            self.stats.count("rejected")
+            status, content_type, body, extra = 503, "text/plain", b"too many requests in progress\n", {"Retry-After": "1"}
+        else:
+            self.stats.count("requests")
+            self.active += 1
+            try:
+                query = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+                status, (content_type, body, extra) = 200, await handler(query)
+            except BadRequest as e:
+                status, content_type, body = 400, "text/plain", ("%s\n" % e).encode("utf-8")
+            except NotFound as e:
+                status, content_type, body = 404, "text/plain", ("%s\n" % e).encode("utf-8")
+            except Exception as e:
+                self.stats.count("errors")
+                status, content_type, body = 500, "text/plain", ("%s: %s\n" % (type(e).__name__, e)).encode("utf-8")
+            finally:
+                self.active -= 1
+        if handler is not None:
+            self.latency.add(route, (time.perf_counter() - start) * 1000)
+        return status, content_type, body, extra
+
+    async def respond(self, writer, status, content_type, body, keep_alive=True, extra=None):
+        headers = ["HTTP/1.1 %d %s" % (status, REASONS[status]), "Content-Type: %s" % content_type,
+                   "Connection: %s" % ("keep-alive" if keep_alive else "close")]
+        headers += ["%s: %s" % item for item in (extra or {}).items()]
+        if not content_type.startswith("image/"):
+            headers.append("Content-Length: %d" % len(body))
+            writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body)
+            await writer.drain()
+            return
+        # images are streamed in chunks so that a slow client only holds a chunk in the buffer
+        headers.append("Transfer-Encoding: chunked")
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1"))
+        view = memoryview(body)
+        for offset in range(0, len(view), CHUNK_SIZE):
+            chunk = view[offset:offset + CHUNK_SIZE]
+            writer.write(b"%x\r\n" % len(chunk))
+            writer.write(chunk)
+            writer.write(b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    # routes; each returns (content type, body, extra headers)
+
+    async def qr(self, query):
+        data = _required(query, "data")
+        level = _level(query.get("level", "M"))
+        mask_pattern = _integer(query, "mask", 0, 0, 7)
+        format = query.get("format", "png")
+        if format not in FORMATS:
+            raise BadRequest("format must be one of %s" % ", ".join(FORMATS))
+        box_size = _integer(query, "box", 10, 1, 100)
+        border = _integer(query, "border", 4, 0, 40)
+        version = _version(query, data, level)
+
+        key = ("qr", data, version, level, mask_pattern, format, box_size, border)
+        body = await self.coalescer.run(key, lambda: self.batcher.add((version, level, mask_pattern),
+                                                                      (data, format, box_size, border)))
+        return FORMATS[format], body, {"X-QR-Version": str(version)}
+
+    async def whim(self, query):
+        data = _required(query, "data")
+        index = _integer(query, "index", -6, -len(data), len(data) - 1)
+        # the default is not checked by _integer
+        if not -len(data) <= index < len(data):
+            raise BadRequest("index must be in %d-%d for %d characters of data" % (-len(data), len(data) - 1, len(data)))
+        choice = _integer(query, "choice", 0, 0, 1 << 16)
+        box_size = _integer(query, "box", 20, 1, 100)
+        border = _integer(query, "border", 4, 0, 40)
+        version = _version(query, data, 3)
+
+        key = ("whim", data, version, index, choice, box_size, border)
+        candidate, body = await self.coalescer.run(
+            key, lambda: self.submit(whim_png, data, version, index, choice, box_size, border))
+        return "image/png", body, {"X-Whim-Candidate": urllib.parse.quote(candidate)}
+
+    async def qash(self, query):
+        data = _required(query, "data")
+        seed = _integer(query, "seed", None, 0, (1 << 63) - 1)
+        policy = query.get("policy", "all")
+        if policy not in POLICIES:
+            raise BadRequest("policy must be one of %s" % ", ".join(POLICIES))
+        count = _integer(query, "count", None, 0, 1 << 16)
+        region = query.get("region")
+        if region is not None:
+            try:
+                region = tuple(int(v) for v in region.split(","))
+            except ValueError:
+                region = ()
+            if len(region) != 4:
+                raise BadRequest("region must be TOP,LEFT,BOTTOM,RIGHT")
+        if (policy == "random") != (count is not None) or (policy == "region") != (region is not None):
+            raise BadRequest("count is used with policy=random and region with policy=region")
+        border = _integer(query, "border", 4, 0, 40)
+        version = _version(query, data, 3)
+
+        key = ("qash", data, version, seed, policy, count, region, border)
+        body = await self.coalescer.run(
+            key, lambda: self.submit(qash_png, data, version, seed, policy, count, region, border))
+        return "image/png", body, {}
+
+    def status(self, query):
+        counters = dict(self.stats.counters)
+        batches = counters.get("batches", 0)
+        document = {
+            "latency_ms": self.latency.percentiles(),
+            "counters": counters,
+            "mean_batch_size": counters.get("batched_items", 0) / batches if batches else 0.0,
+            "active": self.active,
+            "inflight": len(self.coalescer),
+            "running_jobs": self.running,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+        }
+        return "application/json", json.dumps(document, indent=1).encode("utf-8"), {}
+
+
+def _required(query, name):
+    if not query.get(name):
+        raise BadRequest("%s is required" % name)
+    return query[name]
+
+
+def _integer(query, name, default, low, high):
+    value = query.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise BadRequest("%s must be an integer" % name)
+    if not low <= number <= high:
+        raise BadRequest("%s must be in %d-%d" % (name, low, high))
+    return number
+
+
+def _level(value):
+    value = value.upper()
+    if value in LEVELS:
+        return LEVELS[value]
+    if value in ("0", "1", "2", "3"):
+        return int(value)
+    raise BadRequest("level must be one of L, M, Q, H")
+
+
+def _version(query, data, error_correct_level):
+    """データが収まるかを確かめたうえでバージョンを返す"""
+    length = len(data.encode("utf-8"))
+    try:
+        version = parse_version(query.get("version") or "auto")
+        if version == "auto":
+            return fit_version(length, error_correct_level, BYTE_MODE)
+    except ValueError as e:
+        raise BadRequest(str(e))
+    if not 1 <= version <= 40:
+        raise BadRequest("version must be in 1-40")
+    if length > capacity(version, error_correct_level, BYTE_MODE):
+        raise BadRequest("data is too long for version %d: %d > %d"
+                         % (version, length, capacity(version, error_correct_level, BYTE_MODE)))
+    return version
+
+
+async def serve(host, port, **options):
+    server = QRServer(**options)
+    await server.start(host, port)
+    print("serving on http://%s:%d (%d workers)" % (host, server.port, server.workers), flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="misqr-server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, help="worker processes (default: CPU count, 0: one thread)")
+    parser.add_argument("--max-pending", type=int, default=256, help="requests in progress before answering 503")
+    parser.add_argument("--batch-window-ms", type=float, default=2.0, help="time to collect QR requests into a batch")
+    parser.add_argument("--max-batch", type=int, default=64)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, workers=args.workers, max_pending=args.max_pending,
+                          batch_window=args.batch_window_ms / 1000, max_batch=args.max_batch))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
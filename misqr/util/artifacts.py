@@ -0,0 +1,211 @@
+"""
+全バージョン・誤り訂正レベルの事前計算結果(artifact bundle)を一つのファイルにまとめ、mmapで読み込む。
+
+機能パターンの領域・配置マップ・マスクパターン・機能パターンの値(バージョンごと)、インターリーブの
+置換(バージョン・誤り訂正レベルごと)、形式情報の符号語を保持する。
+import時にファイルをmmapするので、forkやspawnしたworkerはページを共有し、新しいバージョンの
+最初のシンボルでも計算を待たない。ファイルがない・古い場合はこれまで通りその場で計算する。
+古いかどうかはimport時にはパッケージのバージョンと元のソースのサイズ・更新時刻だけで判定し、
+ソースのhash(fingerprint)はbuildの時だけ計算してヘッダに記録する。
+
+    python -m misqr.util.artifacts build [PATH]
+    python -m misqr.util.artifacts info [PATH]
+
+ファイルは MAGIC, ヘッダ長(uint32 little endian), JSONヘッダ, 64byte境界に揃えた配列の生データ、の順に並ぶ。
+環境変数MISQR_ARTIFACTSでファイルの場所を変えられる(空文字列の場合は使わない)。
+"""
+from .. import __version__
+import os
+import struct
+import sys
+import warnings
+import numpy as np
+
+FORMAT_VERSION = 1
+MAGIC = b"MISQRART"
+ALIGNMENT = 64
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "artifacts.bin")
+
+# modules whose contents the artifacts are derived from
+SOURCES = ("placement.py", "layout.py", "rs.py", "table.py", "bch.py", "qr.py", "decoder.py")
+
+
+def fingerprint():
+    """artifactの元になるソースのhash(buildの時にヘッダに記録する)"""
+    import hashlib
+    digest = hashlib.sha256(b"%d" % FORMAT_VERSION)
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in SOURCES:
+        with open(os.path.join(directory, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def source_stats():
+    """artifactの元になるソースの[名前, サイズ, 更新時刻(ns)]のリスト。load時の安価な鮮度の判定に使う"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    stats = []
+    for name in SOURCES:
+        st = os.stat(os.path.join(directory, name))
+        stats.append([name, st.st_size, st.st_mtime_ns])
+    return stats
+
+
+class ArtifactBundle:
+    """
+    artifactファイルをmmapし、名前で読み取り専用の配列を返す。
+
+    Attributes
+    --------
+    path: str
+    header: dict
+        format_version, package_version, sources(source_stats), fingerprint, arrays(名前ごとのoffset, dtype, shape)
+    """
+
+    def __init__(self, path):
+        import json  # only needed when a bundle file exists
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("%s is not a misqr artifact file" % path)
+            size, = struct.unpack("<I", f.read(4))
+            self.header = json.loads(f.read(size).decode("utf-8"))
+        self._map = np.memmap(path, dtype=np.uint8, mode="r")
+        self._arrays = {}
+
+    def __contains__(self, name):
+        return name in self.header["arrays"]
+
+    def __getitem__(self, name):
+        array = self._arrays.get(name)
+        if array is None:
+            spec = self.header["arrays"][name]
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"], dtype=np.int64))
+            array = np.frombuffer(self._map, dtype=dtype, count=count, offset=spec["offset"]).reshape(spec["shape"])
+            self._arrays[name] = array
+        return array
+
+    def __len__(self):
+        return len(self.header["arrays"])
+
+    @property
+    def nbytes(self):
+        return len(self._map)
+
+
+def collect():
+    """bundleに入れる{名前: 配列}を計算する"""
+    from . import placement
+    from .layout import LayoutPlan
+    from .decoder import format_words
+
+    arrays = {}
+    for version in range(1, 41):
+        arrays["function_mask/%d" % version] = placement._function_mask(version)
+        arrays["placement_map/%d" % version] = placement._placement_map(version)
+        arrays["mask_planes/%d" % version] = np.stack([placement._mask_plane(version, m) for m in range(8)])
+        arrays["function_patterns/%d" % version] = placement._function_patterns(version)
+        for level in range(4):
+            permutation, inverse = LayoutPlan(version, level)._permutations()
+            arrays["permutation/%d/%d" % (version, level)] = permutation
+            arrays["inverse_permutation/%d/%d" % (version, level)] = inverse
+
+    words = format_words()
+    arrays["format_words"] = np.array([[words[(level, m)] for m in range(8)] for level in range(4)], dtype=np.uint8)
+    return arrays
+
+
+def build(path=DEFAULT_PATH):
+    """全てのartifactを計算してpathに書き出し、書いたbyte数を返す"""
+    arrays = {name: np.ascontiguousarray(array) for name, array in collect().items()}
+
+    specs = {}
+    offset = 0
+    for name, array in arrays.items():
+        specs[name] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    import json
+    header = {"format_version": FORMAT_VERSION, "package_version": __version__, "sources": source_stats(),
+              "fingerprint": fingerprint(), "arrays": specs}
+    # the data starts at an aligned position after the header, so shift every offset by it
+    encoded = json.dumps(header, sort_keys=True).encode("utf-8")
+    start = -(-(len(MAGIC) + 4 + len(encoded) + 64) // ALIGNMENT) * ALIGNMENT
+    for spec in specs.values():
+        spec["offset"] += start
+    encoded = json.dumps(header, sort_keys=True).encode("utf-8")
+    encoded += b" " * (start - len(MAGIC) - 4 - len(encoded))
+
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(encoded)) + encoded)
+        for name, array in arrays.items():
+            f.seek(specs[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(start + offset)
+    os.replace(tmp, path)
+    return start + offset
+
+
+def load(path):
+    """pathのbundleを読み込む。ない場合はNone、古い場合は警告してNoneを返す"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        bundle = ArtifactBundle(path)
+    except (OSError, ValueError) as e:
+        warnings.warn("ignoring artifact file %s: %s" % (path, e))
+        return None
+    header = bundle.header
+    try:
+        fresh = (header.get("format_version") == FORMAT_VERSION and header.get("package_version") == __version__
+                 and header.get("sources") == source_stats())
+    except OSError:
+        fresh = False
+    if not fresh:
+        warnings.warn("ignoring stale artifact file %s; rebuild it with python -m misqr.util.artifacts build" % path)
+        return None
+    return bundle
+
+
+def lookup(name, compute, *args):
+    """bundleにnameがあればその配列を、なければcompute(*args)を返す(computeがNoneならNone)"""
+    if _bundle is not None and name in _bundle:
+        array = _bundle[name]
+        if array.dtype.kind == "i" and array.dtype != np.intp:
+            array = array.astype(np.intp)
+            array.setflags(write=False)
+        return array
+    return compute(*args) if compute is not None else None
+
+
+def get():
+    """読み込まれているbundle(なければNone)"""
+    return _bundle
+
+
+_bundle = load(os.environ.get("MISQR_ARTIFACTS", DEFAULT_PATH))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else "info"
+    path = argv[1] if len(argv) > 1 else os.environ.get("MISQR_ARTIFACTS", DEFAULT_PATH)
+    if command == "build":
+        size = build(path)
+        print("wrote %s (%d bytes)" % (path, size))
+    elif command == "info":
+        bundle = load(path)
+        if bundle is None:
+            print("no usable artifact file at %s" % path)
+            return 1
+        print("%s: %d arrays, %d bytes, fingerprint %s" % (path, len(bundle), bundle.nbytes, bundle.header["fingerprint"][:12]))
+    else:
+        print("usage: python -m misqr.util.artifacts [build|info] [PATH]")
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
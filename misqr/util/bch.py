@@ -2,8 +2,6 @@ G15 = [1,0,1,0,0,1,1,0,1,1,1]
 G18 = [1,1,1,1,1,0,0,1,0,0,1,0,1]
 
 MASK = 0b101010000010010
-gf_exp = [0] * 512 # Create list of 512 elements. In Python 2.6+, consider using bytearray
-gf_log = [0] * 256
 
 def gf_poly_div(dividend, divisor):
     '''Fast polynomial division by using Extended Synthetic Division and optimized for GF(2^p) computations
@@ -87,7 +85,8 @@ def init_tables(prim=0x11d):
     '''Precompute the logarithm and anti-log tables for faster computation later, using the provided primitive polynomial.'''
     # prim is the primitive (binary) polynomial. Since it's a polynomial in the binary sense,
     # it's only in fact a single galois field value between 0 and 255, and not a list of gf values.
-    global gf_exp, gf_log
+    # The tables are built locally and returned as tuples, so the module-level ones are never rebound or mutated
+    # and can be shared between threads.
     gf_exp = [0] * 512 # anti-log (exponential) table
     gf_log = [0] * 256 # log table
     # For each possible value in the galois field 2^8, we will pre-compute the logarithm and anti-logarithm (exponential) of this value
@@ -95,17 +94,54 @@ def init_tables(prim=0x11d):
     for i in range(0, 255):
         gf_exp[i] = x # compute anti-log for this value and store it in a table
         gf_log[x] = i # compute log at the same time
-        x = gf_mult_noLUT(x, 2, prim)
-
-        # If you use only generator==2 or a power of 2, you can use the following which is faster than gf_mult_noLUT():
-        #x <<= 1 # multiply by 2 (change 1 by another number y to multiply by a power of 2^y)
-        #if x & 0x100: # similar to x >= 256, but a lot faster (because 0x100 == 256)
-            #x ^= prim # substract the primary polynomial to the current value (instead of 255, so that we get a unique set made of coprime numbers), this is the core of the tables generation
+        # The generator is 2, so multiply by shifting instead of gf_mult_noLUT(x, 2, prim), which dominated import time
+        x <<= 1 # multiply by 2 (change 1 by another number y to multiply by a power of 2^y)
+        if x & 0x100: # similar to x >= 256, but a lot faster (because 0x100 == 256)
+            x ^= prim # substract the primary polynomial to the current value (instead of 255, so that we get a unique set made of coprime numbers), this is the core of the tables generation
 
     # Optimization: double the size of the anti-log table so that we don't need to mod 255 to
     # stay inside the bounds (because we will mainly use this table for the multiplication of two GF numbers, no more).
     for i in range(255, 512):
         gf_exp[i] = gf_exp[i - 255]
-    return [gf_log, gf_exp]
+    return tuple(gf_log), tuple(gf_exp)
+
+def gf_div(x, y):
+    if y == 0:
+        raise ZeroDivisionError()
+    if x == 0:
+        return 0
+    return gf_exp[(gf_log[x] + 255 - gf_log[y]) % 255]
+
+def gf_pow(x, power):
+    return gf_exp[(gf_log[x] * power) % 255]
+
+def gf_inverse(x):
+    return gf_exp[255 - gf_log[x]] # gf_inverse(x) == gf_div(1, x)
+
+def gf_poly_scale(p, x):
+    return [gf_mul(p[i], x) for i in range(0, len(p))]
+
+def gf_poly_add(p, q):
+    r = [0] * max(len(p), len(q))
+    for i in range(0, len(p)):
+        r[i + len(r) - len(p)] = p[i]
+    for i in range(0, len(q)):
+        r[i + len(r) - len(q)] ^= q[i]
+    return r
+
+def gf_poly_mul(p, q):
+    '''Multiply two polynomials, inside Galois Field'''
+    r = [0] * (len(p) + len(q) - 1)
+    for j in range(0, len(q)):
+        for i in range(0, len(p)):
+            r[i + j] ^= gf_mul(p[i], q[j])
+    return r
+
+def gf_poly_eval(poly, x):
+    '''Evaluates a polynomial in GF(2^p) given the value for x. This is based on Horner's scheme for maximum efficiency.'''
+    y = poly[0]
+    for i in range(1, len(poly)):
+        y = gf_mul(y, x) ^ poly[i]
+    return y
 
-init_tables()
+gf_log, gf_exp = init_tables()
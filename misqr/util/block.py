@@ -1,95 +1,99 @@
-from .rs import rs
-import reedsolo
-import random
-import itertools
+from .layout import get_layout
+from .builder import error_correction_codes
+import numpy as np
 
 class Block():
 
     def __init__(self, code):
         self.code = code
 
-    def randomize(self, n):
+    def randomize(self, n, rng=None, seed=None):
         """
         data codeのうち、先頭のn moduleをrandomizeする。
 
         Parameters
         --------
         n : int
+        rng : numpy.random.Generator
+        seed : int
+            rngが指定されていない場合に使うseed
 
         Notes
         --------
         randomizeされたコードをsetします。
         
         """
-        randomized_code = self.code[:]
-        for i in range(n):
-            while True:
-                r = random.randint(0, 1<<8)
-                if randomized_code[i] != r:
-                    randomized_code[i] = r
-                    break
+        self.randomize_blocks([self], [n], rng, seed)
         
-        self.code = randomized_code
-        
-    def calculate_error_correction_code(self, error_code_length):
-        rsc = reedsolo.RSCodec(error_code_length)
-        error_block = [i for i in rsc.encode(self.code)[-error_code_length:]]
-        return error_block
+    @classmethod
+    def random_replacement(cls, code, rng, size=None):
+        """
+        codeの各コード語と必ず異なる0-255の値を一様に選ぶ。
+
+        Parameters
+        --------
+        code : array_like
+        rng : numpy.random.Generator
+        size : tuple
+            codeにbroadcastする出力のshape(省略時はcodeと同じ)
+
+        Returns
+        --------
+        replacement : ndarray(uint8)
+        """
+        code = np.asarray(code, dtype=np.uint8)
+        size = code.shape if size is None else size
+        # adding 1-255 modulo 256 never returns the original codeword
+        shift = rng.integers(1, 1 << 8, size=size, dtype=np.uint8)
+        return code + shift
 
     @classmethod
-    def integrate(cls, blocks=[]):
-        code = []
-        for data in itertools.zip_longest(*blocks):
-            for d in data:
-                if d == None:
-                    continue
-                code.append(d)
-                
-        return Block(code) 
+    def randomize_blocks(cls, blocks, counts, rng=None, seed=None):
+        """
+        ブロックごとに先頭counts[i]語を一度の乱数生成でrandomizeする。
+
+        Parameters
+        --------
+        blocks : list
+            Blockのリスト
+        counts : list
+            ブロックごとのrandomizeする語数
+        rng : numpy.random.Generator
+        seed : int
+            rngが指定されていない場合に使うseed
+        """
+        rng = rng if rng is not None else np.random.default_rng(seed)
+        counts = [max(0, min(n, len(block.code))) for block, n in zip(blocks, counts)]
+        heads = [c for block, n in zip(blocks, counts) for c in block.code[:n]]
+        replacement = cls.random_replacement(heads, rng).tolist()
+
+        base = 0
+        for block, n in zip(blocks, counts):
+            block.code = replacement[base:base+n] + list(block.code[n:])
+            base += n
+
+    def calculate_error_correction_code(self, error_code_length):
+        return self.calculate_error_correction_codes([self], error_code_length)[0]
 
     @classmethod
-    def divide_into_data_block(cls, code, version, error_correction):
-        block_length, code_length, data_code_length, blocks_info = cls.get_block_info(version, error_correction)
-        blocks = [[] for _ in range(block_length)]
-        block_data_length = [range(block_info[2]) for block_info in blocks_info]
-        index = 0
-        for row in itertools.zip_longest(*block_data_length):
-            for i, item in enumerate(row):
-                if item == None:
-                    continue
-                blocks[i].append(code[index])
-                index += 1
-        
-        return blocks
+    def calculate_error_correction_codes(cls, blocks, error_code_length):
+        """
+        ブロックごとの誤り訂正語のリストを返す。
+
+        全ブロックをまとめてNumPyで計算する(misqr.util.builder.error_correction_codes)。
+        """
+        return error_correction_codes([block.code for block in blocks], error_code_length).tolist()
 
     @classmethod
     def divide_into_block(cls, code, version, error_correct_level):
-        block_length, code_length, data_code_length, blocks_info = cls.get_block_info(version, error_correct_level)
-        blocks = [[] for _ in range(block_length)]
-        block_data_length = [block_info[2] for block_info in blocks_info]
-
-        base = 0
-        for i, l in enumerate(block_data_length):
-            blocks[i] = Block(code[base:base+l])
-            base += l
+        plan = get_layout(version, error_correct_level)
+        blocks = []
+        for base, l in zip(plan.data_offsets, plan.data_lengths):
+            blocks.append(Block(code[base:base+l]))
 
         return blocks
 
     @classmethod
     def get_block_info(cls, version, error_correct_level):
-        block_info = rs[(version-1) * 4 + error_correct_level]
-        block_length = 0
-        code_length = 0
-        data_code_length = 0
-
-        blocks_info = []
-
-        for i in range(len(block_info) // 3):
-            sub_block_info = block_info[i*3: i*3+3]
-            block_length += sub_block_info[0]
-            code_length += sub_block_info[1] * sub_block_info[0]
-            data_code_length += sub_block_info[2] * sub_block_info[0]
-            for _ in range(sub_block_info[0]):
-                blocks_info.append(sub_block_info)
-
-        return block_length, code_length, data_code_length, blocks_info
+        plan = get_layout(version, error_correct_level)
+        return plan.block_num, plan.code_length, plan.data_code_length, plan.blocks_info
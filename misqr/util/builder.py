@@ -0,0 +1,213 @@
+from . import bch
+from .capacity import capacity, instruction_bit_length
+from .layout import get_layout
+from .decoder import format_positions, format_words
+from .placement import placement_map, mask_plane, function_patterns
+import functools
+import threading
+import numpy as np
+
+BYTE_MODE = 0b0100
+WEEDS = [0b11101100, 0b00010001]
+
+# BIT_TABLE[c] is the 8 bits of codeword c, most significant first
+BIT_TABLE = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1)
+
+
+@functools.lru_cache(maxsize=None)
+def multiplication_table():
+    """GF(2^8)の積の表(256, 256)"""
+    gf_exp = np.array(bch.gf_exp, dtype=np.intp)
+    gf_log = np.array(bch.gf_log, dtype=np.intp)
+    table = gf_exp[(gf_log[:, None] + gf_log[None, :]) % 255].astype(np.uint8)
+    table[0, :] = 0
+    table[:, 0] = 0
+    table.setflags(write=False)
+    return table
+
+
+@functools.lru_cache(maxsize=None)
+def generator_polynomial(nsym):
+    """誤り訂正語nsym語の生成多項式(次数の高い順)"""
+    g = [1]
+    for i in range(nsym):
+        g = bch.gf_poly_mul(g, [1, bch.gf_pow(2, i)])
+    return tuple(g)
+
+
+def error_correction_codes(blocks, nsym):
+    """
+    全てのブロックの誤り訂正語をまとめて計算する。
+
+    短いブロックは先頭を0で埋めて右に揃え、全ブロックの割り算を一度に進める(QRBuilder.encode_error_codeと同じ)。
+    共有する表は読み取り専用なので、複数のthreadから同時に呼んでよい。
+
+    Parameters
+    --------
+    blocks : list
+        ブロックごとのデータ語のリスト
+    nsym : int
+        ブロックごとの誤り訂正語数
+
+    Returns
+    --------
+    codes : ndarray
+        (ブロック数, nsym)のuint8配列
+    """
+    longest = max(len(block) for block in blocks)
+    work = np.zeros((longest + nsym, len(blocks)), dtype=np.intp)
+    for b, block in enumerate(blocks):
+        work[longest - len(block):longest, b] = block
+    generator = multiplication_table()[list(generator_polynomial(nsym)[1:])]
+    for i in range(longest):
+        work[i+1:i+1+nsym] ^= generator[:, work[i]]
+    return work[longest:].T.astype(np.uint8)
+
+
+class QRBuilder:
+    """
+    (バージョン, 誤り訂正レベル, マスクパターン)を固定して、バッファを使い回しながらQRコードを繰り返し生成する。
+
+    module配列、コード語・bitのバッファ、誤り訂正符号計算用の作業領域を最初に確保し、
+    encodeではこれらを上書きするだけなので、定常状態ではほとんどメモリを確保しない。
+    バッファを共有するので、一つのbuilderを複数のthreadから同時に使わないこと(pooledを参照)。
+
+    Attributes
+    --------
+    version: int
+    error_correct_level: int
+    mask_pattern: int
+    w: int
+        QRコードの一辺のmodule数
+    capacity: int
+        8-bit byteモードで格納できる最大byte数
+    """
+
+    def __init__(self, version, error_correct_level, mask_pattern=0b000):
+        self.version = version
+        self.error_correct_level = error_correct_level
+        self.mask_pattern = mask_pattern
+        self.w = 17 + version * 4
+        self.capacity = capacity(version, error_correct_level, BYTE_MODE)
+        self.count_bit_length = instruction_bit_length(version, BYTE_MODE)
+
+        plan = get_layout(version, error_correct_level)
+        self.plan = plan
+        ecc = plan.error_code_length
+        self.longest = int(plan.data_lengths.max())
+
+        # function patterns and format information; every data module is rewritten by encode
+        template = function_patterns(version).copy()
+        word = format_words()[(error_correct_level, mask_pattern)]
+        for positions in format_positions(self.w):
+            template[tuple(positions)] = word
+        self.template = template.ravel()
+        self.index = placement_map(version)
+        self.mask_bits = mask_plane(version, mask_pattern).ravel()[self.index]
+        # generator[j, c] = g_{j+1} * c
+        self.generator = np.ascontiguousarray(multiplication_table()[list(generator_polynomial(ecc)[1:])], dtype=np.intp)
+
+        # preallocated buffers
+        self.data_code = np.zeros(plan.data_code_length, dtype=np.uint8)
+        self.padding = np.resize(np.array(WEEDS, dtype=np.uint8), plan.data_code_length)
+        self.shifted = np.zeros(self.capacity, dtype=np.uint8)
+        # np.take copies indices that are not writable contiguous intp, so the buffers used as
+        # indices are intp and the work area is (position, block) to make each step a row
+        self.work = np.zeros((self.longest + ecc, plan.block_num), dtype=np.intp)
+        self.product = np.zeros((ecc, plan.block_num), dtype=np.intp)
+        self.code = np.zeros(plan.code_length, dtype=np.intp)
+        self.permutation = plan.permutation.copy()
+        self.arranged = np.zeros(plan.code_length, dtype=np.intp)
+        self.bits = np.zeros(len(self.index), dtype=np.uint8)  # remainder bits stay 0
+        self.masked = np.zeros(len(self.index), dtype=np.uint8)
+        self.matrix = self.template.copy()
+
+        # right-aligned position of each block's data in the work area
+        self.rows = [slice(self.longest - length, self.longest) for length in plan.data_lengths]
+        self.blocks = [slice(offset, offset + length) for offset, length in zip(plan.data_offsets, plan.data_lengths)]
+
+    def encode(self, data, out=None):
+        """
+        dataを符号化したmasked matrixを返す。
+
+        outを指定しない場合はbuilderの内部バッファ(w, w)を返し、次のencodeで上書きされる。
+        outを指定した場合は(w, w)のuint8配列outに書き込んでoutを返す。
+        """
+        payload = data.encode("utf-8") if isinstance(data, str) else data
+        self.encode_data_code(payload)
+        self.encode_error_code()
+
+        # interleave, expand to bits and place them over the template
+        # (mode="clip" keeps np.take from buffering out; all indices are in range)
+        np.take(self.code, self.permutation, out=self.arranged, mode="clip")
+        np.take(BIT_TABLE, self.arranged, axis=0, out=self.bits[:len(self.arranged) * 8].reshape(-1, 8), mode="clip")
+        np.bitwise_xor(self.bits, self.mask_bits, out=self.masked)
+        self.matrix[self.index] = self.masked
+
+        matrix = self.matrix.reshape(self.w, self.w)
+        if out is None:
+            return matrix
+        np.copyto(out, matrix)
+        return out
+
+    def encode_data_code(self, payload):
+        n = len(payload)
+        if n > self.capacity:
+            raise ValueError("data is too long for version %d: %d > %d" % (self.version, n, self.capacity))
+
+        # mode (4 bits) + count + payload, so the payload is shifted by a nibble
+        buf = self.data_code
+        if self.count_bit_length == 8:
+            buf[0] = (BYTE_MODE << 4) | (n >> 4)
+            head = 1
+        else:
+            buf[0] = (BYTE_MODE << 4) | (n >> 12)
+            buf[1] = (n >> 4) & 0xff
+            head = 2
+        low = (n & 0xf) << 4
+        if n:
+            d = np.frombuffer(payload, dtype=np.uint8)
+            np.right_shift(d, 4, out=buf[head:head+n])
+            buf[head] |= low
+            np.left_shift(d[:-1], 4, out=self.shifted[:n-1])
+            np.bitwise_or(buf[head+1:head+n], self.shifted[:n-1], out=buf[head+1:head+n])
+            buf[head+n] = (d[-1] & 0xf) << 4
+        else:
+            buf[head] = low
+        rest = len(buf) - (head + n + 1)
+        buf[head+n+1:] = self.padding[:rest]
+
+    def encode_error_code(self):
+        # synthetic division of all blocks at once; shorter blocks are padded with leading zeros
+        work = self.work
+        work[:] = 0
+        for b, (row, block) in enumerate(zip(self.rows, self.blocks)):
+            work[row, b] = self.data_code[block]
+        ecc = self.plan.error_code_length
+        for i in range(self.longest):
+            np.take(self.generator, work[i], axis=1, out=self.product, mode="clip")
+            np.bitwise_xor(work[i+1:i+1+ecc], self.product, out=work[i+1:i+1+ecc])
+
+        dcl = self.plan.data_code_length
+        self.code[:dcl] = self.data_code
+        self.code[dcl:].reshape(self.plan.block_num, ecc).T[:] = work[self.longest:]
+
+    def encode_batch(self, datas, out=None):
+        """複数のデータを符号化し、(N, w, w)のuint8配列に書き込んで返す"""
+        if out is None:
+            out = np.empty((len(datas), self.w, self.w), dtype=np.uint8)
+        for i, data in enumerate(datas):
+            self.encode(data, out[i])
+        return out
+
+    @classmethod
+    def pooled(cls, version, error_correct_level, mask_pattern=0b000):
+        """threadごとに使い回すbuilderを返す"""
+        pool = _pool.__dict__.setdefault("builders", {})
+        key = (version, error_correct_level, mask_pattern)
+        if key not in pool:
+            pool[key] = cls(version, error_correct_level, mask_pattern)
+        return pool[key]
+
+
+_pool = threading.local()
@@ -0,0 +1,246 @@
+from .qr import QR
+from .layout import get_layout
+from .builder import QRBuilder
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+import numpy as np
+
+
+class CacheStats:
+    """
+    QRCacheのhit/missの統計。
+
+    Attributes
+    --------
+    hits: int
+        メモリ上のcacheにhitした回数
+    disk_hits: int
+        ディスク上のcacheにhitした回数
+    misses: int
+        どちらにもなく生成した回数
+    evictions: int
+        メモリ上のcacheから追い出した数
+    disk_evictions: int
+        ディスク上のcacheから削除したファイル数
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.disk_hits + self.misses
+        return (self.hits + self.disk_hits) / total if total else 0.0
+
+    def as_dict(self):
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "disk_evictions": self.disk_evictions,
+            "hit_rate": self.hit_rate,
+        }
+
+    def __repr__(self):
+        return "CacheStats(%s)" % ", ".join("%s=%s" % item for item in self.as_dict().items())
+
+
+class QRCache:
+    """
+    生成したQRコードを内容(データと生成条件)をkeyとしてcacheする。
+
+    メモリ上のLRU(maxsize件)に、QRオブジェクト・コード語列・module配列・PNGを保持する。
+    directoryを指定すると、これらをディスクにも保存し(QRオブジェクトはコード語列とpackbitsしたmasked matrix)、
+    合計がmax_disk_bytesを超えたら古いものから削除する。
+    cacheから返すQRオブジェクトは共有されるので、変更する場合はQR.copy()してから使うこと。
+
+    Attributes
+    --------
+    maxsize: int
+        メモリ上に保持する件数
+    directory: str
+        ディスク上のcacheの場所(Noneの場合はメモリのみ)
+    max_disk_bytes: int
+        ディスク上のcacheの最大サイズ[byte]
+    stats: CacheStats
+    """
+
+    def __init__(self, maxsize=256, directory=None, max_disk_bytes=64 << 20):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.stats = CacheStats()
+
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._disk_bytes = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    @staticmethod
+    def key(kind, data, version, error_correct_level, mask_pattern=0b000, color="#000000", **options):
+        """生成条件から内容に対応するkey(sha256)を返す"""
+        content = repr((kind, data, version, error_correct_level, mask_pattern, color, sorted(options.items())))
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def qr(self, data, version, error_correct_level, mask_pattern=0b000, color="#000000", stats=None):
+        """
+        QRオブジェクトを返す。statsはcacheになく生成する場合に渡す(keyには含めない)。
+
+        ディスク上にはバージョン・配置順のコード語列・masked matrix(packbits)を保存し、QR.restoreで作り直す。
+        """
+        key = self.key("qr", data, version, error_correct_level, mask_pattern, color)
+
+        def dump(qr):
+            return bytes([qr.version]) + bytes(qr.processed_code) + qr._packed.tobytes()
+
+        def load(content):
+            code_length = get_layout(content[0], error_correct_level).code_length
+            return QR.restore(data, content[0], error_correct_level, content[1:1 + code_length], content[1 + code_length:],
+                              mask_pattern, color, stats=stats)
+
+        return self._get(key, lambda: QR(data, version, error_correct_level, mask_pattern, color, stats=stats),
+                         ".qr", dump, load)
+
+    def code(self, data, version, error_correct_level):
+        """
+        ブロック順のコード語列(データ語 + 誤り訂正語)を読み取り専用のuint8配列で返す(Whimの候補)。
+
+        QRBuilder.pooledで符号化するので、QRオブジェクトは作らない。
+        """
+        key = self.key("code", data, version, error_correct_level)
+
+        def build():
+            builder = QRBuilder.pooled(version, error_correct_level)
+            builder.encode_data_code(data.encode("utf-8"))
+            builder.encode_error_code()
+            return self._load_code(builder.code.astype(np.uint8).tobytes())
+
+        return self._get(key, build, ".code", bytes, self._load_code)
+
+    def matrix(self, data, version, error_correct_level, mask_pattern=0b000):
+        """masked matrixを(w, w)の読み取り専用のuint8配列で返す"""
+        key = self.key("matrix", data, version, error_correct_level, mask_pattern)
+
+        def build():
+            qr = self.qr(data, version, error_correct_level, mask_pattern)
+            matrix = np.array(qr.masked_matrix, dtype=np.uint8)
+            matrix.setflags(write=False)
+            return matrix
+
+        return self._get(key, build, ".bin", self._pack, self._unpack)
+
+    def png(self, data, version, error_correct_level, mask_pattern=0b000, color="#000000", box_size=10, border=4):
+        """1bitのPNGのbytesを返す(QR.png)"""
+        key = self.key("png", data, version, error_correct_level, mask_pattern, color, box_size=box_size, border=border)
+
+        def build():
+            return self.qr(data, version, error_correct_level, mask_pattern, color).png(box_size, border)
+
+        return self._get(key, build, ".png", bytes, bytes)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key, build, suffix=None, dump=None, load=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.stats.hits += 1
+                return self._entries[key]
+
+        value = None
+        if suffix is not None and self.directory is not None:
+            value = self._read(key + suffix, load)
+        if value is None:
+            value = build()
+            with self._lock:
+                self.stats.misses += 1
+            if suffix is not None and self.directory is not None:
+                self._write(key + suffix, dump(value))
+
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+        return value
+
+    def _read(self, name, load):
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, "rb") as f:
+                value = load(f.read())
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        with self._lock:
+            self.stats.disk_hits += 1
+        return value
+
+    def _write(self, name, content):
+        path = os.path.join(self.directory, name)
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(content)
+        os.replace(tmp, path)
+        with self._lock:
+            self._disk_bytes += len(content)
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        # least recently used first; hits touch the mtime
+        entries = sorted((entry for entry in os.scandir(self.directory) if entry.is_file()),
+                         key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            self.stats.disk_evictions += 1
+        self._disk_bytes = total
+
+    @staticmethod
+    def _load_code(content):
+        code = np.frombuffer(content, dtype=np.uint8)
+        code.setflags(write=False)
+        return code
+
+    @staticmethod
+    def _pack(matrix):
+        return bytes([matrix.shape[0]]) + np.packbits(matrix).tobytes()
+
+    @staticmethod
+    def _unpack(content):
+        w = content[0]
+        bits = np.unpackbits(np.frombuffer(content, dtype=np.uint8, offset=1), count=w * w).reshape(w, w)
+        bits.setflags(write=False)
+        return bits
+
+
+def render(image, box_size=10, border=4):
+    """1module 1pxのQR画像を、moduleの一辺box_size[px]、余白border[module]の画像にする"""
+    from PIL import Image
+    scaled = image.resize((image.width * box_size, image.height * box_size), resample=Image.NEAREST)
+    canvas = Image.new(image.mode, (scaled.width + 2 * border * box_size, scaled.height + 2 * border * box_size), "white")
+    canvas.paste(scaled, (border * box_size, border * box_size))
+    return canvas
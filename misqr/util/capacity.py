@@ -0,0 +1,96 @@
+from .table import CODE_LENGTH_TABLE, INSTRUCTION_BIT_LENGTH_TABLE
+import bisect
+
+MODE_INDICATOR_LENGTH = 4
+
+
+def mode_to_index(mode):
+    for i in range(4):
+        if (mode >> i) & 1:
+            return i
+
+
+def instruction_bit_length(version, mode):
+    index = mode_to_index(mode)
+    if version < 10:
+        return INSTRUCTION_BIT_LENGTH_TABLE[0][index]
+    elif version < 27:
+        return INSTRUCTION_BIT_LENGTH_TABLE[1][index]
+    else:
+        return INSTRUCTION_BIT_LENGTH_TABLE[2][index]
+
+
+def _characters(bits, mode_index):
+    # numeric: 3 digits / 10 bits, alphanumeric: 2 chars / 11 bits
+    if mode_index == 0:
+        rest = bits % 10
+        return bits // 10 * 3 + (2 if rest >= 7 else 1 if rest >= 4 else 0)
+    elif mode_index == 1:
+        return bits // 11 * 2 + (1 if bits % 11 >= 6 else 0)
+    elif mode_index == 2:
+        return bits // 8
+    else:
+        return bits // 13
+
+
+def build_capacity_table(header_length=0):
+    """
+    (誤り訂正レベル, モード)ごとに、バージョン1-40の最大文字数を計算する。
+
+    Parameters
+    --------
+    header_length : int
+        モード指示子の前に付加するヘッダのbit長(連結モードなど)
+
+    Returns
+    --------
+    table : list
+        table[error_correct_level][mode_index][version-1] -> 最大文字数
+    """
+    table = [[[] for _ in range(4)] for _ in range(4)]
+    for version in range(1, 41):
+        for level in range(4):
+            data_bits = CODE_LENGTH_TABLE[version-1][level][1] * 8
+            for mode_index in range(4):
+                available = data_bits - header_length - MODE_INDICATOR_LENGTH - instruction_bit_length(version, 1 << mode_index)
+                table[level][mode_index].append(_characters(max(available, 0), mode_index))
+    return table
+
+
+CAPACITY_TABLE = build_capacity_table()
+
+# structured append header: mode indicator 0011, symbol position (4 bits), total - 1 (4 bits), parity (8 bits)
+STRUCTURED_APPEND_HEADER_LENGTH = 20
+STRUCTURED_APPEND_CAPACITY_TABLE = build_capacity_table(STRUCTURED_APPEND_HEADER_LENGTH)
+
+
+def capacity(version, error_correct_level, mode, table=CAPACITY_TABLE):
+    return table[error_correct_level][mode_to_index(mode)][version-1]
+
+
+def fit_version(length, error_correct_level, mode, table=CAPACITY_TABLE):
+    """
+    length文字が収まる最小のバージョンを返す。
+
+    容量はバージョンについて単調増加なので、二分探索で求める。
+
+    Parameters
+    --------
+    length : int
+        データの文字数(8-bit byteモードではbyte数)
+    error_correct_level : int
+    mode : int
+
+    Returns
+    --------
+    version : int
+    """
+    capacities = table[error_correct_level][mode_to_index(mode)]
+    index = bisect.bisect_left(capacities, length)
+    if index == len(capacities):
+        raise ValueError("data is too long: %d > %d" % (length, capacities[-1]))
+    return index + 1
+
+
+def parse_version(value):
+    return value if value == "auto" else int(value)
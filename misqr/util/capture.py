@@ -0,0 +1,194 @@
+from . import demosaic
+import itertools
+import numpy as np
+
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def rasterize(matrices, box_size, border=0, color=(0, 0, 0)):
+    """
+    (N, h, w)のmodule配列(1: 暗)を、一辺box_size[px]のmoduleからなる(N, H, W, 3)のuint8画像にする。
+    """
+    matrices = np.asarray(matrices, dtype=bool)
+    raster = np.where(matrices[..., None], np.array(color, dtype=np.uint8), np.uint8(255))
+    raster = np.repeat(np.repeat(raster, box_size, axis=-3), box_size, axis=-2)
+    if border:
+        pad = [(0, 0)] * (raster.ndim - 3) + [(border * box_size,) * 2] * 2 + [(0, 0)]
+        raster = np.pad(raster, pad, constant_values=255)
+    return raster
+
+
+def sweep(scale=(1.0,), rotation=(0.0,), blur=(0.0,)):
+    """scale, rotation[deg], blur[sensor px]の全組み合わせを(P,)の配列3つで返す"""
+    grid = np.array(list(itertools.product(scale, rotation, blur)), dtype=np.float32).reshape(-1, 3)
+    return grid[:, 0], grid[:, 1], grid[:, 2]
+
+
+class CaptureSimulator:
+    """
+    カメラでQRコードを撮影したときの見え方をまとめてシミュレーションする。
+
+    QR画像をセンサの画素格子に縮小・回転してサンプルし、ぼかし、CFAでmosaicしてからdemosaicし、
+    輝度を二値化してmodule中心の値を読み取る。
+    撮影条件(scale, rotation, blur)はP通りまとめて与え、N個の画像と合わせて(N, P, ...)のテンソルで処理する。
+
+    Attributes
+    --------
+    shape: tuple
+        QRコードのmodule数(h, w)
+    box_size: int
+        moduleの一辺[px]
+    offset: int
+        QR部分の左上の位置[px](余白)
+    scale: ndarray
+        (P,) QR画像の1pxあたりのセンサ画素数
+    rotation: ndarray
+        (P,) 回転角[deg]
+    blur: ndarray
+        (P,) ぼかしのガウス分布の標準偏差[センサ画素]
+    sensor_shape: tuple
+        センサの画素数(Hs, Ws)
+    pattern: str
+        CFAの配列
+    method: str
+        demosaicの手法
+    threshold: float
+        二値化の閾値(0-255)。Noneの場合は画像ごとのmodule中心の平均輝度
+    """
+
+    def __init__(self,
+                 shape,
+                 box_size,
+                 raster_shape,
+                 offset=0,
+                 scale=(1.0,),
+                 rotation=(0.0,),
+                 blur=(0.0,),
+                 sensor_shape=None,
+                 pattern="RGGB",
+                 method="bilinear",
+                 threshold=None):
+
+        self.shape = tuple(shape)
+        self.box_size = box_size
+        self.offset = offset
+        self.raster_shape = tuple(raster_shape[:2])
+        self.scale, self.rotation, self.blur = np.broadcast_arrays(
+            np.asarray(scale, dtype=np.float32),
+            np.asarray(rotation, dtype=np.float32),
+            np.asarray(blur, dtype=np.float32))
+        if sensor_shape is None:
+            largest = float(self.scale.max())
+            sensor_shape = tuple(int(np.ceil(n * largest)) for n in self.raster_shape)
+        self.sensor_shape = tuple(sensor_shape)
+        self.pattern = pattern
+        self.method = method
+        self.threshold = threshold
+
+        self._make_sampling()
+
+    def _make_sampling(self):
+        # sensor q = center_s + scale * R(theta) (p - center_r); invert for every sensor pixel
+        theta = np.deg2rad(self.rotation)[:, None, None]
+        scale = self.scale[:, None, None]
+        cos, sin = np.cos(theta), np.sin(theta)
+        center_r = (np.array(self.raster_shape, dtype=np.float32) - 1) / 2
+        center_s = (np.array(self.sensor_shape, dtype=np.float32) - 1) / 2
+
+        qy, qx = np.indices(self.sensor_shape, dtype=np.float32)
+        dy, dx = (qy - center_s[0]) / scale, (qx - center_s[1]) / scale
+        py = center_r[0] + cos * dy + sin * dx
+        px = center_r[1] - sin * dy + cos * dx
+
+        # bilinear gather from the raster padded with one white pixel
+        height, width = self.raster_shape
+        py = np.clip(py + 1, 0, height + 1)
+        px = np.clip(px + 1, 0, width + 1)
+        y0 = np.minimum(np.floor(py).astype(np.intp), height)
+        x0 = np.minimum(np.floor(px).astype(np.intp), width)
+        self._index = (y0, x0)
+        self._weight = ((py - y0)[..., None].astype(np.float32), (px - x0)[..., None].astype(np.float32))
+
+        # module centers seen on the sensor
+        my, mx = np.indices(self.shape, dtype=np.float32)
+        ry = self.offset + (my + 0.5) * self.box_size - 0.5 - center_r[0]
+        rx = self.offset + (mx + 0.5) * self.box_size - 0.5 - center_r[1]
+        sy = center_s[0] + scale * (cos * ry - sin * rx)
+        sx = center_s[1] + scale * (sin * ry + cos * rx)
+        self._module_index = (np.clip(np.rint(sy), 0, self.sensor_shape[0] - 1).astype(np.intp),
+                              np.clip(np.rint(sx), 0, self.sensor_shape[1] - 1).astype(np.intp))
+
+        # per-condition gaussian kernel
+        radius = int(np.ceil(3 * float(self.blur.max())))
+        taps = np.arange(-radius, radius + 1, dtype=np.float32)
+        sigma = np.maximum(self.blur, 1e-6)[:, None]
+        kernel = np.exp(-0.5 * (taps[None, :] / sigma) ** 2)
+        self._kernel = (kernel / kernel.sum(axis=1, keepdims=True)).astype(np.float32)
+
+    def _sample(self, rasters):
+        padded = np.pad(np.asarray(rasters, dtype=np.float32), ((0, 0), (1, 1), (1, 1), (0, 0)), constant_values=255)
+        y0, x0 = self._index
+        wy, wx = self._weight
+        top = padded[:, y0, x0] * (1 - wx) + padded[:, y0, x0 + 1] * wx
+        bottom = padded[:, y0 + 1, x0] * (1 - wx) + padded[:, y0 + 1, x0 + 1] * wx
+        return top * (1 - wy) + bottom * wy
+
+    def _blur(self, images):
+        # images: (N, P, Hs, Ws, 3), a different kernel for each of the P conditions
+        radius = self._kernel.shape[1] // 2
+        if radius == 0:
+            return images
+        for axis in (2, 3):
+            pad = [(0, 0)] * images.ndim
+            pad[axis] = (radius, radius)
+            padded = np.pad(images, pad, mode="edge")
+            n = images.shape[axis]
+            out = np.zeros_like(images)
+            for k in range(2 * radius + 1):
+                window = [slice(None)] * images.ndim
+                window[axis] = slice(k, k + n)
+                out += self._kernel[:, k][None, :, None, None, None] * padded[tuple(window)]
+            images = out
+        return images
+
+    def capture(self, rasters):
+        """
+        N個のQR画像を撮影した、demosaic後の(N, P, Hs, Ws, 3)のRGB画像を返す。
+        """
+        images = self._blur(self._sample(rasters))
+        raw = demosaic.mosaic(images, self.pattern)
+        return np.clip(demosaic.demosaic(raw, self.pattern, self.method), 0, 255)
+
+    def read(self, rasters, chunk=16):
+        """
+        N個のQR画像を撮影し、module中心の輝度と、それを二値化したmodule(True: 暗)を返す。
+
+        Returns
+        --------
+        luminance : ndarray
+            (N, P, h, w)のmodule中心の輝度
+        modules : ndarray
+            (N, P, h, w)のbool配列
+        """
+        rasters = np.asarray(rasters)
+        if rasters.ndim == 3:
+            rasters = rasters[None]
+        conditions = np.arange(len(self.scale))[:, None, None]
+        values, modules = [], []
+        for start in range(0, len(rasters), chunk):
+            gray = self.capture(rasters[start:start + chunk]) @ LUMA
+            value = gray[:, conditions, self._module_index[0], self._module_index[1]]
+            threshold = value.mean(axis=(-2, -1), keepdims=True) if self.threshold is None else self.threshold
+            values.append(value)
+            modules.append(value < threshold)
+        return np.concatenate(values), np.concatenate(modules)
+
+    def errors(self, rasters, expected, chunk=16):
+        """
+        撮影して読み取ったmoduleと、期待するmodule配列expected((N, h, w)または(h, w))が異なる数を(N, P)で返す。
+        """
+        _, modules = self.read(rasters, chunk)
+        expected = np.asarray(expected, dtype=bool)
+        if expected.ndim == 2:
+            expected = expected[None]
+        return np.count_nonzero(modules != expected[:, None], axis=(-2, -1))
@@ -0,0 +1,99 @@
+from .placement import function_mask
+from numpy.lib.stride_tricks import as_strided
+import numpy as np
+
+POLICIES = ("all", "random", "region")
+
+
+def eligible_mask(qr, module=0):
+    """
+    False Patternを置けるmoduleをTrueとするbool配列を返す。
+
+    機能パターン(位置検出・タイミング・形式情報など、flag_matrixで値が決まっている領域)を除き、
+    値がmoduleであるデータ領域のmoduleを対象とする。
+
+    Parameters
+    --------
+    qr : QR
+    module : int
+        対象とするmoduleの値(0: 白, 1: 黒)
+    """
+    matrix = np.asarray(qr.masked_matrix, dtype=np.uint8)
+    return np.logical_and(~function_mask(qr.version), matrix == module)
+
+
+def select(mask, policy="all", count=None, region=None, rng=None, seed=None):
+    """
+    eligible_maskからFalse Patternを置くmoduleを選ぶ。
+
+    Parameters
+    --------
+    mask : ndarray
+        eligible_maskの結果
+    policy : str
+        "all": 全て, "random": count個をランダムに選ぶ, "region": regionの内側
+    count : int
+        policy="random"で選ぶmoduleの数
+    region : tuple
+        policy="region"の範囲(top, left, bottom, right)。module単位で、bottom, rightは含まない
+    rng : numpy.random.Generator
+    seed : int
+        rngが指定されていない場合に使うseed
+    """
+    if policy == "all":
+        return mask.copy()
+    elif policy == "random":
+        rng = rng if rng is not None else np.random.default_rng(seed)
+        candidates = np.flatnonzero(mask)
+        count = len(candidates) if count is None else min(count, len(candidates))
+        selected = np.zeros(mask.size, dtype=bool)
+        selected[rng.choice(candidates, size=count, replace=False)] = True
+        return selected.reshape(mask.shape)
+    elif policy == "region":
+        top, left, bottom, right = region
+        selected = np.zeros_like(mask)
+        selected[top:bottom, left:right] = mask[top:bottom, left:right]
+        return selected
+    raise ValueError("unknown policy: %s (expected one of %s)" % (policy, ", ".join(POLICIES)))
+
+
+def module_view(raster, shape, box_size, offset=0):
+    """
+    rasterを(h, w, box_size, box_size, channel)のmodule単位のviewとして返す(copyしない)。
+    """
+    h, w = shape
+    region = raster[offset:offset + h * box_size, offset:offset + w * box_size]
+    s0, s1 = region.strides[:2]
+    return as_strided(region,
+                      shape=(h, w, box_size, box_size) + region.shape[2:],
+                      strides=(s0 * box_size, s1 * box_size, s0, s1) + region.strides[2:],
+                      writeable=True)
+
+
+def composite(raster, selected, tile, box_size, offset=0):
+    """
+    拡大済みのQR画像rasterのうち、selectedのmodule全てにtileを一度に書き込む。
+
+    Parameters
+    --------
+    raster : ndarray
+        (H, W, channel)の書き込み可能な画像配列。in-placeで書き換える
+    selected : ndarray
+        (h, w)のbool配列
+    tile : ndarray
+        (th, tw, channel)のFalse Pattern。moduleの左上に揃えて書き、box_sizeより大きい部分は切り捨て、
+        小さい場合(box_sizeが奇数でbox_size//2から作ったtileなど)は残りの画素をそのままにする
+    box_size : int
+        moduleの一辺[px]
+    offset : int
+        QR部分の左上の位置[px](余白)
+
+    Returns
+    --------
+    raster : ndarray
+    """
+    tile = np.asarray(tile, dtype=raster.dtype)[:box_size, :box_size]
+    th, tw = tile.shape[:2]
+    view = module_view(raster, selected.shape, box_size, offset)
+    view[selected, :th, :tw] = tile
+    return raster
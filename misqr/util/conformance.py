@@ -0,0 +1,169 @@
+"""
+qrcodeライブラリとの差分テスト。
+
+全てのバージョン・誤り訂正レベル・マスクパターンについてデータを生成し、QRとQRBuilderのmasked matrixが
+qrcodeのmodulesと一致するかを調べ、一致しないmoduleの座標と、それぞれの生成速度(symbols/s)を報告する。
+
+    python -m misqr.util.conformance [--versions 1-40] [--levels 0-3] [--masks 0-7] [--seed 0]
+"""
+from .qr import QR
+from .builder import QRBuilder
+from .capacity import capacity
+import argparse
+import random
+import sys
+import time
+import numpy as np
+
+BYTE_MODE = 0b0100
+LEVEL_NAMES = "LMQH"
+# payload characters; the non-ASCII ones take 2 and 3 bytes in UTF-8
+ALPHABET = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 ./:-_?=&%~" + "éあ"
+
+
+def payload(version, error_correct_level, rng):
+    """versionが収まる最小のバージョンになる長さ(byte)のデータを返す"""
+    low = capacity(version - 1, error_correct_level, BYTE_MODE) + 1 if version > 1 else 1
+    high = capacity(version, error_correct_level, BYTE_MODE)
+    target = rng.randint(low, high)
+    chars, size = [], 0
+    while size < target:
+        c = rng.choice(ALPHABET)
+        n = len(c.encode("utf-8"))
+        if size + n > target:
+            c, n = "a", 1
+        chars.append(c)
+        size += n
+    return "".join(chars)
+
+
+def reference_modules(data, version, error_correct_level, mask_pattern):
+    """qrcodeで8-bit byteモードのQRコードを生成し、(w, w)のuint8配列で返す"""
+    import qrcode
+    import qrcode.util
+    # qrcode numbers the levels (M, L, H, Q) = (0, 1, 2, 3)
+    levels = [qrcode.constants.ERROR_CORRECT_L, qrcode.constants.ERROR_CORRECT_M,
+              qrcode.constants.ERROR_CORRECT_Q, qrcode.constants.ERROR_CORRECT_H]
+    q = qrcode.QRCode(version=version, error_correction=levels[error_correct_level], mask_pattern=mask_pattern)
+    q.add_data(qrcode.util.QRData(data.encode("utf-8"), mode=qrcode.util.MODE_8BIT_BYTE))
+    q.make(fit=False)
+    return np.array(q.modules, dtype=np.uint8)
+
+
+def mismatches(expected, actual):
+    """一致しないmoduleの(y, x)のリスト"""
+    expected = np.asarray(expected, dtype=np.uint8)
+    actual = np.asarray(actual, dtype=np.uint8)
+    if expected.shape != actual.shape:
+        raise ValueError("symbol size differs: %s != %s" % (expected.shape, actual.shape))
+    return [tuple(int(i) for i in yx) for yx in np.argwhere(expected != actual)]
+
+
+class ConformanceReport:
+    """
+    差分テストの結果。
+
+    Attributes
+    --------
+    symbols: int
+        比較したシンボル数
+    failures: list
+        (実装名, version, 誤り訂正レベル, マスクパターン, data, 一致しないmoduleの座標)のリスト
+    seconds: dict
+        実装ごとの生成時間の合計[s](qrcode, QR, QRBuilder)
+    """
+
+    def __init__(self):
+        self.symbols = 0
+        self.failures = []
+        self.seconds = {}
+
+    @property
+    def ok(self):
+        return not self.failures
+
+    def add_time(self, name, ns):
+        self.seconds[name] = self.seconds.get(name, 0.0) + ns / 1e9
+
+    def throughput(self):
+        """実装ごとのsymbols/s"""
+        return {name: self.symbols / seconds for name, seconds in self.seconds.items() if seconds}
+
+
+def check(versions=range(1, 41), levels=range(4), masks=range(8), per_config=1, seed=0, builder=True, report=None):
+    """
+    全ての(version, 誤り訂正レベル, マスクパターン)について、per_config個のデータでqrcodeと比較する。
+
+    QRBuilderは構成ごとに一度作り、時間にはencodeだけを含める。
+    """
+    report = report if report is not None else ConformanceReport()
+    rng = random.Random(seed)
+    for version in versions:
+        for level in levels:
+            for mask_pattern in masks:
+                fast = QRBuilder(version, level, mask_pattern) if builder else None
+                for _ in range(per_config):
+                    data = payload(version, level, rng)
+
+                    start = time.perf_counter_ns()
+                    expected = reference_modules(data, version, level, mask_pattern)
+                    report.add_time("qrcode", time.perf_counter_ns() - start)
+
+                    start = time.perf_counter_ns()
+                    actual = QR(data, version, level, mask_pattern).masked_matrix
+                    report.add_time("QR", time.perf_counter_ns() - start)
+                    results = [("QR", actual)]
+
+                    if fast is not None:
+                        start = time.perf_counter_ns()
+                        actual = fast.encode(data)
+                        report.add_time("QRBuilder", time.perf_counter_ns() - start)
+                        results.append(("QRBuilder", actual))
+
+                    report.symbols += 1
+                    for name, actual in results:
+                        wrong = mismatches(expected, actual)
+                        if wrong:
+                            report.failures.append((name, version, level, mask_pattern, data, wrong))
+    return report
+
+
+def parse_range(value, low, high):
+    """"1-40"や"1,7,40"を数のリストにする"""
+    numbers = []
+    for part in value.split(","):
+        first, _, last = part.partition("-")
+        numbers.extend(range(int(first), int(last or first) + 1))
+    if not all(low <= n <= high for n in numbers):
+        raise argparse.ArgumentTypeError("%r is out of %d-%d" % (value, low, high))
+    return numbers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m misqr.util.conformance")
+    parser.add_argument("--versions", type=lambda v: parse_range(v, 1, 40), default=list(range(1, 41)))
+    parser.add_argument("--levels", type=lambda v: parse_range(v, 0, 3), default=list(range(4)))
+    parser.add_argument("--masks", type=lambda v: parse_range(v, 0, 7), default=list(range(8)))
+    parser.add_argument("--per-config", type=int, default=1, help="payloads per configuration")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-builder", action="store_true", help="check QR only")
+    parser.add_argument("--max-coordinates", type=int, default=8, help="coordinates shown per mismatching symbol")
+    args = parser.parse_args(argv)
+
+    report = check(args.versions, args.levels, args.masks, args.per_config, args.seed, not args.no_builder)
+
+    for name, version, level, mask_pattern, data, wrong in report.failures:
+        shown = " ".join("(%d,%d)" % yx for yx in wrong[:args.max_coordinates])
+        more = " ..." if len(wrong) > args.max_coordinates else ""
+        print("MISMATCH %-9s version=%d level=%s mask=%d bytes=%d modules=%d: %s%s" % (
+            name, version, LEVEL_NAMES[level], mask_pattern, len(data.encode("utf-8")), len(wrong), shown, more))
+
+    print("%d symbols, %d mismatching" % (report.symbols, len(report.failures)))
+    print("%-10s %12s %12s" % ("library", "symbols/s", "ms/symbol"))
+    for name, rate in report.throughput().items():
+        print("%-10s %12.1f %12.3f" % (name, rate, 1000 / rate))
+    return 0 if report.ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
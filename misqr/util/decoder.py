@@ -0,0 +1,280 @@
+from . import artifacts
+from . import bch
+from .bch import gf_poly_div, gf_mul, gf_pow, gf_inverse, gf_div, gf_poly_scale, gf_poly_add, gf_poly_mul, gf_poly_eval, G15
+from .capacity import instruction_bit_length
+from .layout import get_layout
+from .placement import function_mask, placement_map, mask_plane
+import functools
+import numpy as np
+
+# format information bits of the error correct levels L, M, Q, H
+LEVEL_BITS = [[0,1], [0,0], [1,1], [1,0]]
+FORMAT_MASK = [1,0,1,0,1,0,0,0,0,0,1,0,0,1,0]
+
+
+class DecodeError(ValueError):
+    pass
+
+
+class DecodeResult:
+    """
+    QRコードの復号結果。
+
+    Attributes
+    --------
+    data: bytes
+        復号したデータ
+    version: int
+    error_correct_level: int
+    mask_pattern: int
+    corrected: list
+        ブロックごとに訂正したコード語の数
+    structured_append: tuple
+        連結モードのシンボルの場合は(シンボルの位置, シンボル数, パリティ)、それ以外はNone
+    """
+
+    def __init__(self, data, version, error_correct_level, mask_pattern, corrected, structured_append=None):
+        self.data = data
+        self.version = version
+        self.error_correct_level = error_correct_level
+        self.mask_pattern = mask_pattern
+        self.corrected = corrected
+        self.structured_append = structured_append
+
+    @property
+    def text(self):
+        return self.data.decode("utf-8")
+
+    def __repr__(self):
+        return "DecodeResult(data=%r, version=%d, error_correct_level=%d, mask_pattern=%d, corrected=%r%s)" % (
+            self.data, self.version, self.error_correct_level, self.mask_pattern, self.corrected,
+            "" if self.structured_append is None else ", structured_append=%r" % (self.structured_append,))
+
+
+@functools.lru_cache(maxsize=None)
+def format_words():
+    """(誤り訂正レベル, マスクパターン)ごとの形式情報15bit(i番目がbit i)"""
+    table = artifacts.lookup("format_words", None)
+    if table is not None:
+        return {(level, m): tuple(int(b) for b in table[level, m]) for level in range(4) for m in range(8)}
+    words = {}
+    for level, level_bits in enumerate(LEVEL_BITS):
+        for mask_pattern in range(8):
+            format_info = level_bits + [(mask_pattern >> (2-i)) & 1 for i in range(3)]
+            format_info += gf_poly_div(format_info + [0]*10, G15)[-1]
+            words[(level, mask_pattern)] = tuple(i ^ j for i, j in zip(format_info, FORMAT_MASK))[::-1]
+    return words
+
+
+@functools.lru_cache(maxsize=None)
+def format_positions(w):
+    """形式情報のbit iが置かれる2箇所の(y, x)"""
+    first = [(i, 8) for i in range(6)] + [(7, 8), (8, 8), (8, 7)] + [(8, 14-i) for i in range(9, 15)]
+    second = [(8, w-1-i) for i in range(8)] + [(w-15+i, 8) for i in range(8, 15)]
+    return np.array(first).T, np.array(second).T
+
+
+def read_format(matrix):
+    """形式情報の2箇所を読み、ハミング距離が最小の(誤り訂正レベル, マスクパターン)を返す"""
+    first, second = format_positions(matrix.shape[0])
+    copies = [matrix[tuple(first)], matrix[tuple(second)]]
+    best, distance = None, 16
+    for key, word in format_words().items():
+        for bits in copies:
+            d = int(np.count_nonzero(bits != word))
+            if d < distance:
+                best, distance = key, d
+    if distance > 3:
+        raise DecodeError("format information is unreadable")
+    return best
+
+
+@functools.lru_cache(maxsize=None)
+def _gf_tables():
+    return np.array(bch.gf_exp, dtype=np.uint8), np.array(bch.gf_log, dtype=np.intp)
+
+
+@functools.lru_cache(maxsize=None)
+def _syndrome_power(n, nsym):
+    # exponent j * (n - 1 - i) of alpha for the syndrome j of codeword i
+    return (np.arange(nsym)[:, None] * np.arange(n - 1, -1, -1)[None, :]) % 255
+
+
+def calc_syndromes(blocks, nsym):
+    """
+    (B, n)のコード語(短いブロックは先頭を0で埋める)の、ブロックごとのsyndrome(B, nsym)をまとめて計算する。
+    """
+    gf_exp, gf_log = _gf_tables()
+    power = _syndrome_power(blocks.shape[1], nsym)
+    terms = gf_exp[(gf_log[blocks][:, None, :] + power[None]) % 255]
+    terms[np.broadcast_to((blocks == 0)[:, None, :], terms.shape)] = 0
+    return np.bitwise_xor.reduce(terms, axis=2)
+
+
+def rs_find_error_locator(synd, nsym):
+    # Berlekamp-Massey; synd has a leading 0 so that synd[i+1] is the i-th syndrome
+    err_loc = [1]
+    old_loc = [1]
+    for i in range(0, nsym):
+        K = i + 1
+        delta = synd[K]
+        for j in range(1, len(err_loc)):
+            delta ^= gf_mul(err_loc[-(j+1)], synd[K - j])
+        old_loc = old_loc + [0]
+        if delta != 0:
+            if len(old_loc) > len(err_loc):
+                new_loc = gf_poly_scale(old_loc, delta)
+                old_loc = gf_poly_scale(err_loc, gf_inverse(delta))
+                err_loc = new_loc
+            err_loc = gf_poly_add(err_loc, gf_poly_scale(old_loc, delta))
+    while len(err_loc) and err_loc[0] == 0:
+        del err_loc[0]
+    if (len(err_loc) - 1) * 2 > nsym:
+        raise DecodeError("too many errors to correct")
+    return err_loc
+
+
+def rs_find_errors(err_loc, nmess):
+    # Chien search, evaluating err_loc at alpha^i for all positions at once
+    errs = len(err_loc) - 1
+    gf_exp, gf_log = _gf_tables()
+    coef = np.array(err_loc)
+    degree = np.arange(errs, -1, -1)[coef != 0]
+    log = gf_log[coef[coef != 0]]
+    i = np.arange(nmess)
+    values = np.bitwise_xor.reduce(gf_exp[(log[:, None] + degree[:, None] * i[None, :]) % 255], axis=0)
+    err_pos = (nmess - 1 - i[values == 0]).tolist()
+    if len(err_pos) != errs:
+        raise DecodeError("too many errors to correct")
+    return err_pos
+
+
+def rs_correct_errata(msg, synd, err_pos):
+    # Forney algorithm
+    coef_pos = [len(msg) - 1 - p for p in err_pos]
+    err_loc = [1]
+    for i in coef_pos:
+        err_loc = gf_poly_mul(err_loc, gf_poly_add([1], [gf_pow(2, i), 0]))
+    _, err_eval = gf_poly_div(gf_poly_mul(synd[::-1], err_loc), [1] + [0]*len(err_loc))
+    err_eval = err_eval[::-1]
+
+    X = [gf_pow(2, -(255 - p)) for p in coef_pos]
+    E = [0] * len(msg)
+    for i, Xi in enumerate(X):
+        Xi_inv = gf_inverse(Xi)
+        err_loc_prime = 1
+        for j in range(len(X)):
+            if j != i:
+                err_loc_prime = gf_mul(err_loc_prime, 1 ^ gf_mul(Xi_inv, X[j]))
+        y = gf_mul(Xi, gf_poly_eval(err_eval[::-1], Xi_inv))
+        if err_loc_prime == 0:
+            raise DecodeError("could not find error magnitude")
+        E[err_pos[i]] = gf_div(y, err_loc_prime)
+    return gf_poly_add(msg, E)
+
+
+def rs_correct(msg, synd, nsym):
+    """1ブロックのコード語msgを訂正し、(訂正後のコード語, 訂正した語数)を返す"""
+    synd = [0] + list(synd)
+    err_loc = rs_find_error_locator(synd, nsym)
+    err_pos = rs_find_errors(err_loc[::-1], len(msg))
+    corrected = rs_correct_errata(list(msg), synd, err_pos)
+    if max(calc_syndromes(np.array([corrected], dtype=np.uint8), nsym)[0]) != 0:
+        raise DecodeError("could not correct message")
+    return corrected, len(err_pos)
+
+
+def parse(data_code, version):
+    """
+    データコード語列から8-bit byteモードのデータを取り出す。
+
+    連結モードのヘッダがあれば、(データ, (シンボルの位置, シンボル数, パリティ))を返す。
+    ない場合は(データ, None)を返す。
+    """
+    value = int.from_bytes(bytes(data_code), "big")
+    remaining = len(data_code) * 8
+    data = bytearray()
+    structured_append = None
+
+    def read(n):
+        nonlocal remaining
+        if n > remaining:
+            raise DecodeError("data is truncated")
+        remaining -= n
+        return (value >> remaining) & ((1 << n) - 1)
+
+    while remaining >= 4:
+        mode = read(4)
+        if mode == 0b0000:
+            break
+        if mode == 0b0011:
+            position, total, parity = read(4), read(4) + 1, read(8)
+            structured_append = (position, total, parity)
+            continue
+        if mode != 0b0100:
+            raise DecodeError("unsupported mode: 0b{:04b}".format(mode))
+        length = read(instruction_bit_length(version, mode))
+        data += read(length * 8).to_bytes(length, "big")
+    return bytes(data), structured_append
+
+
+def decode(masked_matrix):
+    """
+    masked_matrixからQRコードを復号する。
+
+    Parameters
+    --------
+    masked_matrix : array_like
+        (w, w)のmodule配列(1: 暗)
+
+    Returns
+    --------
+    result : DecodeResult
+
+    Raises
+    --------
+    DecodeError
+        形式情報が読めない、誤りが訂正できない、対応していないモードの場合
+    """
+    matrix = np.asarray(masked_matrix, dtype=np.uint8)
+    version = (matrix.shape[0] - 17) // 4
+    if matrix.shape[0] != matrix.shape[1] or not 1 <= version <= 40 or version * 4 + 17 != matrix.shape[0]:
+        raise DecodeError("invalid symbol size: %s" % (matrix.shape,))
+
+    level, mask_pattern = read_format(matrix)
+    plan = get_layout(version, level)
+
+    # unmask the data area and gather the codewords in placement order
+    unmasked = matrix ^ (mask_plane(version, mask_pattern) & ~function_mask(version))
+    bits = unmasked.ravel()[placement_map(version)[:plan.code_length * 8]]
+    code = plan.deinterleave(np.packbits(bits))
+
+    # (B, n) right-aligned blocks of data + error codewords
+    ecc = plan.error_code_length
+    n = int(plan.data_lengths.max()) + ecc
+    blocks = np.zeros((plan.block_num, n), dtype=np.uint8)
+    for b, (offset, length) in enumerate(zip(plan.data_offsets, plan.data_lengths)):
+        blocks[b, n - length - ecc:n - ecc] = code[offset:offset + length]
+        blocks[b, n - ecc:] = code[plan.data_code_length + b * ecc:plan.data_code_length + (b + 1) * ecc]
+
+    syndromes = calc_syndromes(blocks, ecc)
+    corrected = [0] * plan.block_num
+    data_code = []
+    for b, length in enumerate(plan.data_lengths):
+        msg = blocks[b, n - length - ecc:]
+        if syndromes[b].any():
+            msg, corrected[b] = rs_correct(msg.tolist(), syndromes[b].tolist(), ecc)
+        data_code.extend(int(c) for c in msg[:length])
+
+    data, structured_append = parse(data_code, version)
+    return DecodeResult(data, version, level, mask_pattern, corrected, structured_append)
+
+
+def verify(masked_matrix, data):
+    """masked_matrixがdata(strまたはbytes)に復号できるかを返す"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    try:
+        return decode(masked_matrix).data == data
+    except DecodeError:
+        return False
@@ -1,7 +1,7 @@
 from .constants import R, G, B, W, K
-from PIL import Image
-from scipy import signal
+from . import demosaic
 import numpy as np
+import functools
 
 class BayerFilter:
     # R = np.array([255,0,0])
@@ -37,9 +37,11 @@ class BayerFilter:
     def zoom(self, n):
         self.width *= n
         self.height *= n
-        self.image = self.image.resize((self.width,self.height), resample=Image.BOX)
+        from PIL import Image
+        self.image = Image.fromarray(self.repeat(np.asarray(self.image), n))
 
     def makeImage(self):
+        from PIL import Image
         self.image = Image.fromarray(np.uint8(self.bayerfilter)).convert('RGB')
 
     def makeBayerFilter(self):
@@ -48,50 +50,40 @@ class BayerFilter:
         else:
             bayerfilter = self.pix_r
 
-        bayerfilter = self._hstack(bayerfilter, self.width)
-        bayerfilter = self._vstack(bayerfilter, self.height)
+        self.bayerfilter = self.tile(bayerfilter, self.width, self.height)
 
-        self.bayerfilter = bayerfilter
+    @classmethod
+    def tile(cls, pix, width, height, zoom=1):
+        """
+        pixを横にwidth個、縦にheight個並べ、zoom倍したuint8のfilterを返す。
 
-    def _vstack(self, array, w):
-        if w == 1:
-            return array
-        
-        if w % 2 == 0:
-            half = self._vstack(array, w//2)
-            return np.vstack((half, half))
-        else:
-            return np.vstack((self._vstack(array, w-1), array))
-            
-    def _hstack(self, array, w):
-        if w == 1:
+        同じ(pix, サイズ, zoom)の結果はcacheされ、同じ読み取り専用の配列を返す。
+        """
+        pix = np.asarray(pix, dtype=np.uint8)
+        return cls._tile(pix.tobytes(), pix.shape, width, height, zoom)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def _tile(pix_bytes, pix_shape, width, height, zoom):
+        pix = np.frombuffer(pix_bytes, dtype=np.uint8).reshape(pix_shape)
+        bayerfilter = BayerFilter.repeat(np.tile(pix, (height, width, 1)), zoom)
+        bayerfilter.setflags(write=False)
+        return bayerfilter
+
+    @staticmethod
+    def repeat(array, n):
+        if n == 1:
             return array
-        
-        if w % 2 == 0:
-            half = self._hstack(array, w//2)
-            return np.hstack((half, half))
-        else:
-            return np.hstack((self._hstack(array, w-1), array))
-
-    def demosaic(self):
-        r = np.delete(self.bayerfilter, [1,2], 2).reshape(self.width*2, self.height*2)
-        g = np.delete(self.bayerfilter, [0,2], 2).reshape(self.width*2, self.height*2)
-        b = np.delete(self.bayerfilter, [0,1], 2).reshape(self.width*2, self.height*2)
-        print(r)
-        f = [
-            [1/9,1/9,1/9],
-            [1/9,1/9,1/9],
-            [1/9,1/9,1/9]
-        ]
-        rnew = signal.convolve2d(r, np.array(f), 'same')
-        gnew = signal.convolve2d(g, np.array(f), 'same')
-        bnew = signal.convolve2d(b, np.array(f), 'same')
-
-        rnew = rnew[:, :, np.newaxis]
-        gnew = gnew[:, :, np.newaxis]
-        bnew = bnew[:, :, np.newaxis]
-        
-        self.bayerfilter = np.concatenate((rnew, gnew, bnew), axis=2)
+        return np.repeat(np.repeat(array, n, axis=0), n, axis=1)
+
+    def demosaic(self, method="bilinear", pattern="RGGB"):
+        """
+        filterをカメラのセンサ(CFA: pattern)でサンプルし、methodでdemosaicした結果をbayerfilterにsetする。
+
+        methodは"bilinear"または"mhc"(demosaic.demosaicを参照)。
+        """
+        raw = demosaic.mosaic(self.bayerfilter, pattern)
+        self.bayerfilter = np.clip(demosaic.demosaic(raw, pattern, method), 0, 255)
 
 if __name__ == '__main__':
     f = BayerFilter(50, 50)
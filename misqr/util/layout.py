@@ -0,0 +1,101 @@
+from .rs import rs
+from . import artifacts
+import functools
+import numpy as np
+
+
+class LayoutPlan:
+    """
+    (バージョン, 誤り訂正レベル)ごとのブロック構成とインターリーブの配置。
+
+    Attributes
+    --------
+    version: int
+    error_correct_level: int
+    block_num: int
+        ブロック数
+    code_length: int
+        全コード語数
+    data_code_length: int
+        データコード語数
+    error_code_length: int
+        ブロックごとの誤り訂正コード語数(全ブロック共通)
+    blocks_info: list
+        ブロックごとの[ブロック数, コード語数, データコード語数](rsの行)
+    data_lengths: ndarray
+        ブロックごとのデータコード語数
+    data_offsets: ndarray
+        データコード語列におけるブロックの先頭位置
+    possible_error: list
+        ブロックごとに訂正可能な最大エラー数
+    block_index: ndarray
+        ブロック順に連結したコード語列の各コード語が属するブロック
+    permutation: ndarray
+        ブロック順に連結したコード語列(データ語 + 誤り訂正語)から配置順のコード語列へのindex
+    inverse_permutation: ndarray
+        permutationの逆置換
+    """
+
+    def __init__(self, version, error_correct_level):
+        self.version = version
+        self.error_correct_level = error_correct_level
+
+        block_info = rs[(version-1) * 4 + error_correct_level]
+        self.blocks_info = []
+        for i in range(len(block_info) // 3):
+            sub_block_info = block_info[i*3: i*3+3]
+            for _ in range(sub_block_info[0]):
+                self.blocks_info.append(sub_block_info)
+
+        self.block_num = len(self.blocks_info)
+        self.data_lengths = np.array([info[2] for info in self.blocks_info])
+        self.data_offsets = np.concatenate(([0], np.cumsum(self.data_lengths)[:-1]))
+        self.data_code_length = int(self.data_lengths.sum())
+        self.code_length = sum(info[1] for info in self.blocks_info)
+        self.error_code_length = (self.code_length - self.data_code_length) // self.block_num
+        self.possible_error = [self.error_code_length // 2] * self.block_num
+        blocks = np.arange(self.block_num)
+        self.block_index = np.concatenate((np.repeat(blocks, self.data_lengths), np.repeat(blocks, self.error_code_length)))
+
+        key = "%d/%d" % (version, error_correct_level)
+        self.permutation = artifacts.lookup("permutation/" + key, None)
+        self.inverse_permutation = artifacts.lookup("inverse_permutation/" + key, None)
+        if self.permutation is None or self.inverse_permutation is None:
+            self.permutation, self.inverse_permutation = self._permutations()
+        for array in (self.data_lengths, self.data_offsets, self.block_index, self.permutation, self.inverse_permutation):
+            array.setflags(write=False)
+
+    def _permutations(self):
+        """(permutation, inverse_permutation)を計算する"""
+        data_permutation = self._interleave_index(self.data_offsets, self.data_lengths)
+        error_offsets = self.data_code_length + np.arange(self.block_num) * self.error_code_length
+        error_lengths = np.full(self.block_num, self.error_code_length)
+        error_permutation = self._interleave_index(error_offsets, error_lengths)
+
+        permutation = np.concatenate((data_permutation, error_permutation))
+        return permutation, np.argsort(permutation)
+
+    @staticmethod
+    def _interleave_index(offsets, lengths):
+        # column-major walk over the blocks, skipping the columns short blocks do not have
+        columns = np.arange(lengths.max())
+        index = offsets[:, None] + columns[None, :]
+        exists = columns[None, :] < lengths[:, None]
+        return index.T[exists.T]
+
+    def split(self, data_code):
+        """データコード語列をブロックごとに分割する"""
+        return np.split(np.asarray(data_code), self.data_offsets[1:])
+
+    def interleave(self, code):
+        """ブロック順のコード語列(データ語 + 誤り訂正語)を配置順に並べ替える"""
+        return np.take(code, self.permutation)
+
+    def deinterleave(self, code):
+        """配置順のコード語列をブロック順(データ語 + 誤り訂正語)に戻す"""
+        return np.take(code, self.inverse_permutation)
+
+
+@functools.lru_cache(maxsize=None)
+def get_layout(version, error_correct_level):
+    return LayoutPlan(version, error_correct_level)
@@ -0,0 +1,151 @@
+from .table import PATTERN_POSITION_TABLE
+from . import artifacts
+import functools
+import numpy as np
+
+MASK_FUNCTIONS = [
+    (lambda i ,j: 1 if (i+j) % 2 == 0 else 0),
+    (lambda i ,j: 1 if i % 2 == 0 else 0),
+    (lambda i ,j: 1 if j % 3 == 0 else 0),
+    (lambda i ,j: 1 if (i+j) % 3 == 0 else 0),
+    (lambda i ,j: 1 if (i // 2 + j // 3) % 2 == 0 else 0),
+    (lambda i ,j: 1 if (i*j) % 2 + (i*j) % 3 == 0 else 0),
+    (lambda i ,j: 1 if ((i*j) % 2 + (i*j) % 3) % 2 == 0 else 0),
+    (lambda i ,j: 1 if ((i+j) % 2 + (i*j) % 3) % 2 == 0 else 0),
+]
+
+
+def symbol_size(version):
+    return 17 + version * 4
+
+
+def _read_only(array):
+    array.setflags(write=False)
+    return array
+
+
+@functools.lru_cache(maxsize=None)
+def function_mask(version):
+    """
+    機能パターン(位置検出・タイミング・位置合わせ・形式情報・型番情報)の領域をTrueとするbool配列を返す。
+    """
+    return artifacts.lookup("function_mask/%d" % version, _function_mask, version)
+
+
+def _function_mask(version):
+    w = symbol_size(version)
+    mask = np.zeros((w, w), dtype=bool)
+
+    # position patterns with separators and format information
+    mask[:9, :9] = True
+    mask[:9, -8:] = True
+    mask[-8:, :9] = True
+
+    # alignment patterns overlapping the position patterns are skipped
+    positions = PATTERN_POSITION_TABLE[version - 1]
+    for y in positions:
+        for x in positions:
+            if mask[y, x]: continue
+            mask[y-2:y+3, x-2:x+3] = True
+
+    # timing patterns
+    mask[6, :] = True
+    mask[:, 6] = True
+
+    if version >= 7:
+        mask[:6, -11:-8] = True
+        mask[-11:-8, :6] = True
+
+    return _read_only(mask)
+
+
+@functools.lru_cache(maxsize=None)
+def placement_map(version):
+    """
+    コード語のbitを配置順に並べたときの、各bitのmodule位置(y * w + x)を返す。
+
+    コード語に使われない残余bitの位置も末尾に含む。
+    """
+    return artifacts.lookup("placement_map/%d" % version, _placement_map, version)
+
+
+def _placement_map(version):
+    w = symbol_size(version)
+    reserved = function_mask(version)
+    index = []
+    upward = True
+    for right in range(w - 1, 0, -2):
+        if right <= 6:
+            right -= 1
+        rows = range(w - 1, -1, -1) if upward else range(w)
+        for y in rows:
+            for x in (right, right - 1):
+                if not reserved[y, x]:
+                    index.append(y * w + x)
+        upward = not upward
+    return _read_only(np.array(index, dtype=np.intp))
+
+
+@functools.lru_cache(maxsize=None)
+def mask_plane(version, mask_pattern):
+    """マスクパターンをsymbol全体に評価したuint8配列を返す"""
+    planes = artifacts.lookup("mask_planes/%d" % version, None)
+    if planes is not None:
+        return planes[mask_pattern]
+    return _mask_plane(version, mask_pattern)
+
+
+def _mask_plane(version, mask_pattern):
+    w = symbol_size(version)
+    i, j = np.indices((w, w))
+    func = MASK_FUNCTIONS[mask_pattern]
+    plane = np.vectorize(func, otypes=[np.uint8])(i, j)
+    return _read_only(plane)
+
+
+@functools.lru_cache(maxsize=None)
+def function_patterns(version):
+    """
+    機能パターンのmoduleの値を返す(機能パターン以外と、形式情報の領域は0)。
+
+    形式情報(誤り訂正レベルとマスクパターン)を書き込めば、データを置く前のQRコードになる。
+    """
+    return artifacts.lookup("function_patterns/%d" % version, _function_patterns, version)
+
+
+def _function_patterns(version):
+    from .bch import gf_poly_div, G18
+    w = symbol_size(version)
+    patterns = np.zeros((w, w), dtype=np.uint8)
+
+    # position patterns; the separators around them stay 0
+    finder = np.ones((7, 7), dtype=np.uint8)
+    finder[1:-1, 1:-1] = 0
+    finder[2:-2, 2:-2] = 1
+    patterns[:7, :7] = patterns[:7, -7:] = patterns[-7:, :7] = finder
+
+    # alignment patterns, except where they would overlap the position patterns
+    alignment = np.ones((5, 5), dtype=np.uint8)
+    alignment[1:-1, 1:-1] = 0
+    alignment[2, 2] = 1
+    positions = PATTERN_POSITION_TABLE[version - 1]
+    for y in positions:
+        for x in positions:
+            if (y < 8 or y >= w - 8) and x < 8 or y < 8 and x >= w - 8: continue
+            patterns[y-2:y+3, x-2:x+3] = alignment
+
+    # timing patterns and the dark module
+    timing = (np.arange(8, w - 7) + 1) % 2
+    patterns[6, 8:w-7] = timing
+    patterns[8:w-7, 6] = timing
+    patterns[-8, 8] = 1
+
+    if version >= 7:
+        bits = [(version >> (5 - i)) & 1 for i in range(6)]
+        bits += gf_poly_div(bits + [0] * 12, G18)[-1]
+        # bit i * 3 + j goes to (5 - i, -9 - j) and its transpose
+        block = np.array(bits, dtype=np.uint8).reshape(6, 3)[::-1, ::-1]
+        patterns[:6, -11:-8] = block
+        patterns[-11:-8, :6] = block.T
+
+    return _read_only(patterns)
@@ -0,0 +1,306 @@
+"""
+PNGを書き出す。
+
+白黒のQRコードは1bitのグレースケール、Whimの候補やQashのように色の少ない画像は1-8bitのパレットで書き、
+zlibの圧縮レベル・フィルタ・戦略を選べる。画像はmodule単位(1module 1px)のまま色を調べてから拡大するので、
+大きなbox_sizeでも色の集計は小さな配列で済む。
+zlibの圧縮はGILを解放するので、PNGEncoder.encode_allは複数の画像をthread poolで並列に書き出す。
+
+    encoder = PNGEncoder(level=9, workers=4)
+    data = encoder.encode_modules(qr.masked_matrix, box_size=10, border=4)
+    for result in encoder.encode_all([qr.image for qr in symbols], box_size=10, border=4):
+        result.data, result.nbytes, result.ms
+"""
+from . import stats as _stats
+from time import perf_counter_ns
+import os
+import struct
+import sys
+import zlib
+import numpy as np
+
+SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# color types
+GRAY, RGB, PALETTE = 0, 2, 3
+CHANNELS = {GRAY: 1, RGB: 3, PALETTE: 1}
+FILTERS = {"none": 0, "sub": 1, "up": 2}
+STRATEGIES = {
+    "default": zlib.Z_DEFAULT_STRATEGY,
+    "filtered": zlib.Z_FILTERED,
+    "rle": zlib.Z_RLE,
+    "huffman": zlib.Z_HUFFMAN_ONLY,
+}
+WHITE = (255, 255, 255)
+
+
+class EncodedPNG:
+    """
+    PNGEncoder.encode_allの結果。
+
+    Attributes
+    --------
+    data: bytes
+        PNGファイルの内容
+    nbytes: int
+        PNGのbyte数
+    ms: float
+        書き出しにかかった時間[ms]
+    """
+    __slots__ = ("data", "nbytes", "ns")
+
+    def __init__(self, data, ns):
+        self.data = data
+        self.nbytes = len(data)
+        self.ns = ns
+
+    @property
+    def ms(self):
+        return self.ns / 1e6
+
+    def __repr__(self):
+        return "EncodedPNG(nbytes=%d, ms=%.3f)" % (self.nbytes, self.ms)
+
+
+def chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(data, zlib.crc32(kind)))
+
+
+def filter_rows(rows, filter="none", bpp=1):
+    """
+    (h, 1行のbyte数)のuint8配列の各行にフィルタをかけ、先頭にフィルタ種別を付けた(h, 1 + 1行のbyte数)を返す。
+
+    bppは1画素のbyte数(8bit未満の場合は1)。
+    """
+    kind = FILTERS[filter]
+    out = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+    out[:, 0] = kind
+    if kind == 0:
+        out[:, 1:] = rows
+    elif kind == 1:
+        # difference from the byte bpp to the left (uint8 arithmetic wraps like the spec)
+        out[:, 1:1 + bpp] = rows[:, :bpp]
+        np.subtract(rows[:, bpp:], rows[:, :-bpp], out=out[:, 1 + bpp:])
+    else:
+        # difference from the row above; repeated rows of a scaled symbol become all zero
+        out[0, 1:] = rows[0]
+        np.subtract(rows[1:], rows[:-1], out=out[1:, 1:])
+    return out
+
+
+def write(rows, width, bit_depth, color_type, palette=None, level=6, filter="none", strategy="default"):
+    """
+    packされた行の配列からPNGのbytesを作る。
+
+    Parameters
+    --------
+    rows : ndarray
+        (h, 1行のbyte数)のuint8配列
+    width : int
+        画素数での幅
+    bit_depth : int
+        1, 2, 4, 8
+    color_type : int
+        GRAY, RGB, PALETTE
+    palette : array_like
+        color_type=PALETTEの場合の(n, 3)の色
+    level : int
+        zlibの圧縮レベル(0-9)
+    filter : str
+        "none", "sub", "up"
+    strategy : str
+        "default", "filtered", "rle", "huffman"
+    """
+    bpp = max(1, bit_depth * CHANNELS[color_type] // 8)
+    raw = filter_rows(rows, filter, bpp)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 15, 9, STRATEGIES[strategy])
+    body = compressor.compress(raw) + compressor.flush()
+
+    parts = [SIGNATURE, chunk(b"IHDR", struct.pack(">IIBBBBB", width, len(rows), bit_depth, color_type, 0, 0, 0))]
+    if palette is not None:
+        parts.append(chunk(b"PLTE", np.asarray(palette, dtype=np.uint8).tobytes()))
+    parts += [chunk(b"IDAT", body), chunk(b"IEND", b"")]
+    return b"".join(parts)
+
+
+def pack(index, bit_depth):
+    """(h, w)の画素値(< 2 ** bit_depth)を、1行ごとにbit_depth bitずつ詰めた(h, 1行のbyte数)にする"""
+    index = np.asarray(index, dtype=np.uint8)
+    if bit_depth == 8:
+        return index
+    if bit_depth == 1:
+        return np.packbits(index, axis=1)
+    per_byte = 8 // bit_depth
+    h, w = index.shape
+    padded = np.zeros((h, -(-w // per_byte) * per_byte), dtype=np.uint8)
+    padded[:, :w] = index
+    # the i-th pixel of every byte is shifted into place with one strided slice
+    rows = padded[:, 0::per_byte] << (8 - bit_depth)
+    for i in range(1, per_byte):
+        rows |= padded[:, i::per_byte] << (8 - bit_depth * (i + 1))
+    return rows
+
+
+def scale(index, box_size=1, border=0, fill=0):
+    """(h, w, ...)の配列を一辺box_size倍にし、周りにborder * box_size[px]のfillを付ける"""
+    if box_size > 1:
+        index = np.repeat(np.repeat(index, box_size, axis=0), box_size, axis=1)
+    if border:
+        margin = border * box_size
+        index = np.pad(index, [(margin, margin)] * 2 + [(0, 0)] * (index.ndim - 2), constant_values=fill)
+    return index
+
+
+def bit_depth(colors):
+    for depth in (1, 2, 4, 8):
+        if colors <= 1 << depth:
+            return depth
+    return None
+
+
+def rgb(color):
+    from PIL import ImageColor
+    return ImageColor.getrgb(color)[:3]
+
+
+class PNGEncoder:
+    """
+    QRコード・Whim・Qashの画像をPNGにする。
+
+    Attributes
+    --------
+    level: int
+        zlibの圧縮レベル(0-9)
+    filter: str
+        行のフィルタ("none", "sub", "up")。1bitのシンボルは"none"が最も小さくなる(benchmarks/bench_png.py)
+    strategy: str
+        zlibの戦略("default", "filtered", "rle", "huffman")
+    workers: int
+        encode_allで使うthread数(Noneの場合はCPU数)
+    stats: Stats
+        処理時間とカウンタの記録先(Noneの場合は記録しない)
+    """
+
+    def __init__(self, level=6, filter="none", strategy="default", workers=None, stats=None):
+        if filter not in FILTERS:
+            raise ValueError("unknown filter %r (%s)" % (filter, ", ".join(FILTERS)))
+        if strategy not in STRATEGIES:
+            raise ValueError("unknown strategy %r (%s)" % (strategy, ", ".join(STRATEGIES)))
+        self.level = level
+        self.filter = filter
+        self.strategy = strategy
+        self.workers = workers
+        self.stats = _stats.resolve(stats)
+
+    @classmethod
+    def add_arguments(cls, parser):
+        """CLIにPNGの書き出しのoptionを加える(from_argumentsで読む)"""
+        parser.add_argument("--png-level", type=int, choices=range(10), default=6, metavar="0-9", help="zlib level")
+        parser.add_argument("--png-filter", choices=list(FILTERS), default="none")
+        parser.add_argument("--png-strategy", choices=list(STRATEGIES), default="default")
+        parser.add_argument("--png-workers", type=int, help="encoding threads (default: CPU count)")
+
+    @classmethod
+    def from_arguments(cls, args, stats=None):
+        return cls(args.png_level, args.png_filter, args.png_strategy, args.png_workers, stats)
+
+    def write(self, rows, width, bit_depth, color_type, palette=None):
+        return write(rows, width, bit_depth, color_type, palette, self.level, self.filter, self.strategy)
+
+    def encode_modules(self, matrix, box_size=1, border=0, color="#000000"):
+        """
+        module配列(1が暗)を1bitのPNGにする。
+
+        colorが黒の場合はグレースケール、それ以外は(白, color)の2色のパレットにする。
+        """
+        dark = scale(np.asarray(matrix, dtype=bool), box_size, border)
+        with self.stats.stage("png.encode"):
+            if color in (None, "#000000", "black"):
+                data = self.write(pack(~dark, 1), dark.shape[1], 1, GRAY)
+            else:
+                data = self.write(pack(dark, 1), dark.shape[1], 1, PALETTE, [WHITE, rgb(color)])
+        self.stats.count("png_bytes", len(data))
+        return data
+
+    def encode_image(self, image, box_size=1, border=0):
+        """
+        画像(PIL.Imageまたは(h, w), (h, w, 3)の配列)をPNGにする。
+
+        白黒だけなら1bitのグレースケール、256色以下なら1-8bitのパレット、それ以外は24bitのRGBにする。
+        色は拡大する前の画像で調べ、余白は白にする。
+        """
+        pixels = np.asarray(image.convert("RGB") if hasattr(image, "convert") else image)
+        if pixels.dtype == bool:
+            pixels = pixels.astype(np.uint8) * 255
+        if pixels.ndim == 2:
+            pixels = np.repeat(pixels[:, :, None], 3, axis=2)
+        pixels = pixels[:, :, :3].astype(np.uint8)
+
+        with self.stats.stage("png.encode"):
+            key = (pixels[:, :, 0].astype(np.uint32) << 16) | (pixels[:, :, 1].astype(np.uint32) << 8) | pixels[:, :, 2]
+            if border:
+                key = np.pad(key, 1, constant_values=0xffffff)  # white for the border
+            colors, index = np.unique(key, return_inverse=True)
+            index = index.reshape(key.shape)
+            if border:
+                index = index[1:-1, 1:-1]
+            palette = np.stack(((colors >> 16) & 0xff, (colors >> 8) & 0xff, colors & 0xff), axis=1)
+            white = int(np.searchsorted(colors, 0xffffff)) if border else 0
+
+            depth = bit_depth(len(colors))
+            if len(colors) <= 2 and set(colors.tolist()) <= {0, 0xffffff}:
+                # black and white: the gray level is the bit itself
+                gray = scale(palette[index, 0] == 255, box_size, border, True)
+                data = self.write(pack(gray, 1), gray.shape[1], 1, GRAY)
+            elif depth is not None:
+                index = scale(index.astype(np.uint8), box_size, border, white)
+                data = self.write(pack(index, depth), index.shape[1], depth, PALETTE, palette)
+            else:
+                pixels = scale(pixels, box_size, border, 255)
+                data = self.write(pixels.reshape(pixels.shape[0], -1), pixels.shape[1], 8, RGB)
+        self.stats.count("png_bytes", len(data))
+        return data
+
+    def encode(self, item, box_size=1, border=0, modules=False):
+        """
+        module配列(masked_matrixなど)はencode_modules、PIL.Imageとそれ以外の配列はencode_imageで書き出す。
+
+        module配列として扱うのはboolの配列かmodules=Trueの場合だけで、0/1の値のuint8の配列も
+        modules=Falseなら画素値(0は黒)として書き出す。
+        """
+        if not hasattr(item, "convert"):
+            array = np.asarray(item)
+            if modules or array.dtype == np.bool_:
+                return self.encode_modules(array, box_size, border)
+        return self.encode_image(item, box_size, border)
+
+    def encode_all(self, items, box_size=1, border=0, modules=False):
+        """
+        複数の画像をthread poolで書き出し、EncodedPNGのリストを返す(modulesはencodeと同じ)。
+
+        時間とbyte数は一つずつ測り、statsにはまとめて記録する(Statsはthreadから同時に書き込まない)。
+        """
+        from concurrent.futures import ThreadPoolExecutor  # imported on first use to keep startup light
+        plain = PNGEncoder(self.level, self.filter, self.strategy)
+
+        def run(item):
+            start = perf_counter_ns()
+            data = plain.encode(item, box_size, border, modules)
+            return EncodedPNG(data, perf_counter_ns() - start)
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            results = list(pool.map(run, items))
+        for result in results:
+            self.stats.add_time("png.encode", result.ns)
+            self.stats.count("png_bytes", result.nbytes)
+        return results
+
+
+def save_all(directory, names, results, file=None):
+    """encode_allの結果をdirectoryにnamesの名前で保存し、画像ごとのbyte数と時間をfile(既定はsys.stdout)に書く"""
+    file = file if file is not None else sys.stdout
+    os.makedirs(directory, exist_ok=True)
+    for name, result in zip(names, results):
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(result.data)
+        file.write("%-24s %8d bytes %8.3f ms\n" % (name, result.nbytes, result.ms))
+    file.write("%-24s %8d bytes %8.3f ms\n" % ("total", sum(r.nbytes for r in results), sum(r.ms for r in results)))
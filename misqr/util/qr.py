@@ -1,10 +1,14 @@
 from .block import Block
+from .layout import get_layout
+from .placement import placement_map, mask_plane, function_mask, function_patterns, symbol_size
+from .decoder import format_positions, format_words
 from .bitarray import Bitarray
-from .table import PATTERN_POSITION_TABLE
-from .bch import gf_poly_div, G15, G18
-from PIL import Image, ImageColor
-import reedsolo
+from .capacity import capacity, fit_version, instruction_bit_length, parse_version, CAPACITY_TABLE, STRUCTURED_APPEND_CAPACITY_TABLE
+from . import stats as _stats
+from . import terminal
 import numpy
+import copy
+import sys
 
 
 # Only Support Simgle Encoding Mode
@@ -14,35 +18,162 @@ class QR():
     ERROR_CORRECT_Q = 2
     ERROR_CORRECT_H = 3
 
-    def __init__(self, data, version, error_correct_level, mask_pattern=0b000, color="#000000"):
+    # modules are stored packed (1 bit each) in _packed; masked_matrix (unpacked once, read-only) and image are built from them
+    __slots__ = ("data", "error_correct_level", "mode", "color", "version", "mask_pattern", "w", "h",
+                 "keep_intermediates", "encoded_bit_array", "encoded_byte_array", "data_code",
+                 "data_blocks", "error_blocks", "processed_code", "processed_data_code",
+                 "processed_error_code", "matrix", "stats", "structured_append", "_packed", "_matrix",
+                 "_image")
+
+    def __init__(self, data, version, error_correct_level, mask_pattern=0b000, color="#000000", keep_intermediates=True,
+                 stats=None, structured_append=None):
         self.data = data
-        self.version = version
+        # (symbol position, total symbols, parity) when the symbol is part of a structured append set
+        self.structured_append = structured_append
+        # stages are timed into stats (misqr.util.stats.Stats) when given
+        self.stats = stats = _stats.resolve(stats)
         self.error_correct_level = error_correct_level
 
         self.mode = self.data_analiyze(self.data)
         self.color = color
 
-        self.encoded_bit_array = self.data_encode(self.data)
-        self.encoded_byte_array = self.encoded_bit_array.to_bytes_array()
+        # version="auto" selects the smallest version the data fits in
+        data_length = len(self.data.encode("utf-8"))
+        table = CAPACITY_TABLE if structured_append is None else STRUCTURED_APPEND_CAPACITY_TABLE
+        if version == "auto":
+            version = fit_version(data_length, self.error_correct_level, self.mode, table)
+        elif data_length > capacity(version, self.error_correct_level, self.mode, table):
+            raise ValueError("data is too long for version %d: %d > %d"
+                             % (version, data_length, capacity(version, self.error_correct_level, self.mode, table)))
+        self.version = version
 
-        block_length, code_length, data_code_length, blocks_info = Block.get_block_info(self.version, self.error_correct_level)
-        self.data_code = self.weed_padding(self.encoded_byte_array, data_code_length)
-        self.data_blocks = Block.divide_into_block(self.encoded_byte_array, self.version, self.error_correct_level)
+        plan = get_layout(self.version, self.error_correct_level)
+        with stats.stage("qr.encode"):
+            self.encoded_bit_array = self.data_encode(self.data)
+            self.encoded_byte_array = self.encoded_bit_array.to_bytes_array()
+            self.data_code = self.weed_padding(self.encoded_byte_array, plan.data_code_length)
 
-        error_code_length = (code_length - data_code_length) // block_length
-        self.error_blocks = [block.calculate_error_correction_code(error_code_length) for block in self.data_blocks]
+        with stats.stage("qr.split"):
+            self.data_blocks = Block.divide_into_block(self.encoded_byte_array, self.version, self.error_correct_level)
+        with stats.stage("qr.rs"):
+            self.error_blocks = Block.calculate_error_correction_codes(self.data_blocks, plan.error_code_length)
+        stats.count("rs_calls", len(self.data_blocks))
 
-        self.processed_data_code = Block.integrate([block.code for block in self.data_blocks]).code
-        self.processed_error_code = Block.integrate(self.error_blocks).code
-        self.processed_code = self.processed_data_code + self.processed_error_code
+        with stats.stage("qr.interleave"):
+            self.arrange_code()
 
         # For test, mask pattern is fixed
         self.mask_pattern = mask_pattern
 
-        self.matrix = self.make_matrix(Bitarray(self.processed_code).array)
-
-        self.masked_matrix = self.mask(self.mask_pattern)
-        self.image = self.make_image(self.masked_matrix, self.color)
+        with stats.stage("qr.matrix"):
+            self.matrix = self.make_matrix(numpy.unpackbits(numpy.asarray(self.processed_code, dtype=numpy.uint8)))
+
+        with stats.stage("qr.mask"):
+            self.masked_matrix = self.mask(self.mask_pattern)
+        self._image = None
+        stats.count("qr_built")
+
+        # keep_intermediates=False keeps only the packed modules (see drop_intermediates)
+        self.keep_intermediates = keep_intermediates
+        if not keep_intermediates:
+            self.drop_intermediates()
+
+    @property
+    def masked_matrix(self):
+        """
+        maskしたmodule配列(h, w)。読み取り専用で、setterで置き換えるまで同じ配列を返す。
+
+        変更する場合はコピーを書き換えてから qr.masked_matrix = matrix で設定すること(imageも作り直される)。
+        """
+        if self._matrix is None:
+            matrix = numpy.unpackbits(self._packed, count=self.w * self.h).reshape(self.h, self.w)
+            matrix.setflags(write=False)
+            self._matrix = matrix
+        return self._matrix
+
+    @masked_matrix.setter
+    def masked_matrix(self, matrix):
+        self._packed = numpy.packbits(numpy.asarray(matrix, dtype=numpy.uint8))
+        self._matrix = None
+        self._image = None
+
+    @property
+    def image(self):
+        # built on first access
+        if self._image is None:
+            with self.stats.stage("qr.render"):
+                self._image = self.make_image(self.masked_matrix, self.color)
+        return self._image
+
+    @image.setter
+    def image(self, image):
+        self._image = image
+
+    def png(self, box_size=10, border=4, level=6, filter="none", strategy="default"):
+        """masked matrixを1bitのPNGのbytesにする(misqr.util.png)。colorが黒以外なら2色のパレット"""
+        from .png import PNGEncoder
+        return PNGEncoder(level, filter, strategy, stats=self.stats).encode_modules(self.masked_matrix, box_size, border, self.color)
+
+    @classmethod
+    def restore(cls, data, version, error_correct_level, processed_code, packed, mask_pattern=0b000, color="#000000",
+                stats=None):
+        """
+        保存したprocessed_codeとmasked matrix(packbits)からQRオブジェクトを作り直す(QRCacheのディスク上のcache)。
+
+        誤り訂正符号の計算とmaskは行わず、data_blocks・error_blocks・matrixはprocessed_codeから復元するので、
+        copyやset_blocks(Qash)もそのまま使える。
+
+        Parameters
+        --------
+        processed_code : bytes
+            配置順のコード語列
+        packed : bytes
+            masked matrixをnumpy.packbitsしたもの
+        """
+        qr = cls.__new__(cls)
+        qr.data = data
+        qr.structured_append = None
+        qr.stats = _stats.resolve(stats)
+        qr.error_correct_level = error_correct_level
+        qr.mode = qr.data_analiyze(data)
+        qr.color = color
+        qr.version = version
+        qr.mask_pattern = mask_pattern
+
+        plan = get_layout(version, error_correct_level)
+        qr.encoded_bit_array = qr.data_encode(data)
+        qr.encoded_byte_array = qr.encoded_bit_array.to_bytes_array()
+        qr.data_code = qr.weed_padding(qr.encoded_byte_array, plan.data_code_length)
+        qr.data_blocks = Block.divide_into_block(qr.encoded_byte_array, version, error_correct_level)
+        code = plan.deinterleave(numpy.frombuffer(processed_code, dtype=numpy.uint8))
+        qr.error_blocks = code[plan.data_code_length:].reshape(plan.block_num, plan.error_code_length).tolist()
+        qr.processed_code = list(processed_code)
+        qr.processed_data_code = qr.processed_code[:plan.data_code_length]
+        qr.processed_error_code = qr.processed_code[plan.data_code_length:]
+
+        qr.matrix = qr.make_matrix(numpy.unpackbits(numpy.frombuffer(processed_code, dtype=numpy.uint8)))
+        qr._packed = numpy.frombuffer(packed, dtype=numpy.uint8)
+        qr._matrix = qr._image = None
+        qr.keep_intermediates = True
+        return qr
+
+    def drop_intermediates(self):
+        # free the build-stage artifacts; masked_matrix, image and render_code keep working,
+        # set_blocks and copy need a QR built with keep_intermediates=True
+        self.encoded_bit_array = self.encoded_byte_array = self.data_code = None
+        self.data_blocks = self.error_blocks = None
+        self.processed_code = self.processed_data_code = self.processed_error_code = None
+        self.matrix = None
+        self.keep_intermediates = False
+
+    @property
+    def flag_matrix(self):
+        # function pattern modules of matrix, None where code is placed and masked
+        if self.matrix is None:
+            return None
+        reserved = function_mask(self.version)
+        return [[int(value) if flag else None for value, flag in zip(row, flags)]
+                for row, flags in zip(self.matrix.tolist(), reserved.tolist())]
 
     def data_analiyze(self, data):
         # 0b0001: neric mode
@@ -57,29 +188,26 @@ class QR():
 
         data_length = len(encoded_data)
         instruction_bit_length = self.get_instruction_bit_length(self.version, self.mode)
-        data_length_instruction = Bitarray([data_length], instruction_bit_length)
+        data_length_instruction = Bitarray(data_length.to_bytes(2, "big"), instruction_bit_length)
 
         encoded_data_bitarray = Bitarray(encoded_data)
 
-        return mode_instruction + data_length_instruction + encoded_data_bitarray
+        encoded = mode_instruction + data_length_instruction + encoded_data_bitarray
+        if self.structured_append is not None:
+            encoded = self.structured_append_header(*self.structured_append) + encoded
+
+        # terminator 0000, shortened when the symbol is full
+        room = get_layout(self.version, self.error_correct_level).data_code_length * 8 - len(encoded.array)
+        encoded.array += [False] * min(4, room)
+        return encoded
+
+    def structured_append_header(self, position, total, parity):
+        if not 0 <= position < total <= 16:
+            raise ValueError("invalid structured append position: %d of %d" % (position, total))
+        return Bitarray([0b0011], 4) + Bitarray([position], 4) + Bitarray([total - 1], 4) + Bitarray([parity], 8)
 
     def get_instruction_bit_length(self, version, mode):
-        length_table = [[10,9,8,8], #1-9
-                        [12,11,16,10], #10-26
-                        [14,13,16,12], #27-40
-                        ]
-        def mode_to_index(mode):
-            for i in range(4):
-                if (mode >> i) & 1:
-                    return i
-
-        index = mode_to_index(mode)
-        if version < 10:
-            return length_table[0][index]
-        elif version < 27:
-            return length_table[1][index]
-        else:
-            return length_table[2][index]
+        return instruction_bit_length(version, mode)
 
     def weed_padding(self, data_code, data_code_length):
         WEEDS = [0b11101100, 0b00010001]
@@ -91,164 +219,24 @@ class QR():
         return data_code
 
     def make_matrix(self, code_bit_array):
-        matrix = self.init_matrix()
-        matrix = self.set_position_pattern(matrix)
-        matrix = self.set_position_pattern2(matrix)
-        matrix = self.set_timing_pattern(matrix)
-        matrix = self.set_dark_module(matrix)
-        matrix = self.set_format_information(matrix)
-
-        if self.version >= 7:
-            matrix = self.set_version_information(matrix)
-
-        self.flag_matrix = [[value for value in row] for row in matrix]
-        matrix = self.put(matrix, code_bit_array)
-        matrix = self.fill_rest(matrix)
-
-        return matrix
-
-    def init_matrix(self):
-        self.w = self.h = w = h = 17 + self.version * 4
-        matrix = [[None for col in range(w)] for row in range(h)]
-        return matrix
-
-    def set_position_pattern(self, matrix):
-        BASE = [[1,1,1,1,1,1,1,0],
-                [1,0,0,0,0,0,1,0],
-                [1,0,1,1,1,0,1,0],
-                [1,0,1,1,1,0,1,0],
-                [1,0,1,1,1,0,1,0],
-                [1,0,0,0,0,0,1,0],
-                [1,1,1,1,1,1,1,0],
-                [0,0,0,0,0,0,0,0],
-        ]
-        for y in range(len(BASE)):
-            for x in range(len(BASE[y])):
-                matrix[y][x] = BASE[y][x]
-                matrix[y][-1-x] = BASE[y][x]
-                matrix[-1-y][x] = BASE[y][x]
-        return matrix
-
-    def set_timing_pattern(self, matrix):
-        for x in range(8, self.w-7):
-            matrix[6][x] = (x+1) % 2
-            matrix[x][6] = (x+1) % 2
-        return matrix
-
-    def set_position_pattern2(self, matrix):
-        # position pattern
-        PATTERN_POSITION = PATTERN_POSITION_TABLE[self.version - 1]
-        for x in PATTERN_POSITION:
-            for y in PATTERN_POSITION:
-                if matrix[y][x] != None: continue
-                for i in range(-2, 3):
-                    for j in range(-2, 3):
-                        matrix[y+i][x+j] = 1 if abs(i) == 2 or abs(j) == 2 or (i == j == 0) else 0
-
-        return matrix
-
-    def set_dark_module(self, matrix):
-        matrix[-8][8] = 1
-        return matrix
-
-    def set_format_information(self, matrix):
-        # format information
-        format_info = []
-        if self.error_correct_level == self.ERROR_CORRECT_L:
-            format_info.extend([0,1])
-        elif self.error_correct_level == self.ERROR_CORRECT_M:
-            format_info.extend([0,0])
-        elif self.error_correct_level == self.ERROR_CORRECT_Q:
-            format_info.extend([1,1])
-        elif self.error_correct_level == self.ERROR_CORRECT_H:
-            format_info.extend([1,0])
-
-        for i in range(3):
-            format_info.append((self.mask_pattern>>(2-i)) & 1)
-        
-        bch_code = gf_poly_div(format_info+[0]*(15-5), G15)[-1]
-        format_info += bch_code
-        mask = [1,0,1,0,1,0,0,0,0,0,1,0,0,1,0]
-        format_info = [i^j for i, j in zip(format_info, mask)][::-1]
-
-        for i, f in enumerate(format_info):
-            if i < 8:
-                matrix[8][-1-i] = f
-                if matrix[i][8] == None:
-                    matrix[i][8] = f
-                else:
-                    matrix[i+1][8] = f
-            else:
-                matrix[-7+i-8][8] = f
-                if matrix[8][7-i+8] == None:
-                    matrix[8][7-i+8] = f
-                else:
-                    matrix[8][7-i-1+8] = f
-        
-        return matrix
-    
-    def set_version_information(self, matrix):
-        # format information
-        version_info = [1 if bit else 0 for bit in Bitarray([self.version], 6).array]
-        
-        bch_code = gf_poly_div(version_info+[0]*12, G18)[-1]
-        version_info += bch_code
-
-        for i in range(6):
-            for j in range(3):
-                matrix[5-i][-9-j] = version_info[i * 3 + j]
-                matrix[-9-j][5-i] = version_info[i * 3 + j]
-
-        return matrix
-
-    def put(self, matrix, code_bit_array):
-        x = y = self.w - 1
-        mx, my, sign = -1, 0, -1
-        for bit in code_bit_array:
-            while matrix[y][x] != None:
-                if y + sign * my < 0 or y + sign * my >= self.h:
-                    sign *= -1
-                    mx = 1
-                    my = 1
-                    x -= 2
-                    y -= sign * my
-                x += mx
-                y += sign * my
-                if x == 6:
-                    x -= 1
-
-                mx *= -1
-                my = (my + 1) % 2
-            matrix[y][x] = 1 if bit else 0
-        return matrix
-            
-    def fill_rest(self, matrix):
-        for y in range(self.h):
-            for x in range(self.w):
-                if matrix[y][x] == None:
-                    matrix[y][x] = 0
+        # function patterns and format information from the shared read-only tables, code bits at their placement;
+        # a new array is returned each time, so nothing shared is written
+        self.w = self.h = w = symbol_size(self.version)
+        matrix = function_patterns(self.version).copy()
+        word = format_words()[(self.error_correct_level, self.mask_pattern)]
+        for positions in format_positions(w):
+            matrix[tuple(positions)] = word
+        bits = numpy.asarray(code_bit_array, dtype=numpy.uint8)
+        matrix.ravel()[placement_map(self.version)[:len(bits)]] = bits
         return matrix
 
     def mask(self, mask_pattern):
-        masked_matrix = self.matrix
-        functions = [
-        (lambda i ,j: 1 if (i+j) % 2 == 0 else 0),
-        (lambda i ,j: 1 if i % 2 == 0 else 0),
-        (lambda i ,j: 1 if j % 3 == 0 else 0),
-        (lambda i ,j: 1 if (i+j) % 3 == 0 else 0),
-        (lambda i ,j: 1 if (i // 2 + j // 3) % 2 else 0),
-        (lambda i ,j: 1 if (i*j) % 2 + (i*j) % 3 == 0 else 0),
-        (lambda i ,j: 1 if ((i*j) % 2 + (i*j) % 3) % 2 == 0 else 0),
-        (lambda i ,j: 1 if ((i+j) % 2 + (i*j) % 3) % 2 == 0 else 0),
-        ]
-        func = functions[mask_pattern]
-        for y, row in enumerate(self.flag_matrix):
-            for x, value in enumerate(row):
-                if value == None:
-                    masked_matrix[y][x] ^= func(y, x)
-        return masked_matrix
+        # xor of the mask pattern outside the function patterns; self.matrix is left unchanged
+        plane = mask_plane(self.version, mask_pattern) & ~function_mask(self.version)
+        return numpy.bitwise_xor(self.matrix, plane)
 
     def make_image(self, matrix, color):
+        from PIL import Image, ImageColor  # imported on first render to keep startup light
         color_tuple = ImageColor.getrgb(color)
         color_tuple = tuple(255 - c for c in color_tuple)
         mid_image = Image.fromarray(numpy.uint8(matrix))
@@ -258,27 +246,54 @@ class QR():
         img = Image.fromarray(colored_matrix)
         return img
 
+    def arrange_code(self):
+        # interleave data and error blocks by a single permutation of the block-ordered code
+        plan = get_layout(self.version, self.error_correct_level)
+        code = [c for block in self.data_blocks for c in block.code]
+        code += [c for block in self.error_blocks for c in block]
+        self.processed_code = plan.interleave(code).tolist()
+        self.processed_data_code = self.processed_code[:plan.data_code_length]
+        self.processed_error_code = self.processed_code[plan.data_code_length:]
+
     def set_blocks(self, blocks):
         self.data_blocks = blocks
-        self.processed_data_code = Block.integrate([block.code for block in self.data_blocks]).code
-        self.processed_error_code = Block.integrate(self.error_blocks).code
-        self.processed_code = self.processed_data_code + self.processed_error_code
+        with self.stats.stage("qr.interleave"):
+            self.arrange_code()
+
+        with self.stats.stage("qr.matrix"):
+            self.matrix = self.make_matrix(numpy.unpackbits(numpy.asarray(self.processed_code, dtype=numpy.uint8)))
 
-        self.matrix = self.make_matrix(Bitarray(self.processed_code).array)
+        with self.stats.stage("qr.mask"):
+            self.masked_matrix = self.mask(self.mask_pattern)
 
-        self.masked_matrix = self.mask(self.mask_pattern)
-        self.image = self.make_image(self.masked_matrix, self.color)
+    def render_code(self, code):
+        # masked matrix with code placed instead of processed_code, leaving self untouched
+        matrix = numpy.array(self.masked_matrix, dtype=numpy.uint8)
+        index = placement_map(self.version)[:len(code) * 8]
+        bits = numpy.unpackbits(numpy.asarray(code, dtype=numpy.uint8))
+        matrix.ravel()[index] = bits ^ mask_plane(self.version, self.mask_pattern).ravel()[index]
+        return matrix
+
+    def copy(self):
+        # blocks are randomized in place (Qash), so they are not shared with the copy
+        qr = copy.copy(self)
+        if self.data_blocks is not None:
+            qr.data_blocks = [Block(list(block.code)) for block in self.data_blocks]
+        return qr
 
     def print_matrix(self, matrix):
-        for row in matrix:
-            for col in row:
-                print(col, end="") if col != None else print(2, end="")
-            print()
+        # the whole matrix in one write; None (not yet placed) is shown as 2
+        sys.stdout.write("".join("".join("2" if col is None else str(col) for col in row) + "\n" for row in matrix))
+
+    def print_terminal(self, border=4, ansi=None):
+        """masked matrixを半角ブロックで端末に表示する(misqr.util.terminal)"""
+        terminal.write(self.masked_matrix, border, ansi)
     
 
 def main():
     import sys
-    data, version = sys.argv[1], int(sys.argv[2])
+    data = sys.argv[1]
+    version = parse_version(sys.argv[2]) if len(sys.argv) > 2 else "auto"
 
     qr = QR(data, version, 3, color="#000000")
     qr.image.show()
@@ -290,9 +305,10 @@ if __name__ == '__main__':
     import sys
     data, version = sys.argv[1], int(sys.argv[2])
 
-    import qrcode
-    q = qrcode.QRCode(version=version, error_correction=qrcode.constants.ERROR_CORRECT_H)
-    q.add_data(data)
-    q.make()
+    # compare with the qrcode library (see conformance.py for all versions)
+    from .conformance import reference_modules, mismatches
+    expected = reference_modules(data, version, 3, 0)
 
-    qr = QR(data, version, 3)
\ No newline at end of file
+    qr = QR(data, version, 3)
+    wrong = mismatches(expected, qr.masked_matrix)
+    print("%d mismatching modules %s" % (len(wrong), wrong[:8]))
\ No newline at end of file
@@ -0,0 +1,109 @@
+from .layout import get_layout
+from .placement import placement_map
+import numpy as np
+
+
+class RobustnessEstimator:
+    """
+    QRコードにmoduleの反転や汚れを加えたときに、読み取れなくなる確率を見積もる。
+
+    試行ごとの損傷を(trials, h, w)のbool配列(True: 反転)でまとめて与え、配置マップでコード語に対応づけて
+    ブロックごとの誤りコード語数を数え、possible_errorを超えるかを判定する(復号は行わない)。
+    形式情報など機能パターンの損傷は考慮しない。
+
+    Attributes
+    --------
+    version: int
+    error_correct_level: int
+    possible_error: ndarray
+        ブロックごとに訂正可能な最大エラー数
+    base_errors: ndarray
+        損傷を加える前から誤っているブロックごとのコード語数(Qashで使ったエラー数)
+    margin: ndarray
+        ブロックごとの残りの訂正可能数(possible_error - base_errors)
+    """
+
+    def __init__(self, qr, reference_code=None):
+        """
+        Parameters
+        --------
+        qr : QR
+            見積もる対象のQRコード
+        reference_code : list
+            本来のコード語列(processed_code)。qrがQashのようにわざと誤りを含む場合に指定する
+        """
+        self.version = qr.version
+        self.error_correct_level = qr.error_correct_level
+        self.matrix = np.asarray(qr.masked_matrix, dtype=np.uint8)
+        plan = get_layout(self.version, self.error_correct_level)
+
+        self.code_length = plan.code_length
+        self.bit_index = placement_map(self.version)[:plan.code_length * 8]
+
+        # block of each codeword in placement order
+        block_of = np.empty(plan.code_length, dtype=np.intp)
+        data_block = np.repeat(np.arange(plan.block_num), plan.data_lengths)
+        error_block = np.repeat(np.arange(plan.block_num), plan.error_code_length)
+        block_of[plan.inverse_permutation] = np.concatenate((data_block, error_block))
+        self.block_onehot = (block_of[:, None] == np.arange(plan.block_num)[None, :]).astype(np.int32)
+
+        code = np.asarray(qr.processed_code, dtype=np.uint8)
+        reference = code if reference_code is None else np.asarray(reference_code, dtype=np.uint8)
+        self.base_diff = code ^ reference
+        self.possible_error = np.array(plan.possible_error)
+        self.base_errors = (self.base_diff != 0).astype(np.int32) @ self.block_onehot
+        self.margin = self.possible_error - self.base_errors
+
+    def flips(self, trials, rate, rng=None, seed=None):
+        """各moduleを確率rateで独立に反転する損傷を(trials, h, w)で返す"""
+        rng = rng if rng is not None else np.random.default_rng(seed)
+        return rng.random((trials,) + self.matrix.shape) < rate
+
+    def bursts(self, trials, size, count=1, fill=None, rng=None, seed=None):
+        """
+        一辺sizeの正方形の汚れをcount個ランダムな位置に置いた損傷を(trials, h, w)で返す。
+
+        fillがNoneの場合は汚れの中を反転し、0または1の場合はその値で塗りつぶす。
+        """
+        rng = rng if rng is not None else np.random.default_rng(seed)
+        h, w = self.matrix.shape
+        top = rng.integers(0, h - size + 1, size=(trials, count, 1))
+        left = rng.integers(0, w - size + 1, size=(trials, count, 1))
+        rows = (np.arange(h) >= top) & (np.arange(h) < top + size)
+        cols = (np.arange(w) >= left) & (np.arange(w) < left + size)
+        damage = np.any(rows[..., :, None] & cols[..., None, :], axis=1)
+        if fill is not None:
+            damage &= (self.matrix != fill)[None]
+        return damage
+
+    def block_errors(self, damage):
+        """損傷(trials, h, w)ごとの、ブロックごとの誤りコード語数(trials, B)を返す"""
+        damage = np.asarray(damage, dtype=bool)
+        trials = damage.shape[0]
+        bits = damage.reshape(trials, -1)[:, self.bit_index].reshape(trials, self.code_length, 8)
+        delta = np.packbits(bits, axis=-1)[..., 0]
+        wrong = (delta ^ self.base_diff[None]) != 0
+        return wrong.astype(np.int32) @ self.block_onehot
+
+    def failures(self, damage):
+        """損傷ごとに、訂正可能数を超えるブロックがあるか(読み取れないか)を返す"""
+        return np.any(self.block_errors(damage) > self.possible_error[None], axis=1)
+
+    def flip_curve(self, rates, trials=1000, rng=None, seed=None, chunk=1000):
+        """反転確率rateごとの読み取り失敗確率を返す"""
+        rng = rng if rng is not None else np.random.default_rng(seed)
+        return self._curve(rates, trials, chunk, lambda n, rate: self.flips(n, rate, rng))
+
+    def burst_curve(self, sizes, trials=1000, count=1, fill=None, rng=None, seed=None, chunk=1000):
+        """汚れの一辺sizeごとの読み取り失敗確率を返す"""
+        rng = rng if rng is not None else np.random.default_rng(seed)
+        return self._curve(sizes, trials, chunk, lambda n, size: self.bursts(n, size, count, fill, rng))
+
+    def _curve(self, values, trials, chunk, make_damage):
+        curve = []
+        for value in values:
+            failed = 0
+            for start in range(0, trials, chunk):
+                failed += int(self.failures(make_damage(min(chunk, trials - start), value)).sum())
+            curve.append(failed / trials)
+        return np.array(curve)
@@ -0,0 +1,213 @@
+"""
+複数processでのバッチ生成の結果を、共有メモリに直接書き込む。
+
+親processがN個分のシンボル(またはN個分の拡大した画像)のmultiprocessing.shared_memoryを確保し、
+workerは自分の範囲に書き込むだけで結果をpickleして返さない。親は最後にその共有メモリをそのまま
+NumPy配列として受け取る(コピーしない)。
+
+    with generate(datas, version=10, error_correct_level=3, box_size=4, border=4) as batch:
+        batch.array  # (N, h, w) uint8; 1: 暗 (box_size=1, border=0の場合はmasked matrix)
+"""
+from .capacity import fit_version
+from .workers import process_pool
+from multiprocessing import shared_memory
+import numpy as np
+
+BYTE_MODE = 0b0100
+# generate_variants splits n into this many chunks (one random stream each) when chunk is not given
+VARIANT_CHUNKS = 16
+
+
+class SharedBatch:
+    """
+    共有メモリ上の(n, *shape)の配列。
+
+    親processで作り、workerはattachで同じ配列を開く。使い終わったらclose(作った側はさらにunlink)する。
+    withで使うと、抜けるときにcloseとunlinkを行う。
+
+    Attributes
+    --------
+    shape: tuple
+        (n, ...)
+    dtype: numpy.dtype
+    name: str
+        共有メモリの名前(workerに渡す)
+    array: ndarray
+        共有メモリ上の配列(コピーではない)
+    """
+
+    def __init__(self, shape, dtype=np.uint8, name=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = max(1, int(np.prod(self.shape)) * self.dtype.itemsize)
+        self.owner = name is None
+        if self.owner:
+            self._memory = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self._memory = shared_memory.SharedMemory(name=name)
+        self.name = self._memory.name
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._memory.buf)
+
+    @classmethod
+    def attach(cls, name, shape, dtype=np.uint8):
+        return cls(shape, dtype, name)
+
+    def close(self):
+        # views of the buffer must be released before the mapping can be closed
+        self.array = None
+        self._memory.close()
+
+    def unlink(self):
+        if self.owner:
+            self._memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        self.unlink()
+
+    def __len__(self):
+        return self.shape[0]
+
+
+def raster_size(version, box_size=1, border=0):
+    """バージョンのシンボルを拡大したときの一辺[px]"""
+    return (17 + version * 4 + 2 * border) * box_size
+
+
+def scale_into(matrix, out, box_size=1, border=0):
+    """(w, w)のmoduleを、余白border[module]を付けて一辺box_size倍にし、outに書き込む"""
+    w = matrix.shape[0]
+    if box_size == 1 and border == 0:
+        out[...] = matrix
+        return out
+    margin = border * box_size
+    if margin:
+        out[:margin] = out[-margin:] = 0
+        out[:, :margin] = out[:, -margin:] = 0
+    # view the symbol area as (w, box, w, box) and broadcast each module over its box
+    inner = out[margin:margin + w * box_size, margin:margin + w * box_size]
+    inner.reshape(w, box_size, w, box_size)[...] = matrix[:, None, :, None]
+    return out
+
+
+def encode_into(name, shape, start, datas, version, error_correct_level, mask_pattern=0b000, box_size=1, border=0):
+    """
+    datasを符号化し、共有メモリ(name)の配列のstart番目からに書き込む(workerで実行する)。
+
+    返り値は書き込んだ数だけで、画像は返さない。
+    """
+    from .builder import QRBuilder
+    builder = QRBuilder.pooled(version, error_correct_level, mask_pattern)
+    batch = SharedBatch.attach(name, shape)
+    try:
+        out = batch.array[start:start + len(datas)]
+        if box_size == 1 and border == 0:
+            builder.encode_batch(datas, out)
+        else:
+            for data, raster in zip(datas, out):
+                scale_into(builder.encode(data), raster, box_size, border)
+        return len(datas)
+    finally:
+        batch.close()
+
+
+def variants_into(name, shape, start, n, data, version, error_correct_level, seed, box_size=1, border=0):
+    """QashVariantsでn個のvariantを生成し、共有メモリの配列のstart番目からに書き込む(workerで実行する)"""
+    from ..qash import QashVariants
+    variants = QashVariants(data, version, error_correct_level, seed=seed)
+    batch = SharedBatch.attach(name, shape)
+    try:
+        out = batch.array[start:start + n]
+        if box_size == 1 and border == 0:
+            variants.generate(n, out=out)
+        else:
+            for matrix, raster in zip(variants.generate(n), out):
+                scale_into(matrix, raster, box_size, border)
+        return n
+    finally:
+        batch.close()
+
+
+def _chunks(n, workers, chunk=None):
+    # (start, size) ranges; a few per worker so that uneven workers still finish together
+    chunk = chunk or max(1, -(-n // (4 * workers)))
+    return [(start, min(chunk, n - start)) for start in range(0, n, chunk)]
+
+
+def _run(executor, workers, jobs):
+    if executor is not None:
+        return sum(future.result() for future in [executor.submit(*job) for job in jobs])
+    with process_pool(workers) as pool:
+        return sum(future.result() for future in [pool.submit(*job) for job in jobs])
+
+
+def generate(datas, version="auto", error_correct_level=3, mask_pattern=0b000, box_size=1, border=0,
+             workers=None, executor=None, chunk=None):
+    """
+    datasのQRコードを複数processで生成し、(N, h, w)のSharedBatchを返す。
+
+    Parameters
+    --------
+    datas : list
+        str のリスト(8-bit byteモード)
+    version : int or str
+        全てのシンボルのバージョン。"auto"の場合は最も長いデータが収まる最小のバージョン
+    error_correct_level : int
+    mask_pattern : int
+    box_size : int
+        moduleの一辺[px](1の場合、border=0ならmasked matrixそのもの)
+    border : int
+        余白[module]
+    workers : int
+        process数(Noneの場合はCPU数)。executorを渡した場合は使わない
+    executor : concurrent.futures.Executor
+        使い回すprocess pool
+    chunk : int
+        一度にworkerに渡すシンボル数
+
+    Returns
+    --------
+    batch : SharedBatch
+        batch.arrayは1が暗。使い終わったらclose, unlinkすること(withを使うとよい)
+    """
+    if version == "auto":
+        version = fit_version(max(len(data.encode("utf-8")) for data in datas), error_correct_level, BYTE_MODE)
+    size = raster_size(version, box_size, border)
+    batch = SharedBatch((len(datas), size, size))
+    try:
+        jobs = [(encode_into, batch.name, batch.shape, start, datas[start:start + n], version, error_correct_level,
+                 mask_pattern, box_size, border) for start, n in _chunks(len(datas), workers or 1, chunk)]
+        _run(executor, workers, jobs)
+    except BaseException:
+        batch.close()
+        batch.unlink()
+        raise
+    return batch
+
+
+def generate_variants(data, n, version="auto", error_correct_level=3, seed=None, box_size=1, border=0,
+                      workers=None, executor=None, chunk=None):
+    """
+    QashVariantsのn個のvariantを複数processで生成し、(n, h, w)のSharedBatchを返す。
+
+    各chunkはseedから派生させた別々の乱数列を使う。chunkを指定しない場合はnだけからchunkの大きさを
+    決めるので、同じseedならworkersによらず同じ結果になる(chunkを指定した場合は同じseed, chunkなら同じ結果)。
+    """
+    if version == "auto":
+        version = fit_version(len(data.encode("utf-8")), error_correct_level, BYTE_MODE)
+    size = raster_size(version, box_size, border)
+    batch = SharedBatch((n, size, size))
+    try:
+        ranges = _chunks(n, 1, chunk or max(1, -(-n // VARIANT_CHUNKS)))
+        seeds = np.random.SeedSequence(seed).spawn(len(ranges))
+        jobs = [(variants_into, batch.name, batch.shape, start, count, data, version, error_correct_level, child,
+                 box_size, border) for (start, count), child in zip(ranges, seeds)]
+        _run(executor, workers, jobs)
+    except BaseException:
+        batch.close()
+        batch.unlink()
+        raise
+    return batch
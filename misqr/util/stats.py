@@ -0,0 +1,128 @@
+from contextlib import nullcontext
+from time import perf_counter_ns
+
+
+class Stats:
+    """
+    処理の段階ごとの時間とカウンタを記録する。
+
+    QR, Whim, Qashなどにstatsとして渡すと、各段階の時間(perf_counter_ns)と回数を記録する。
+    callbackを指定すると、記録するたびにcallback(kind, name, value)を呼ぶ。
+    kindは"time"(valueはns)または"count"。
+
+    Attributes
+    --------
+    timings: dict
+        段階ごとの合計時間[ns]
+    calls: dict
+        段階ごとの実行回数
+    counters: dict
+        カウンタ(rs_calls, candidates_pruned, etc...)
+    callback: function
+        記録するたびに呼ぶ関数
+    """
+    enabled = True
+
+    def __init__(self, callback=None):
+        self.timings = {}
+        self.calls = {}
+        self.counters = {}
+        self.callback = callback
+
+    def stage(self, name):
+        """with文の中の時間を段階nameとして記録する"""
+        return _Stage(self, name)
+
+    def add_time(self, name, ns):
+        self.timings[name] = self.timings.get(name, 0) + ns
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.callback is not None:
+            self.callback("time", name, ns)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+        if self.callback is not None:
+            self.callback("count", name, n)
+
+    def add_counters(self, prefix, counters):
+        """他の統計(QRCache.statsなど)のカウンタをprefixを付けて加える"""
+        for name, value in counters.items():
+            if isinstance(value, int):
+                self.count(prefix + name, value)
+
+    def merge(self, other):
+        for name, ns in other.timings.items():
+            self.timings[name] = self.timings.get(name, 0) + ns
+            self.calls[name] = self.calls.get(name, 0) + other.calls[name]
+        for name, value in other.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        return self
+
+    def clear(self):
+        self.timings.clear()
+        self.calls.clear()
+        self.counters.clear()
+
+    def as_dict(self):
+        return {
+            "timings_ns": dict(self.timings),
+            "calls": dict(self.calls),
+            "counters": dict(self.counters),
+        }
+
+    def report(self):
+        """段階ごとの時間とカウンタを表にした文字列を返す"""
+        lines = ["%-24s %8s %12s %12s" % ("stage", "calls", "total[ms]", "mean[us]")]
+        for name, ns in sorted(self.timings.items(), key=lambda item: -item[1]):
+            calls = self.calls[name]
+            lines.append("%-24s %8d %12.3f %12.1f" % (name, calls, ns / 1e6, ns / calls / 1e3))
+        if self.counters:
+            lines.append("%-24s %8s" % ("counter", "value"))
+            for name, value in sorted(self.counters.items()):
+                lines.append("%-24s %8d" % (name, value))
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return "Stats(%r)" % self.as_dict()
+
+
+class _Stage:
+    __slots__ = ("stats", "name", "start")
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add_time(self.name, perf_counter_ns() - self.start)
+        return False
+
+
+class _NullStats:
+    """statsを指定しない場合に使う、何も記録しないStats"""
+    enabled = False
+    _context = nullcontext()
+
+    def stage(self, name):
+        return self._context
+
+    def add_time(self, name, ns):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def add_counters(self, prefix, counters):
+        pass
+
+
+DISABLED = _NullStats()
+
+
+def resolve(stats):
+    """Noneの場合は何も記録しないDISABLEDを返す"""
+    return DISABLED if stats is None else stats
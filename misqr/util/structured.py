@@ -0,0 +1,213 @@
+"""
+連結モード(Structured Append)。
+
+一つのシンボルに収まらない、または大きなバージョンになるデータを最大16個のシンボルに分割する。
+各シンボルの先頭には、モード指示子0011・シンボルの位置・シンボル数・パリティ(データ全体のbyteのxor)の
+20bitのヘッダが付く。シンボルごとにデータが収まる最小のバージョンを選び、process poolで並列に生成する。
+
+    python -m misqr.util.structured DATA [--level 3] [--max-version 40] [--workers N] [-o sheet.png] [--output-dir DIR]
+"""
+from .qr import QR
+from .capacity import capacity, STRUCTURED_APPEND_CAPACITY_TABLE
+from .decoder import DecodeError
+from .workers import process_pool
+from .png import PNGEncoder
+from . import png
+import argparse
+import functools
+import math
+import sys
+
+BYTE_MODE = 0b0100
+MAX_SYMBOLS = 16
+
+
+def parity(data):
+    """データ全体(UTF-8)のbyteのxor"""
+    return functools.reduce(lambda a, b: a ^ b, data.encode("utf-8") if isinstance(data, str) else data, 0)
+
+
+def max_chunk_length(error_correct_level, max_version=40):
+    """ヘッダを含めてmax_versionのシンボル一つに収まるbyte数"""
+    return capacity(max_version, error_correct_level, BYTE_MODE, STRUCTURED_APPEND_CAPACITY_TABLE)
+
+
+def split(data, error_correct_level, max_version=40):
+    """
+    dataを最小の数のシンボルに、なるべく均等な長さで分割する。
+
+    分割は文字の境界で行う(各シンボルのデータもUTF-8の文字列になる)。
+
+    Parameters
+    --------
+    data : str
+    error_correct_level : int
+    max_version : int
+        各シンボルのバージョンの上限
+
+    Returns
+    --------
+    chunks : list
+        str のリスト(最大16個)
+
+    Raises
+    --------
+    ValueError
+        16個のシンボルに収まらない場合
+    """
+    encoded = data.encode("utf-8")
+    limit = max_chunk_length(error_correct_level, max_version)
+    if limit == 0:
+        raise ValueError("version %d cannot hold a structured append symbol" % max_version)
+    for total in range(max(1, math.ceil(len(encoded) / limit)), MAX_SYMBOLS + 1):
+        chunks = _split_into(encoded, total, limit)
+        if chunks is not None:
+            return [chunk.decode("utf-8") for chunk in chunks]
+    raise ValueError("data is too long for %d symbols of version %d: %d > %d"
+                     % (MAX_SYMBOLS, max_version, len(encoded), MAX_SYMBOLS * limit))
+
+
+def _split_into(encoded, total, limit):
+    # even sizes, moved back to the start of a UTF-8 character; None if total symbols are not enough
+    chunks, start = [], 0
+    for i in range(total):
+        size = min(limit, math.ceil((len(encoded) - start) / (total - i)))
+        end = min(start + size, len(encoded))
+        while end < len(encoded) and end > start and encoded[end] & 0b11000000 == 0b10000000:
+            end -= 1
+        chunks.append(encoded[start:end])
+        start = end
+    return chunks if start == len(encoded) else None
+
+
+def _build(data, error_correct_level, mask_pattern, color, structured_append):
+    # runs in a worker; only the packed modules are sent back
+    return QR(data, "auto", error_correct_level, mask_pattern, color, keep_intermediates=False,
+              structured_append=structured_append)
+
+
+class StructuredAppend:
+    """
+    データを連結モードのシンボルに分割して生成する。
+
+    Attributes
+    --------
+    data: string
+    error_correct_level: int
+        誤り訂正レベル。(L, M, Q, H) = (0, 1, 2, 3)
+    max_version: int
+        各シンボルのバージョンの上限
+    parity: int
+        データ全体のbyteのxor
+    chunks: list
+        シンボルごとのデータ
+    symbols: list
+        QRオブジェクトのリスト(シンボルの位置の順)
+    """
+
+    def __init__(self, data, error_correct_level=QR.ERROR_CORRECT_M, max_version=40, mask_pattern=0b000,
+                 color="#000000", workers=None, executor=None):
+        self.data = data
+        self.error_correct_level = error_correct_level
+        self.max_version = max_version
+        self.parity = parity(data)
+        self.chunks = split(data, error_correct_level, max_version)
+
+        total = len(self.chunks)
+        jobs = [(chunk, error_correct_level, mask_pattern, color, (i, total, self.parity))
+                for i, chunk in enumerate(self.chunks)]
+        if executor is not None:
+            self.symbols = list(executor.map(_build, *zip(*jobs)))
+        elif total == 1 or workers is not None and workers <= 1:
+            self.symbols = [_build(*job) for job in jobs]
+        else:
+            with process_pool(min(workers or total, total)) as pool:
+                self.symbols = list(pool.map(_build, *zip(*jobs)))
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __iter__(self):
+        return iter(self.symbols)
+
+    @property
+    def versions(self):
+        return [qr.version for qr in self.symbols]
+
+    def sheet(self, box_size=4, border=4, columns=None):
+        """
+        全てのシンボルを並べた一枚の画像を返す。
+
+        各シンボルは余白border[module]を付けて、最も大きなシンボルの大きさの枠に左上を揃えて置く。
+        """
+        from PIL import Image
+        from .cache import render
+        columns = columns or math.ceil(math.sqrt(len(self.symbols)))
+        rows = math.ceil(len(self.symbols) / columns)
+        cell = (max(qr.w for qr in self.symbols) + 2 * border) * box_size
+        canvas = Image.new("RGB", (columns * cell, rows * cell), "white")
+        for i, qr in enumerate(self.symbols):
+            image = render(qr.image, box_size, border)
+            canvas.paste(image, ((i % columns) * cell, (i // columns) * cell))
+        return canvas
+
+
+def join(results):
+    """
+    連結モードのシンボルの復号結果(DecodeResult)を位置の順につなぎ、データ全体を返す。
+
+    Raises
+    --------
+    DecodeError
+        連結モードでない・シンボルが足りない・シンボル数またはパリティが一致しない場合
+    """
+    headers = [result.structured_append for result in results]
+    if not results or None in headers:
+        raise DecodeError("not a structured append symbol")
+    total, expected_parity = headers[0][1], headers[0][2]
+    if any(header[1:] != (total, expected_parity) for header in headers):
+        raise DecodeError("symbols belong to different structured append sets")
+    by_position = {header[0]: result.data for header, result in zip(headers, results)}
+    missing = sorted(set(range(total)) - set(by_position))
+    if missing:
+        raise DecodeError("missing structured append symbols: %s" % missing)
+    data = b"".join(by_position[i] for i in range(total))
+    if parity(data) != expected_parity:
+        raise DecodeError("parity mismatch: 0x%02x != 0x%02x" % (parity(data), expected_parity))
+    return data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m misqr.util.structured")
+    parser.add_argument("data", help="data, or - to read it from stdin")
+    parser.add_argument("--level", type=int, choices=range(4), default=QR.ERROR_CORRECT_M, help="(L, M, Q, H) = (0, 1, 2, 3)")
+    parser.add_argument("--max-version", type=int, choices=range(1, 41), default=40, metavar="1-40")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per symbol)")
+    parser.add_argument("--box-size", type=int, default=4)
+    parser.add_argument("-o", "--output", help="save the combined sheet here instead of showing it (format from the extension)")
+    parser.add_argument("--output-dir", help="save every symbol as a 1-bit PNG in this directory instead of showing the sheet")
+    PNGEncoder.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    data = sys.stdin.read() if args.data == "-" else args.data
+    symbols = StructuredAppend(data, args.level, args.max_version, workers=args.workers)
+    print("%d symbols, versions %s, parity 0x%02x" % (len(symbols), symbols.versions, symbols.parity))
+    encoder = PNGEncoder.from_arguments(args)
+    if args.output_dir:
+        results = encoder.encode_all([qr.masked_matrix for qr in symbols], args.box_size, 4, modules=True)
+        png.save_all(args.output_dir, ["symbol_%02d.png" % i for i in range(len(symbols))], results)
+    if args.output:
+        # other extensions are left to PIL
+        sheet = symbols.sheet(args.box_size)
+        if args.output.lower().endswith(".png"):
+            with open(args.output, "wb") as f:
+                f.write(encoder.encode_image(sheet))
+        else:
+            sheet.save(args.output)
+    elif not args.output_dir:
+        symbols.sheet(args.box_size).show()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -244,3 +244,12 @@ CODE_LENGTH_TABLE = [
         [3706, 1666, 2040],
         [3706, 1276, 2430]]]
 
+
+
+# [version range][mode index] -> bit length of the character count indicator
+# mode index: (numeric, alphanumeric, 8-bit byte, kanji)
+INSTRUCTION_BIT_LENGTH_TABLE = [
+    [10,  9,  8,  8], # 1-9
+    [12, 11, 16, 10], # 10-26
+    [14, 13, 16, 12], # 27-40
+]
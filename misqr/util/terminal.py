@@ -0,0 +1,86 @@
+"""
+QRコードを端末に表示する。
+
+上下2moduleを1文字(半角ブロック ▀ ▄ █)にまとめ、余白を付けた全体を一つの文字列にして一度のwriteで書き出す。
+ansi=Trueの場合は前景色・背景色(256色)で描き、Whimの混合したmodule(暗と明の中間)を灰色で表示する。
+"""
+import sys
+import numpy as np
+
+LIGHT, DARK, GRAY = 0, 1, 2
+# 256-color palette entries of the module levels
+ANSI_COLORS = {LIGHT: 231, DARK: 16, GRAY: 244}
+RESET = "\x1b[0m"
+# (top, bottom) is dark -> character; light modules are drawn as blocks, so the symbol shows on dark terminals
+HALF_BLOCKS = {(False, False): "█", (False, True): "▀", (True, False): "▄", (True, True): " "}
+
+
+def levels(matrix):
+    """module配列(0/1, Noneは明)を LIGHT/DARK のuint8配列にする"""
+    if isinstance(matrix, list):
+        return np.array([[DARK if value else LIGHT for value in row] for row in matrix], dtype=np.uint8)
+    return np.asarray(matrix, dtype=np.uint8)
+
+
+def image_levels(image, low=64, high=192):
+    """1module 1pxの画像を LIGHT/DARK/GRAY にする(Whimの候補など)"""
+    gray = np.asarray(image.convert("L"), dtype=np.uint8)
+    result = np.full(gray.shape, GRAY, dtype=np.uint8)
+    result[gray < low] = DARK
+    result[gray > high] = LIGHT
+    return result
+
+
+def render(matrix, border=4, ansi=False, invert=False):
+    """
+    端末に表示する文字列を返す。
+
+    Parameters
+    --------
+    matrix : array_like
+        (h, w)の LIGHT/DARK/GRAY の配列(masked_matrixをそのまま渡せる)
+    border : int
+        余白[module]
+    ansi : bool
+        ANSIの色で描く。Falseの場合GRAYは暗として描く
+    invert : bool
+        ansi=Falseの場合に、明ではなく暗のmoduleをブロックで描く(明るい背景の端末用)
+
+    Returns
+    --------
+    text : str
+    """
+    modules = np.pad(levels(matrix), border, constant_values=LIGHT)
+    if len(modules) % 2:
+        modules = np.vstack((modules, np.full((1, modules.shape[1]), LIGHT, dtype=np.uint8)))
+    top, bottom = modules[0::2], modules[1::2]
+
+    if not ansi:
+        chars = np.array([[HALF_BLOCKS[(False, False)], HALF_BLOCKS[(False, True)]],
+                          [HALF_BLOCKS[(True, False)], HALF_BLOCKS[(True, True)]]])
+        # indexed by (top is dark, bottom is dark)
+        cells = chars[((top != LIGHT) ^ invert).astype(np.intp), ((bottom != LIGHT) ^ invert).astype(np.intp)]
+        return "".join("".join(line) + "\n" for line in cells)
+
+    # upper half block in the top module's color over the bottom module's color;
+    # the escape sequence is only emitted where the pair changes
+    lines = []
+    for upper, lower in zip(top.tolist(), bottom.tolist()):
+        parts, previous = [], None
+        for pair in zip(upper, lower):
+            if pair != previous:
+                parts.append("\x1b[38;5;%d;48;5;%dm" % (ANSI_COLORS[pair[0]], ANSI_COLORS[pair[1]]))
+                previous = pair
+            parts.append("▀")
+        parts.append(RESET + "\n")
+        lines.append("".join(parts))
+    return "".join(lines)
+
+
+def write(matrix, border=4, ansi=None, invert=False, file=None):
+    """render(matrix)を一度のwriteでfile(既定はsys.stdout)に書き出す。ansi=Noneの場合は端末ならTrue"""
+    file = file if file is not None else sys.stdout
+    if ansi is None:
+        ansi = file.isatty()
+    file.write(render(matrix, border, ansi, invert))
+    file.flush()
@@ -0,0 +1,22 @@
+"""
+生成処理を並列に行うprocess poolを作る。
+"""
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+
+
+def process_context():
+    """
+    workerの起動方法を返す。
+
+    threadのあるprocess(asyncioのサーバなど)をforkすると子processがlockを持ったまま止まることがあるので、
+    使える場合はfork server、そうでなければspawnにする。
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def process_pool(workers=None, initializer=None):
+    """workers個(Noneの場合はCPU数)のprocessのProcessPoolExecutorを返す"""
+    return ProcessPoolExecutor(workers or os.cpu_count() or 1, mp_context=process_context(), initializer=initializer)
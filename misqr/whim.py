@@ -1,11 +1,18 @@
-from .util.filter import BayerFilter
-from .util.constants import W, K
-from .util.rs import rs
+from .util.layout import get_layout
 from .util.block import Block
 from .util.qr import QR
-from .util.bitarray import Bitarray
-from PIL import Image
+from .util.capacity import parse_version
+from .util.cache import QRCache
+from .util import stats as _stats
+from .util.stats import Stats
+from .util.builder import QRBuilder, BIT_TABLE
+from .util import terminal
+from .util import png
+from .util.png import PNGEncoder
 import numpy as np
+import argparse
+import cProfile
+import os
 import sys
 
 class Whim:
@@ -25,10 +32,10 @@ class Whim:
         QRコードの余白
     qr: Object
         データから生成した通常のQRコード
-    version: int
-        QRコードのバージョン情報
+    version: int or str
+        QRコードのバージョン情報。"auto"の場合はデータが収まる最小のバージョン
     error_correction: int
-        QRコードの誤り訂正レベル。(L, M, H, Q) = (0, 1, 2, 3)
+        QRコードの誤り訂正レベル。(L, M, Q, H) = (0, 1, 2, 3)
     block_num: int
         QRコードのブロック数
     code_length: int
@@ -43,8 +50,14 @@ class Whim:
         QRコードのブロックごとのコード語
     whim:
         ランダム化されたQRコード
+    cache: QRCache
+        QRコードと候補のコード語列の生成に使うcache(Noneの場合は毎回生成する)
+    stats: Stats
+        処理時間とカウンタの記録先(Noneの場合は記録しない)
     """
-    
+    __slots__ = ("data", "version", "pixel_size", "box_size", "border", "insertion", "cache", "stats",
+                 "qr", "error_correction", "code", "possible_error")
+
     def __init__(self, 
                  data,
                  version,
@@ -52,7 +65,9 @@ class Whim:
                  pixel_size=1,
                  box_size=20,
                  border=4,
-                 insertion=1):
+                 insertion=1,
+                 cache=None,
+                 stats=None):
 
         self.data = data
         self.version = version
@@ -60,8 +75,10 @@ class Whim:
         self.box_size = box_size
         self.border = border
         self.insertion = insertion
+        self.cache = cache
+        self.stats = _stats.resolve(stats)
 
-        self.qr = QR(data, version, error_correction)
+        self.qr = self.build_qr(data, version, error_correction)
 
         self.version = self.qr.version
         self.error_correction = self.qr.error_correct_level
@@ -81,119 +98,176 @@ class Whim:
         y = y * self.box_size
         self.qr.image.paste(pixel, (offset+x,offset+y))
 
+    # cacheがあればcacheからQRを取得する(取得したQRは変更しない)
+    def build_qr(self, data, version, error_correction):
+        if self.cache is not None:
+            return self.cache.qr(data, version, error_correction, stats=self.stats)
+        return QR(data, version, error_correction, stats=self.stats)
+
     # ブロックごとに許容する最大エラー数を返す
     def calc_error_symbol(self):
-        blocks = rs[(self.version-1) * 4 + self.error_correction]
-        possible_errors = []
-        for i in range(len(blocks)//3):
-            block = blocks[i*3:i*3+3]
-            error_code_length = block[1] - block[2]
-            for _ in range(block[0]):
-                possible_errors.append(error_code_length // 2)
-        return possible_errors
+        return list(get_layout(self.version, self.error_correction).possible_error)
 
     def search_similar_qr(self, index=0):
+        """
+        dataのindex文字目を置き換えた候補のうち、一つのmoduleの明暗で読み分けられるものを探す。
+
+        候補と元のデータのコード語をブロックごとに比べ、一つのブロックだけが異なり、
+        その差がそのブロックのエラー許容数 * 2 + 1 語である候補について混合した画像を作る。
+
+        Returns
+        --------
+        ret : dict
+            候補のデータ -> 混合した画像(暗と明の中間のmoduleを含む)
+
+        Raises
+        --------
+        ValueError
+            indexがdataの範囲外の場合
+        """
+        if not -len(self.data) <= index < len(self.data):
+            raise ValueError("index %d is out of range for %d characters of data" % (index, len(self.data)))
+        from PIL import Image
         ret = {}
+        stats = self.stats
+        plan = get_layout(self.version, self.error_correction)
         character = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ1234567890"
-        for c in character:
-            if self.data[index] == c: continue
-            candidate = self.data[:index] + c + (self.data[index+1:] if index != -1 else "")
-            cand_qr = QR(candidate, self.version, self.error_correction)
-            if self.diff(self.qr.processed_code, cand_qr.processed_code) == self.possible_error[0] * 2 + 1:
-                left, right, found = self.mix(self.qr.processed_code, cand_qr.processed_code, self.possible_error[0])
-                if found == -1: continue
-                cand_qr.processed_code = left
-                cand_qr.matrix = cand_qr.make_matrix(Bitarray(cand_qr.processed_code).array)
-                cand_qr.masked_matrix = cand_qr.mask(cand_qr.mask_pattern)
-                cand_qr.image = cand_qr.make_image(cand_qr.masked_matrix, cand_qr.color)
-                src = np.asarray(cand_qr.image, dtype=np.uint16)
-
-                cand_qr.processed_code = right 
-                cand_qr.matrix = cand_qr.make_matrix(Bitarray(cand_qr.processed_code).array)
-                cand_qr.masked_matrix = cand_qr.mask(cand_qr.mask_pattern)
-                cand_qr.image = cand_qr.make_image(cand_qr.masked_matrix, cand_qr.color)
-                dst = np.asarray(cand_qr.image, dtype=np.uint16)
+        candidates = [self.data[:index] + c + (self.data[index+1:] if index != -1 else "")
+                      for c in character if self.data[index] != c]
+
+        with stats.stage("whim.build"):
+            code = self.block_code(self.data)
+            codes = np.array([self.block_code(candidate) for candidate in candidates])
+        stats.count("candidates", len(candidates))
+
+        with stats.stage("whim.diff"):
+            distances = self.diff(code, codes, plan)
+            tolerance = np.asarray(self.possible_error) * 2 + 1
+            differing = distances > 0
+            accepted = (differing.sum(axis=1) == 1) & np.all((distances == tolerance) | ~differing, axis=1)
+        stats.count("candidates_pruned", int((~accepted).sum()))
+
+        for i in np.flatnonzero(accepted):
+            candidate, cand_code = candidates[i], codes[i]
+            with stats.stage("whim.mix"):
+                left, right, found = self.mix(code, cand_code, self.possible_error, plan)
+            if found == -1:
+                stats.count("candidates_rejected")
+                continue
+            with stats.stage("whim.render"):
+                src = np.asarray(self.qr.make_image(self.qr.render_code(plan.interleave(left)), self.qr.color), dtype=np.uint16)
+                dst = np.asarray(self.qr.make_image(self.qr.render_code(plan.interleave(right)), self.qr.color), dtype=np.uint16)
 
                 mixed = np.asarray((src + dst)//2, dtype=np.uint8)
                 middle = Image.fromarray(mixed)
 
-                ret[candidate] = middle
+            ret[candidate] = middle
+            stats.count("hits")
         return ret
 
-
-        part = self.data.split(".")
-        for i in range(len(part[0])):
-            for c in character:
-                if part[0][i] == c: continue
-                candidate = part[0][:i] + c + part[0][i+1:]
-                candidate = ".".join([candidate] + part[1:])
-                cand_qr = QR(candidate, self.version, self.error_correction)
-                if self.diff(self.qr.processed_code, cand_qr.processed_code) == self.possible_error[0] * 2 + 1:
-                    left, right, index = self.mix(self.qr.processed_code, cand_qr.processed_code, self.possible_error[0])
-                    if index == -1: continue
-                    cand_qr.processed_code = left
-                    cand_qr.matrix = cand_qr.make_matrix(Bitarray(cand_qr.processed_code).array)
-                    cand_qr.masked_matrix = cand_qr.mask(cand_qr.mask_pattern)
-                    cand_qr.image = cand_qr.make_image(cand_qr.masked_matrix, cand_qr.color)
-                    src = np.asarray(cand_qr.image, dtype=np.uint16)
-
-                    cand_qr.processed_code = right 
-                    cand_qr.matrix = cand_qr.make_matrix(Bitarray(cand_qr.processed_code).array)
-                    cand_qr.masked_matrix = cand_qr.mask(cand_qr.mask_pattern)
-                    cand_qr.image = cand_qr.make_image(cand_qr.masked_matrix, cand_qr.color)
-                    dst = np.asarray(cand_qr.image, dtype=np.uint16)
-
-                    mixed = np.asarray((src + dst)//2, dtype=np.uint8)
-                    middle = Image.fromarray(mixed)
-
-                    ret[candidate] = middle
-        return ret
+    def block_code(self, data):
+        """dataのブロック順のコード語列(データ語 + 誤り訂正語)。cacheがあればcacheから取得する"""
+        if self.cache is not None:
+            return self.cache.code(data, self.version, self.error_correction)
+        builder = QRBuilder.pooled(self.version, self.error_correction)
+        builder.encode_data_code(data.encode("utf-8"))
+        builder.encode_error_code()
+        return builder.code.copy()
 
     @classmethod
-    def diff(cls, code1, code2):
-        count = 0
-        for c1, c2 in zip(code1, code2):
-            if c1 != c2:
-                count += 1
-        return count
+    def diff(cls, code1, code2, plan):
+        """
+        ブロック順のコード語列のブロックごとに、異なるコード語の数を返す。
+
+        code2が(N, 語数)の場合は、N個の候補をまとめて比べて(N, ブロック数)を返す。
+        """
+        differing = np.asarray(code1) != np.asarray(code2)
+        rows = differing.reshape(-1, differing.shape[-1])
+        # count (row, block) pairs of the differing codewords in one pass
+        ids = np.arange(len(rows))[:, None] * plan.block_num + plan.block_index
+        counts = np.bincount(ids[rows], minlength=len(rows) * plan.block_num)
+        return counts.reshape(differing.shape[:-1] + (plan.block_num,))
 
     @classmethod
-    def mix(cls, code1, code2, possible_error):
-        count = 0
-        index = -1
-        left = []
-        right = []
-        for i, (c1, c2) in enumerate(zip(code1, code2)):
-            if c1 != c2:
-                if index == -1 and bin(c1 ^ c2).count('1') == 1:
-                    index = i
-                    left.append(c1)
-                    right.append(c2)
-                    continue
-                if count < possible_error:
-                    left.append(c1)
-                    right.append(c1)
-                else:
-                    left.append(c2)
-                    right.append(c2)
-                count += 1
-            else:
-                left.append(c1)
-                right.append(c1)
-        return left, right, index 
-                
+    def mix(cls, code1, code2, possible_error, plan):
+        """
+        一つのブロックだけが異なるブロック順のコード語列から、code1とcode2に読み分けられる組を作る。
+
+        そのブロックで1bitだけ異なる最初のコード語を読み分けに使い(leftはcode1、rightはcode2の値)、
+        残りの異なるコード語は先頭からpossible_error[ブロック]語をcode1の値、それ以外をcode2の値にする。
+
+        Returns
+        --------
+        left, right : ndarray
+            ブロック順のコード語列
+        index : int
+            読み分けに使うコード語の位置(ブロック順)。作れない場合は-1
+        """
+        code1, code2 = np.asarray(code1), np.asarray(code2)
+        left, right = code1.copy(), code1.copy()
+        differing = np.flatnonzero(code1 != code2)
+        blocks = np.unique(plan.block_index[differing])
+        single = differing[BIT_TABLE[code1[differing] ^ code2[differing]].sum(axis=1) == 1]
+        if len(blocks) != 1 or len(single) == 0:
+            return left, right, -1
+
+        index = int(single[0])
+        rest = differing[differing != index][possible_error[blocks[0]]:]
+        left[rest] = right[rest] = code2[rest]
+        right[index] = code2[index]
+        return left, right, index
+
+
 def main():
-    data = sys.argv[1]
-    index = int(sys.argv[2])
+    parser = argparse.ArgumentParser(prog="whimq")
+    parser.add_argument("data")
+    parser.add_argument("index", type=int)
+    parser.add_argument("--version", type=parse_version, default="auto")
+    parser.add_argument("--cache-dir", help="directory to keep generated symbols in")
+    parser.add_argument("--profile", action="store_true", help="print stage timings and counters to stderr")
+    parser.add_argument("--profile-file", help="also write cProfile stats to this file")
+    parser.add_argument("--preview", action="store_true", help="draw each option in the terminal")
+    parser.add_argument("--terminal", action="store_true",
+                        help="draw the selected QR code in the terminal instead of an image viewer (default without a display)")
+    parser.add_argument("--output-dir", help="save every option as a small-palette PNG in this directory instead of asking")
+    PNGEncoder.add_arguments(parser)
+    args = parser.parse_args()
 
     # Generate Whim
-    whim = Whim(data=data, version=4 ,error_correction=3)
-    ret = whim.search_similar_qr(index)
+    stats = Stats() if args.profile or args.profile_file else None
+    profiler = cProfile.Profile() if args.profile_file else None
+    if profiler is not None:
+        profiler.enable()
+    cache = QRCache(directory=args.cache_dir)
+    whim = Whim(data=args.data, version=args.version, error_correction=3, cache=cache, stats=stats)
+    ret = whim.search_similar_qr(args.index)
+    results = None
+    if args.output_dir:
+        results = PNGEncoder.from_arguments(args, stats).encode_all(list(ret.values()), whim.box_size, whim.border)
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile_file)
+    if stats is not None:
+        stats.add_counters("cache_", cache.stats.as_dict())
+        print(stats.report(), file=sys.stderr)
     print('Option')
     for i, (key, value) in enumerate(ret.items()):
         print('', key)
+        if args.preview:
+            terminal.write(terminal.image_levels(value), border=2)
+    if results is not None:
+        png.save_all(args.output_dir, ["option_%02d.png" % i for i in range(len(results))], results)
+        return
     option = input('Select:')
-    ret[option].resize((300, 300)).show()
+    if args.terminal or headless():
+        terminal.write(terminal.image_levels(ret[option]))
+    else:
+        ret[option].resize((300, 300)).show()
+
+
+def headless():
+    # no image viewer can open without a display on X11/Wayland systems
+    return sys.platform.startswith("linux") and not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
 
 
 if __name__ == "__main__":
@@ -3,11 +3,12 @@ from setuptools import setup
 setup(
     name="misqr",
     version="1.0.0",
-    install_requires=["reedsolo", "pillow", "numpy"],
+    install_requires=["pillow", "numpy"],
     entry_points={
         "console_scripts": [
             "whimq = misqr.whim:main",
             "qash= misqr.qash:main",
+            "misqr-server = misqr.server:main",
         ],
     }
 )
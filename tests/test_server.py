@@ -0,0 +1,81 @@
+import asyncio
+import json
+import unittest
+
+from misqr.server import QRServer
+
+
+async def get(port, target):
+    """targetにGETし、(status, headers, body)を返す(chunkedのbodyはつなげる)"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(("GET %s HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n" % target).encode("latin-1"))
+    await writer.drain()
+    raw = await reader.read()
+    writer.close()
+    await writer.wait_closed()
+
+    head, _, body = raw.partition(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split()[1])
+    headers = {name.lower(): value for name, _, value in (line.partition(": ") for line in lines[1:])}
+    if headers.get("transfer-encoding") == "chunked":
+        chunks = []
+        while True:
+            size, _, body = body.partition(b"\r\n")
+            n = int(size, 16)
+            if n == 0:
+                break
+            chunks.append(body[:n])
+            body = body[n + 2:]
+        body = b"".join(chunks)
+    return status, headers, body
+
+
+class TestRoutes(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        # workers=0 runs the jobs in a thread instead of a process pool
+        self.server = QRServer(workers=0)
+        await self.server.start("127.0.0.1", 0)
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    async def get(self, target):
+        return await get(self.server.port, target)
+
+    async def test_qr_png(self):
+        status, headers, body = await self.get("/qr?data=hello&level=Q")
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["content-type"], "image/png")
+        self.assertTrue(body.startswith(b"\x89PNG\r\n\x1a\n"))
+
+    async def test_qr_svg(self):
+        status, headers, body = await self.get("/qr?data=hello&format=svg")
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["content-type"], "image/svg+xml")
+        self.assertTrue(body.startswith(b"<svg"))
+
+    async def test_whim_short_data(self):
+        # the default index -6 does not fit in 3 characters
+        status, _, _ = await self.get("/whim?data=abc")
+        self.assertEqual(status, 400)
+
+    async def test_whim_index_out_of_range(self):
+        status, _, _ = await self.get("/whim?data=abcdefghij&index=10")
+        self.assertEqual(status, 400)
+
+    async def test_unknown_path(self):
+        status, _, _ = await self.get("/nope")
+        self.assertEqual(status, 404)
+
+    async def test_stats(self):
+        await self.get("/qr?data=hello")
+        status, headers, body = await self.get("/stats")
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["content-type"], "application/json")
+        self.assertIsInstance(json.loads(body), dict)
+
+
+if __name__ == "__main__":
+    unittest.main()